@@ -8,6 +8,36 @@ from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_core.messages.utils import get_buffer_string
 import requests 
 load_dotenv()
+
+SUMMARY_TEMPLATE = """
+You are a helpful medical assistant.
+
+Your job is to take the full patient record and create a summary of 7-10 lines in the form of a paragraph.
+
+Rules:
+- Always mention patient's name and age first.
+- If "current_diagnosis" exists → report it clearly.
+- If no disease/diagnosis → write exactly: "Patient has no reported medical conditions."
+- Mention prescribed medications (or "None").
+- Mention recovery plan (procedures, lifestyle, physiotherapy, follow-up).
+- Write Dates in a clear manner like 20th March 2021.
+- Bold the important words and terminologies.
+- Merge other important details (allergies, doctor remarks, warnings) in a simple way.
+- Be concise, clear, and easy to read.
+- At the very end, add a Risk line:
+- If labs/vitals/diagnosis indicate a risk → state it clearly (e.g., "High risk due to uncontrolled diabetes").
+- If nothing serious → write "No immediate risks reported."
+- After that, add a Doctor's Note written in simple words a patient can easily understand. Avoid medical jargon.
+
+You Must Consider All the Fields in the data.
+
+Now create a short summary in the form of a paragraph with 7-10 lines only, then finish with the risk line.
+
+Patient Record JSON:
+{record}
+"""
+
+
 class Patient_Summary_System:
     def __init__(self):
         self.api_key = None
@@ -51,11 +81,14 @@ class Patient_Summary_System:
                 cleaned_checkups = []
                 for checkup in data["checkups"]:
                     try:
-                        # Parse and format numeric values
-                        weight = float(checkup.get("weight", 0)) if checkup.get("weight") else 0
-                        height = float(checkup.get("height", 0)) if checkup.get("height") else 0
-                        heart_rate = int(float(checkup.get("heart_rate", 0))) if checkup.get("heart_rate") else 0
-                        temperature = float(checkup.get("temperature", 0)) if checkup.get("temperature") else 0
+                        # The API sends the vitals parsed into numbers (weight_kg, ...);
+                        # records without them still carry plain numeric text
+                        weight = checkup.get("weight_kg") or (float(checkup["weight"]) if checkup.get("weight") else 0)
+                        height = checkup.get("height_cm") or (float(checkup["height"]) if checkup.get("height") else 0)
+                        heart_rate = checkup.get("heart_rate_bpm") or (int(float(checkup["heart_rate"])) if checkup.get("heart_rate") else 0)
+                        temperature_c = checkup.get("temperature_c")
+                        temperature = float(checkup.get("temperature", 0)) if checkup.get("temperature") and not temperature_c else 0
+                        bmi = checkup.get("bmi_value") or checkup.get("bmi")
                         
                         cleaned_checkup = {
                             "date_of_checkup": checkup.get("date_of_checkup", "Not specified"),
@@ -64,10 +97,10 @@ class Patient_Summary_System:
                             "vital_signs": {
                                 "blood_pressure": checkup.get("blood_pressure", "Not recorded"),
                                 "heart_rate": f"{heart_rate} bpm" if heart_rate > 0 else "Not recorded",
-                                "temperature": f"{temperature}°F" if temperature > 0 else "Not recorded",
+                                "temperature": f"{temperature_c}°C" if temperature_c else f"{temperature}°F" if temperature > 0 else "Not recorded",
                                 "weight": f"{weight} kg" if weight > 0 else "Not recorded",
                                 "height": f"{height} cm" if height > 0 else "Not recorded",
-                                "bmi": f"{checkup.get('bmi', 'N/A')}" if checkup.get('bmi') else "Not calculated"
+                                "bmi": f"{bmi}" if bmi else "Not calculated"
                             },
                             "physical_exam_findings": checkup.get("physical_exam_findings", "Normal").strip() or "Normal"
                         }
@@ -115,41 +148,11 @@ class Patient_Summary_System:
         if not self.api_key:
             raise ValueError("⚠️ No API key found. Please set GOOGLE_API_KEY environment variable and restart.")
         
-    def generate_summary(self,url):
-        self.get_patient_data(url=url)
-        self.load_api_key()
-
-        template_str = """
-        You are a helpful medical assistant.
-
-        Your job is to take the full patient record and create a summary of 7-10 lines in the form of a paragraph.
-
-        Rules:
-        - Always mention patient's name and age first.
-        - If "current_diagnosis" exists → report it clearly.
-        - If no disease/diagnosis → write exactly: "Patient has no reported medical conditions."
-        - Mention prescribed medications (or "None").
-        - Mention recovery plan (procedures, lifestyle, physiotherapy, follow-up).
-        - Write Dates in a clear manner like 20th March 2021.
-        - Bold the important words and terminologies.
-        - Merge other important details (allergies, doctor remarks, warnings) in a simple way.
-        - Be concise, clear, and easy to read.
-        - At the very end, add a Risk line:
-        - If labs/vitals/diagnosis indicate a risk → state it clearly (e.g., "High risk due to uncontrolled diabetes").
-        - If nothing serious → write "No immediate risks reported."
-        - After that, add a Doctor's Note written in simple words a patient can easily understand. Avoid medical jargon.
-
-        You Must Consider All the Fields in the data.
-
-        Now create a short summary in the form of a paragraph with 7-10 lines only, then finish with the risk line.
-
-        Patient Record JSON:
-        {record}
-        """
-
+    def _summary_chain(self):
+        """Prompt -> Gemini chain used for the record summaries"""
         prompt = PromptTemplate(
             input_variables=["record"],
-            template=template_str
+            template=SUMMARY_TEMPLATE
         )
 
         # Initialize Gemini model
@@ -160,7 +163,12 @@ class Patient_Summary_System:
         )
 
         # Create RunnableSequence chain
-        chain = RunnableSequence(prompt | llm)
+        return RunnableSequence(prompt | llm)
+
+    def generate_summary(self,url):
+        self.get_patient_data(url=url)
+        self.load_api_key()
+        chain = self._summary_chain()
 
         # Convert dict to JSON string
         json_input_str = json.dumps(self.data, indent=2)
@@ -179,46 +187,7 @@ class Patient_Summary_System:
         self.data = record or {}
         self.load_api_key()
 
-        template_str = """
-        You are a helpful medical assistant.
-
-        Your job is to take the full patient record and create a summary of 7-10 lines in the form of a paragraph.
-
-        Rules:
-        - Always mention patient's name and age first.
-        - If "current_diagnosis" exists → report it clearly.
-        - If no disease/diagnosis → write exactly: "Patient has no reported medical conditions."
-        - Mention prescribed medications (or "None").
-        - Mention recovery plan (procedures, lifestyle, physiotherapy, follow-up).
-        - Write Dates in a clear manner like 20th March 2021.
-        - Bold the important words and terminologies.
-        - Merge other important details (allergies, doctor remarks, warnings) in a simple way.
-        - Be concise, clear, and easy to read.
-        - At the very end, add a Risk line:
-        - If labs/vitals/diagnosis indicate a risk → state it clearly (e.g., "High risk due to uncontrolled diabetes").
-        - If nothing serious → write "No immediate risks reported."
-        - After that, add a Doctor's Note written in simple words a patient can easily understand. Avoid medical jargon.
-
-        You Must Consider All the Fields in the data.
-
-        Now create a short summary in the form of a paragraph with 7-10 lines only, then finish with the risk line.
-
-        Patient Record JSON:
-        {record}
-        """
-
-        prompt = PromptTemplate(
-            input_variables=["record"],
-            template=template_str
-        )
-
-        llm = ChatGoogleGenerativeAI(
-            model="gemini-2.5-flash-lite",
-            google_api_key=self.api_key,
-            temperature=0.7
-        )
-
-        chain = RunnableSequence(prompt | llm)
+        chain = self._summary_chain()
         json_input_str = json.dumps(self.data, indent=2)
         if self.data != {}:
             raw_summary = chain.invoke({"record": json_input_str})
@@ -10,6 +10,8 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
+from importlib.util import find_spec
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -44,6 +46,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # First, so the queries of every other middleware are counted too
+    'patients.querybudget.QueryBudgetMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -80,11 +84,161 @@ CORS_ALLOWED_ORIGINS = ["http://localhost:8080", "http://localhost:8000"]
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
+# 'replica' is a read-only snapshot of db.sqlite3 made by
+# `python manage.py refresh_replica`. Views marked read-only read from
+# READ_REPLICA (patients/replica.py), off unless the PATIENTS_READ_REPLICA
+# environment variable names the alias: the snapshot is only as fresh as its
+# last refresh. Point it at a real replica server in production.
+
+REPLICA_DB_PATH = BASE_DIR / 'db.replica.sqlite3'
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+    },
+    'replica': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': f'file:{REPLICA_DB_PATH}?mode=ro',
+        'TEST': {'MIRROR': 'default'},
+    },
+}
+
+# Patients are spread over the aliases in SHARDS (patients/sharding.py), with
+# the shard directory, change log and table versions in 'default'. A single
+# shard turns sharding off. To use shard_1: `python manage.py migrate
+# --database=shard_1`, add it to SHARDS, then `python manage.py
+# rebalance_shards --even`.
+
+SHARD_DATABASES = {
+    'shard_1': BASE_DIR / 'db.shard1.sqlite3',
+}
+for alias, path in SHARD_DATABASES.items():
+    DATABASES[alias] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': path,
     }
+
+SHARDS = ['default']
+
+DATABASE_ROUTERS = ['patients.sharding.ShardRouter', 'patients.replica.ReplicaRouter']
+READ_REPLICA = os.environ.get('PATIENTS_READ_REPLICA') or None
+
+
+# Caches
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+# patient_records holds the materialized complete patient documents
+# (patients/cache.py). Switch it to a shared backend such as
+# 'django.core.cache.backends.filebased.FileBasedCache' when running more
+# than one server process, so invalidations reach every process.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'patient_records': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'patient-records',
+        'OPTIONS': {'MAX_ENTRIES': 20000},
+    },
+    'fragments': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'fragments',
+        'OPTIONS': {'MAX_ENTRIES': 50000},
+    },
+}
+
+PATIENT_RECORD_CACHE = 'patient_records'
+PATIENT_RECORD_CACHE_TIMEOUT = 60 * 60 * 24
+
+# Rendered rows of the patient list and sections of the patient page; their
+# keys hold the patient version, so edits never serve an old fragment
+FRAGMENT_CACHE = 'fragments'
+FRAGMENT_CACHE_TIMEOUT = 60 * 60 * 24
+
+# Cohort analytics results (patients/analytics.py) are recomputed after this
+# many seconds; `manage.py cohort_analytics` refreshes them on demand
+ANALYTICS_CACHE = 'default'
+ANALYTICS_CACHE_TIMEOUT = 60 * 15
+
+
+# Deleted patients are hidden at once and their rows removed by a background
+# thread (patients/purge.py), PURGE_BATCH_SIZE rows per transaction with
+# PURGE_PAUSE seconds between transactions; `manage.py purge_deleted_patients`
+# finishes interrupted purges
+
+PURGE_IN_BACKGROUND = True
+PURGE_BATCH_SIZE = 500
+PURGE_PAUSE = 0.05
+
+
+# Checkups, lab tests and notes older than this many days are moved to the
+# patients' compressed archives by `manage.py archive_records`
+# (patients/archive.py) and only read with ?include_archived=1
+
+ARCHIVE_AFTER_DAYS = 3 * 365
+
+
+# Gemini clients per model kept by the summary engine (patients/summaries.py),
+# created on the first AI summary and shared by every request of the process
+
+SUMMARY_CLIENT_POOL_SIZE = 4
+
+
+# Query budgets (patients/querybudget.py)
+# Most SQL queries a request to each URL name may run, for every method or per
+# method. Requests over budget log a warning; the test runner turns them into
+# failures. Writes scale with the submitted rows and have no budget. Views that
+# read every shard give (fixed, per shard) pairs.
+
+QUERY_BUDGETS = {
+    'patient-list-create': {'GET': (1, 1)},
+    'patient-detail': {'GET': 8},
+    'patient-vitals': 3,
+    'patient-search': (0, 3),
+    'followup-schedule': (0, 1),
+    'patient-purge-status': 1,
+    'changes-feed': 1,
+    'record-cache-stats': 0,
+    'patient_list': (0, 1),
+    'patient_detail': 7,
+    'edit_complete_patient_form': {'GET': 6},
+}
+QUERY_BUDGET_STRICT = False
+TEST_RUNNER = 'patients.querybudget.QueryBudgetTestRunner'
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        # One line per request with its query count and SQL time
+        'patients.querybudget': {'handlers': ['console'], 'level': 'INFO'},
+    },
+}
+
+
+# Django REST framework
+# JSON goes through orjson when it is installed (patients/renderers.py).
+# MessagePack (Accept / Content-Type: application/msgpack) is offered when the
+# msgpack package is installed.
+
+MSGPACK_ENABLED = find_spec('msgpack') is not None
+
+REST_FRAMEWORK = {
+    'DEFAULT_RENDERER_CLASSES': [
+        'patients.renderers.ORJSONRenderer',
+        *(['patients.renderers.MessagePackRenderer'] if MSGPACK_ENABLED else []),
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'patients.renderers.ORJSONParser',
+        *(['patients.renderers.MessagePackParser'] if MSGPACK_ENABLED else []),
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
 }
 
 
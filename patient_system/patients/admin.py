@@ -1,4 +1,6 @@
 from django.contrib import admin
+from django.db.models import Q
+from . import search
 from .models import (
     Patient,
     MedicalHistory,
@@ -11,35 +13,50 @@ from .models import (
 
 @admin.register(Patient)
 class PatientAdmin(admin.ModelAdmin):
-    list_display = ("id", "patient_name", "guardian_name",  "age", "gender", "date_of_birth","phone_number", "email_address", "address")
+    list_display = ("id", "patient_name", "guardian_name",  "age", "gender", "date_of_birth","phone_number", "email_address", "address", "checkups_count", "last_checkup_date", "deleted_at")
     search_fields = ("patient_name", "phone_number", "email_address")
     list_filter = ("gender", "date_of_birth")
 
 
+class FullTextSearchMixin:
+    """
+    Admin search through the full-text index (patients/search.py) instead of
+    icontains scans over the text columns; patient names are still matched.
+    """
+
+    def get_search_results(self, request, queryset, search_term):
+        match = search.match_query(search_term)
+        if match is None or not search.is_enabled():
+            return super().get_search_results(request, queryset, search_term)
+        named_patients = Patient.objects.filter(patient_name__icontains=search_term.strip()).values('pk')
+        return queryset.filter(Q(pk__in=search.object_ids(self.model, match)) | Q(patient__in=named_patients)), False
+
+
 @admin.register(MedicalHistory)
-class MedicalHistoryAdmin(admin.ModelAdmin):
+class MedicalHistoryAdmin(FullTextSearchMixin, admin.ModelAdmin):
     list_display = ("id", "patient", "past_conditions", "family_history", "previous_surgeries", "allergies")
     search_fields = ("patient__patient_name", "past_conditions", "family_history", "previous_surgeries", "allergies")
 
 
 @admin.register(CheckUp)
-class CheckUpAdmin(admin.ModelAdmin):
+class CheckUpAdmin(FullTextSearchMixin, admin.ModelAdmin):
     list_display = ("id", "patient", "symptoms", "current_diagnosis","date_of_checkup", "blood_pressure", "heart_rate", "temperature")
+    readonly_fields = CheckUp.DERIVED_FIELDS
     search_fields = ("patient__patient_name", "symptoms", "current_diagnosis", "date_of_checkup")
 
 
 @admin.register(LabTests)
-class LabTestAdmin(admin.ModelAdmin):
+class LabTestAdmin(FullTextSearchMixin, admin.ModelAdmin):
     list_display = ("id", "patient", "lab_results", "imaging", "other_tests")
     search_fields = ("patient__patient_name", "lab_results", "imaging", "other_tests")
 
 
 @admin.register(TreatmentPlan)
-class TreatmentPlanAdmin(admin.ModelAdmin):
+class TreatmentPlanAdmin(FullTextSearchMixin, admin.ModelAdmin):
     list_display = ("id", "patient", "checkup" ,"related_disease","assigned_doctor",  "prescribed_medications", "procedures","next_followup_date" ,"lifestyle_recommendations", "physiotherapy_advice")
     search_fields = ("patient__patient_name", "checkup__date_of_checkup" "prescribed_medications", "procedures", "next_followup_date", "assigned_doctor")
 
 @admin.register(AdditionalNote)
-class AdditionalNoteAdmin(admin.ModelAdmin):
+class AdditionalNoteAdmin(FullTextSearchMixin, admin.ModelAdmin):
     list_display = ("id", "patient", "doctor_remarks", "special_warnings")
     search_fields = ("patient__patient_name", "doctor_remarks", "special_warnings")
@@ -0,0 +1,236 @@
+"""
+Cohort analytics over vitals and demographics
+
+Aggregates every checkup (optionally within a checkup date range) into:
+
+- BMI distribution: histogram overall and by gender, WHO categories, mean
+- Blood pressure percentiles by age band and gender
+- Most frequent diagnoses
+
+Statistics are over checkups, i.e. readings, not patients. Checkups are read
+in id ranges of CHUNK_SIZE rows straight into NumPy arrays and folded into
+fixed-size count arrays, so memory depends on the number of patients and
+distinct diagnoses, never on the number of checkups. Blood pressures are
+whole mmHg values (patients/vitals.py), so percentiles read from per-mmHg
+counts are exact. With several shards (patients/sharding.py) the checkups of
+every shard are folded into the same arrays; patient ids are unique across
+shards.
+
+Results are cached in settings.ANALYTICS_CACHE for
+settings.ANALYTICS_CACHE_TIMEOUT seconds; the cohort_analytics management
+command recomputes and stores them.
+"""
+import re
+from collections import Counter
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import caches
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from . import sharding
+from .models import CheckUp, Patient
+from .vitals import LIMITS
+
+
+CHUNK_SIZE = 50000
+DEFAULT_TIMEOUT = 60 * 15
+DEFAULT_TOP = 20
+MAX_TOP = 200
+
+GENDERS = ('Male', 'Female', 'Other')
+# Lower bound of every age band but the first
+AGE_BAND_EDGES = np.array([18, 40, 60, 80])
+AGE_BANDS = ('0-17', '18-39', '40-59', '60-79', '80+')
+PERCENTILES = (10, 25, 50, 75, 90)
+
+# 2.5 kg/m² bins from 10 to 60, values outside fall in the first or last bin
+BMI_EDGES = np.arange(10, 62.5, 2.5)
+BMI_CATEGORIES = (('underweight', 18.5), ('normal', 25.0), ('overweight', 30.0), ('obese', None))
+
+# One bin per whole mmHg
+PRESSURE_BINS = LIMITS['systolic_bp'][1] + 1
+
+_DIAGNOSIS_SEPARATORS = re.compile(r'[,;\n]+')
+
+
+def parse_params(params):
+    """
+    Read from, to and top from query parameters.
+    Raises ValueError with a readable message on bad input.
+    """
+    dates = {}
+    for key in ('from', 'to'):
+        raw = params.get(key)
+        try:
+            dates[key] = parse_date(raw) if raw else None
+        except ValueError:
+            dates[key] = None
+        if raw and dates[key] is None:
+            raise ValueError(f"'{key}' must be a date (YYYY-MM-DD).")
+
+    try:
+        top = int(params.get('top') or DEFAULT_TOP)
+    except ValueError:
+        raise ValueError("'top' must be an integer.")
+    if not 1 <= top <= MAX_TOP:
+        raise ValueError(f"'top' must be between 1 and {MAX_TOP}.")
+    return dates['from'], dates['to'], top
+
+
+def get_cache():
+    return caches[getattr(settings, 'ANALYTICS_CACHE', 'default')]
+
+
+def _chunks(queryset, columns, chunk_size):
+    """(ids, *columns) of `queryset` rows as tuples, `chunk_size` rows at a time in id order"""
+    last_id = 0
+    while True:
+        rows = list(queryset.filter(pk__gt=last_id).order_by('pk').values_list('pk', *columns)[:chunk_size])
+        if not rows:
+            return
+        last_id = rows[-1][0]
+        yield list(zip(*rows))
+
+
+def _demographics(chunk_size):
+    """Age band and gender code of every patient, as arrays indexed by patient id (-1 when unknown)"""
+    last_id = max(sharding.fan_out(lambda: Patient.objects.order_by('-pk').values_list('pk', flat=True).first() or 0))
+    bands = np.full(last_id + 1, -1, dtype=np.int8)
+    genders = np.full(last_id + 1, -1, dtype=np.int8)
+    codes = {gender: code for code, gender in enumerate(GENDERS)}
+    for _ in sharding.each_shard():
+        for ids, ages, gender_names in _chunks(Patient.objects.all(), ('age', 'gender'), chunk_size):
+            ids = np.array(ids)
+            bands[ids] = np.searchsorted(AGE_BAND_EDGES, np.array(ages), side='right')
+            genders[ids] = [codes.get(name, -1) for name in gender_names]
+    return bands, genders
+
+
+def _percentiles(counts):
+    """Nearest-rank percentiles of every row of per-value counts"""
+    totals = counts.sum(axis=1)
+    cumulative = counts.cumsum(axis=1)
+    return {
+        p: np.argmax(cumulative >= np.maximum(np.ceil(totals * p / 100), 1)[:, None], axis=1)
+        for p in PERCENTILES
+    }
+
+
+def compute(start=None, end=None, top=DEFAULT_TOP, chunk_size=CHUNK_SIZE):
+    """Cohort statistics of the checkups dated between `start` and `end` (all checkups by default)"""
+    bands, genders = _demographics(chunk_size)
+    groups = len(AGE_BANDS) * len(GENDERS)
+
+    bmi_counts = np.zeros((len(GENDERS) + 1, len(BMI_EDGES) - 1), dtype=np.int64)
+    bmi_categories = np.zeros(len(BMI_CATEGORIES), dtype=np.int64)
+    bmi_sum = 0.0
+    systolic_counts = np.zeros((groups, PRESSURE_BINS), dtype=np.int64)
+    diastolic_counts = np.zeros((groups, PRESSURE_BINS), dtype=np.int64)
+    diagnoses = Counter()
+    checkups = diagnosed = 0
+
+    queryset = CheckUp.objects.all()
+    if start:
+        queryset = queryset.filter(date_of_checkup__gte=start)
+    if end:
+        queryset = queryset.filter(date_of_checkup__lte=end)
+    columns = ('patient_id', 'bmi_value', 'systolic_bp', 'diastolic_bp', 'current_diagnosis')
+
+    chunks = (chunk for _ in sharding.each_shard() for chunk in _chunks(queryset, columns, chunk_size))
+    for _, patient_ids, bmi, systolic, diastolic, diagnosis_texts in chunks:
+        patient_ids = np.array(patient_ids)
+        # Skip checkups of patients without demographics: deleted ones not purged yet
+        known = patient_ids < len(bands)
+        known[known] = bands[patient_ids[known]] >= 0
+        patient_ids = patient_ids[known]
+        bmi, systolic, diastolic = (np.array(values, dtype=float)[known] for values in (bmi, systolic, diastolic))
+        diagnosis_texts = [text for text, keep in zip(diagnosis_texts, known) if keep]
+        checkups += len(patient_ids)
+        gender = genders[patient_ids].astype(np.int64)
+        group = np.where(gender >= 0, bands[patient_ids].astype(np.int64) * len(GENDERS) + gender, -1)
+
+        measured = ~np.isnan(bmi)
+        bins = np.clip(np.searchsorted(BMI_EDGES, bmi[measured], side='right') - 1, 0, len(BMI_EDGES) - 2)
+        # Row 0 counts everyone, rows 1.. count each gender
+        bmi_counts[0] += np.bincount(bins, minlength=bmi_counts.shape[1])
+        by_gender = gender[measured] >= 0
+        bmi_counts[1:] += np.bincount(
+            gender[measured][by_gender] * bmi_counts.shape[1] + bins[by_gender], minlength=bmi_counts[1:].size
+        ).reshape(len(GENDERS), -1)
+        thresholds = [limit for _, limit in BMI_CATEGORIES if limit is not None]
+        bmi_categories += np.bincount(np.searchsorted(thresholds, bmi[measured], side='right'),
+                                      minlength=len(BMI_CATEGORIES))
+        bmi_sum += bmi[measured].sum()
+
+        for values, counts in ((systolic, systolic_counts), (diastolic, diastolic_counts)):
+            keep = ~np.isnan(values) & (group >= 0)
+            pressures = np.clip(values[keep].astype(np.int64), 0, PRESSURE_BINS - 1)
+            counts += np.bincount(group[keep] * PRESSURE_BINS + pressures, minlength=counts.size).reshape(counts.shape)
+
+        for text in diagnosis_texts:
+            names = {name.strip().lower() for name in _DIAGNOSIS_SEPARATORS.split(text or '') if name.strip()}
+            if names:
+                diagnosed += 1
+                diagnoses.update(names)
+
+    measured_bmi = int(bmi_counts[0].sum())
+    blood_pressure = []
+    systolic_percentiles = _percentiles(systolic_counts)
+    diastolic_percentiles = _percentiles(diastolic_counts)
+    for group in range(groups):
+        count = int(systolic_counts[group].sum())
+        if not count:
+            continue
+        band, gender = divmod(group, len(GENDERS))
+        blood_pressure.append({
+            'age_band': AGE_BANDS[band],
+            'gender': GENDERS[gender],
+            'count': count,
+            'systolic': {f'p{p}': int(values[group]) for p, values in systolic_percentiles.items()},
+            'diastolic': {f'p{p}': int(values[group]) for p, values in diastolic_percentiles.items()},
+        })
+
+    return {
+        'generated_at': timezone.now(),
+        'from': start,
+        'to': end,
+        'checkups': checkups,
+        'bmi': {
+            'count': measured_bmi,
+            'mean': round(bmi_sum / measured_bmi, 2) if measured_bmi else None,
+            'edges': BMI_EDGES.tolist(),
+            'histogram': {
+                'all': bmi_counts[0].tolist(),
+                **{gender: bmi_counts[i + 1].tolist() for i, gender in enumerate(GENDERS)},
+            },
+            'categories': {name: int(count) for (name, _), count in zip(BMI_CATEGORIES, bmi_categories)},
+        },
+        'blood_pressure': blood_pressure,
+        'diagnoses': {
+            'checkups_with_diagnosis': diagnosed,
+            'top': [
+                {'diagnosis': name, 'count': count, 'share': round(count / diagnosed, 4)}
+                for name, count in diagnoses.most_common(top)
+            ],
+        },
+    }
+
+
+def _cache_key(start, end, top):
+    return f'cohort-analytics:{start or ""}:{end or ""}:{top}'
+
+
+def store(result, start=None, end=None, top=DEFAULT_TOP):
+    """Cache a compute() result for cohort_analytics()"""
+    get_cache().set(_cache_key(start, end, top), result, getattr(settings, 'ANALYTICS_CACHE_TIMEOUT', DEFAULT_TIMEOUT))
+
+
+def cohort_analytics(start=None, end=None, top=DEFAULT_TOP, refresh=False):
+    """compute(), served from the analytics cache unless `refresh` is set"""
+    result = None if refresh else get_cache().get(_cache_key(start, end, top))
+    if result is None:
+        result = compute(start, end, top)
+        store(result, start, end, top)
+    return result
@@ -4,3 +4,11 @@ from django.apps import AppConfig
 class PatientsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'patients'
+
+    def ready(self):
+        # Connect the change receivers (cache invalidation)
+        from . import signals  # noqa: F401
+
+        # One summary engine per process, shared by the AI views
+        from . import summaries
+        summaries.start_engine()
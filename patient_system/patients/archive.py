@@ -0,0 +1,261 @@
+"""
+Cold storage for old checkups, lab tests and notes
+
+Old checkups, lab results and notes are rarely read again, but they stay in
+the tables every complete record read goes through. archive_patient() moves
+the rows of a patient older than settings.ARCHIVE_AFTER_DAYS out of their
+tables into the patient's PatientArchive: one gzip compressed JSON document
+holding the column values of every archived row.
+
+Two kinds of checkups are never archived: the latest checkup of a patient (it
+gives last_checkup_date and the latest vitals) and checkups that a treatment
+plan points at.
+
+Reads leave archived rows out unless asked for them:
+GET /api/patients/<id>/?include_archived=1 merges them back into the
+complete record, serialized as they were before being archived. Editing or
+deleting an archived row through the update API restores it first, with its
+original id when that id is still free.
+
+Archiving and restoring send 'archive' and 'restore' notifications: the
+change log records the moves, archived rows leave the search index, the
+versions and the record cache follow the tables, and the counters keep
+counting archived rows.
+"""
+import gzip
+import json
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import router
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+
+from . import sharding
+from .fast_serializers import row_serializer
+from .models import CheckUp, LabTests, TreatmentPlan, AdditionalNote, PatientArchive
+from .records import PROVIDED_COLUMNS
+from .serializer import CheckUpSerializer, LabTestsSerializer, AdditionalNoteSerializer
+from .signals import delete_rows, rows_changed, send_rows_changed
+
+
+DEFAULT_ARCHIVE_AFTER_DAYS = 3 * 365
+
+# Section of the complete record -> (model, serializer, PatientArchive count column)
+ARCHIVED_SECTIONS = {
+    'checkups': (CheckUp, CheckUpSerializer, 'checkups_count'),
+    'lab_tests': (LabTests, LabTestsSerializer, 'lab_tests_count'),
+    'notes': (AdditionalNote, AdditionalNoteSerializer, 'notes_count'),
+}
+
+
+def cutoff(days=None):
+    """Rows older than this are archived"""
+    if days is None:
+        days = getattr(settings, 'ARCHIVE_AFTER_DAYS', DEFAULT_ARCHIVE_AFTER_DAYS)
+    return timezone.now() - timedelta(days=days)
+
+
+def archivable(section, before):
+    """Rows of a section that can be archived, for patients that are not deleted"""
+    model = ARCHIVED_SECTIONS[section][0]
+    if model is CheckUp:
+        newer = CheckUp.objects.filter(patient=OuterRef('patient'), date_of_checkup__gt=OuterRef('date_of_checkup'))
+        rows = (
+            CheckUp.objects
+            .filter(Exists(newer), date_of_checkup__lt=before.date())
+            .exclude(Exists(TreatmentPlan.objects.filter(checkup=OuterRef('pk'))))
+        )
+    else:
+        rows = model.objects.filter(created_at__lt=before)
+    return rows.filter(patient__deleted_at__isnull=True)
+
+
+def _columns(model):
+    # values() names: foreign keys come as 'patient' holding the id
+    return [field.name for field in model._meta.concrete_fields]
+
+
+def _encode(sections):
+    return gzip.compress(json.dumps(sections, cls=DjangoJSONEncoder, separators=(',', ':')).encode())
+
+
+def _decode(data):
+    return json.loads(gzip.decompress(bytes(data)))
+
+
+def _typed(model, row):
+    """Archived row with its JSON values turned back into Python values"""
+    return {name: model._meta.get_field(name).to_python(value) for name, value in row.items()}
+
+
+def _save(archive, sections):
+    archive.data = _encode(sections)
+    for section, (_, _, count_field) in ARCHIVED_SECTIONS.items():
+        setattr(archive, count_field, len(sections.get(section, [])))
+    archive.updated_at = timezone.now()
+    archive.save()
+
+
+def archive_patient(patient_id, before):
+    """Move the rows of a patient older than `before` to its archive, returns how many"""
+    moved = 0
+    with sharding.atomic():
+        rows = {
+            section: list(archivable(section, before).filter(patient_id=patient_id).order_by('pk').values(*_columns(model)))
+            for section, (model, _, _) in ARCHIVED_SECTIONS.items()
+        }
+        if not any(rows.values()):
+            return 0
+
+        archive = PatientArchive.objects.filter(patient_id=patient_id).first()
+        if archive is None:
+            archive, sections = PatientArchive(patient_id=patient_id), {}
+        else:
+            sections = _decode(archive.data)
+        for section, section_rows in rows.items():
+            sections.setdefault(section, []).extend(section_rows)
+        _save(archive, sections)
+
+        for section, section_rows in rows.items():
+            if not section_rows:
+                continue
+            model = ARCHIVED_SECTIONS[section][0]
+            ids = [row['id'] for row in section_rows]
+            delete_rows(model, ids)
+            rows_changed.send(sender=model, op='archive', rows=[(pk, patient_id) for pk in ids],
+                              using=router.db_for_write(model))
+            moved += len(ids)
+    return moved
+
+
+def archive_old_records(days=None, report=None):
+    """
+    Archive the old rows of every patient on every shard. `report(patient_id,
+    rows)` is called after each patient. Returns (patients, rows) archived.
+    """
+    before = cutoff(days)
+    patients = rows = 0
+    for _ in sharding.each_shard():
+        patient_ids = set()
+        for section in ARCHIVED_SECTIONS:
+            patient_ids.update(archivable(section, before).order_by().values_list('patient_id', flat=True).distinct())
+        for patient_id in sorted(patient_ids):
+            moved = archive_patient(patient_id, before)
+            if moved:
+                patients += 1
+                rows += moved
+                if report is not None:
+                    report(patient_id, moved)
+    return patients, rows
+
+
+def restore(patient_id, section=None, ids=None):
+    """
+    Move archived rows of a patient back to their tables: every row, those of
+    one `section`, or those of `section` with the given `ids`. Rows keep their
+    id unless another row took it meanwhile. Returns how many were restored.
+    """
+    return sum(len(section_ids) for section_ids in _restore(patient_id, section, ids).values())
+
+
+def _restore(patient_id, section=None, ids=None):
+    """restore(), returning {section: {archived id: id in the table}} of the restored rows"""
+    restored = {}
+    with sharding.atomic():
+        archive = PatientArchive.objects.filter(patient_id=patient_id).first()
+        if archive is None:
+            return 0
+        sections = _decode(archive.data)
+
+        for name, (model, _, _) in ARCHIVED_SECTIONS.items():
+            if section is not None and name != section:
+                continue
+            picked = [row for row in sections.get(name, []) if ids is None or row['id'] in ids]
+            if not picked:
+                continue
+            picked_ids = {row['id'] for row in picked}
+            sections[name] = [row for row in sections[name] if row['id'] not in picked_ids]
+
+            instances = [
+                model(**{model._meta.get_field(key).attname: value for key, value in _typed(model, row).items()})
+                for row in picked
+            ]
+            taken = set(model.objects.filter(pk__in=picked_ids).values_list('pk', flat=True))
+            archived_ids = [instance.pk for instance in instances]
+            for instance in instances:
+                if instance.pk in taken:
+                    instance.pk = None
+            model.objects.bulk_create(instances)
+            send_rows_changed(model, 'restore', instances)
+            restored[name] = dict(zip(archived_ids, [instance.pk for instance in instances]))
+
+        if any(sections.values()):
+            _save(archive, sections)
+        else:
+            archive.delete()
+    return restored
+
+
+def _section_of(model):
+    for section, (section_model, _, _) in ARCHIVED_SECTIONS.items():
+        if section_model is model:
+            return section
+    return None
+
+
+def archived_ids(patient_id, model, ids):
+    """The given ids of `model` rows that are in the archive of a patient"""
+    section = _section_of(model)
+    data = PatientArchive.objects.filter(patient_id=patient_id).values_list('data', flat=True).first()
+    if section is None or data is None:
+        return set()
+    return {row['id'] for row in _decode(data).get(section, [])} & set(ids)
+
+
+def restore_rows(patient_id, model, ids):
+    """
+    Restore the archived `model` rows of a patient with the given ids,
+    returns {archived id: id in the table} of the restored rows
+    """
+    section = _section_of(model)
+    if section is None:
+        return {}
+    return _restore(patient_id, section, set(ids)).get(section, {})
+
+
+def _merge(hot, archived, key, newest_first):
+    rows = hot + archived
+    if rows and all(key in row for row in rows):
+        rows.sort(key=lambda row: (row[key] is not None, row[key] or ''), reverse=newest_first)
+    return rows
+
+
+def with_archived(record, patient_id, selected=None):
+    """
+    Complete record document with the archived rows of the patient merged into
+    its sections, in the order of the sections. `record` is left unchanged.
+    """
+    archive = PatientArchive.objects.filter(patient_id=patient_id).values_list('data', 'patient__patient_name').first()
+    if archive is None:
+        return record
+    data, patient_name = archive
+    sections = _decode(data)
+
+    merged = dict(record)
+    for section, (model, serializer_class, _) in ARCHIVED_SECTIONS.items():
+        if section not in record or not sections.get(section):
+            continue
+        fields = None if selected is None or selected[section] is None else frozenset(selected[section])
+        serializer = row_serializer(serializer_class, fields, PROVIDED_COLUMNS)
+        archived = []
+        for row in sections[section]:
+            row = _typed(model, row)
+            row['patient__patient_name'] = patient_name
+            archived.append(serializer.to_representation(row))
+        if section == 'checkups':
+            merged[section] = _merge(record[section], archived, 'date_of_checkup', True)
+        else:
+            merged[section] = _merge(record[section], archived, 'id', False)
+    return merged
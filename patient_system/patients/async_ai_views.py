@@ -0,0 +1,232 @@
+"""
+Async AI Summary Views for Patient System
+
+Async versions of the endpoints in ai_views.py. Served by an ASGI server
+(patient_system/asgi.py, e.g. `uvicorn patient_system.asgi:application`),
+a request waiting on Gemini awaits the model call instead of holding a worker
+thread, so a handful of processes can keep many summaries in flight. Request
+and response bodies match the sync endpoints.
+
+DRF views are sync only, so these are plain Django async views.
+"""
+import json
+import os
+
+from asgiref.sync import sync_to_async
+from django.http import Http404, JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+from rest_framework import status
+
+from .cache import aget_complete_record_or_404
+from .records import parse_selection, project_record
+from .replica import read_from_replica
+from . import sharding
+from .summaries import (
+    PROMPT_ENGINEERING_PATH, SUPPORTED_EXTENSIONS, FileExtractionError, extract_text_from_file, get_engine,
+)
+
+
+def _request_data(request):
+    """JSON or form body of a request, like DRF's request.data; ValueError unless it is an object"""
+    if request.content_type == 'application/json':
+        data = json.loads(request.body or b'{}')
+        if not isinstance(data, dict):
+            raise ValueError('Expected a JSON object')
+        return data
+    return request.POST
+
+
+@csrf_exempt
+@require_POST
+@read_from_replica
+@sharding.on_patient_shard
+async def generate_ai_summary(request, patient_id):
+    """
+    Generate AI summary for a patient (async)
+    POST /patient-app/api/async/patients/1/summary/
+    ?fields= and ?include= limit what is returned in "data"
+    """
+    try:
+        try:
+            # ?fields= / ?include= choose what is echoed back in 'data'
+            selected = parse_selection(request.GET.get('fields'), request.GET.get('include'))
+        except ValueError as ve:
+            return JsonResponse({
+                'error': 'Invalid field selection',
+                'details': str(ve)
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        # Get complete patient data (cached per patient); the summary always uses all of it
+        complete_data = await aget_complete_record_or_404(patient_id)
+
+        try:
+            summary = await get_engine().asummarize('record', complete_data)
+
+            return JsonResponse({
+                'success': True,
+                'patient_id': patient_id,
+                'patient_name': complete_data['patient']['patient_name'],
+                'summary': summary,
+                'data': project_record(complete_data, selected)
+            }, status=status.HTTP_200_OK)
+
+        except ImportError as ie:
+            return JsonResponse({
+                'error': 'Failed to import AI summary system',
+                'details': str(ie),
+                'note': 'Make sure prompt_template.py is in the correct location',
+                'path_tried': PROMPT_ENGINEERING_PATH
+            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+        except ValueError as ve:
+            # API key not found
+            return JsonResponse({
+                'error': 'AI API key not found',
+                'details': str(ve),
+                'note': 'Please set GOOGLE_API_KEY environment variable in .env file'
+            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+        except Exception as ai_error:
+            return JsonResponse({
+                'error': 'Failed to generate AI summary',
+                'details': str(ai_error),
+                'patient_data': project_record(complete_data, selected)
+            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    except Http404:
+        raise
+    except Exception as e:
+        return JsonResponse({
+            'error': 'Failed to process request',
+            'details': str(e)
+        }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+@csrf_exempt
+@require_POST
+async def generate_summary_from_text(request):
+    """
+    Generate AI summary from raw text input (async)
+    POST /patient-app/api/async/summary/text/ with {"text": "..."}
+    """
+    try:
+        try:
+            data = _request_data(request)
+        except ValueError as ve:
+            return JsonResponse({
+                'error': 'Invalid JSON',
+                'details': str(ve)
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        text_input = (data.get('text') or '').strip()
+
+        if not text_input:
+            return JsonResponse({
+                'error': 'No text provided',
+                'details': 'Please provide medical report text in the "text" field'
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            summary = await get_engine().asummarize('text', text_input)
+
+            return JsonResponse({
+                'success': True,
+                'summary': summary,
+                'input_length': len(text_input),
+                'source': 'text_input'
+            }, status=status.HTTP_200_OK)
+
+        except ValueError as ve:
+            return JsonResponse({
+                'error': 'AI API key not found',
+                'details': str(ve),
+                'note': 'Please set GOOGLE_API_KEY environment variable in .env file'
+            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+        except Exception as ai_error:
+            return JsonResponse({
+                'error': 'Failed to generate AI summary',
+                'details': str(ai_error)
+            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    except Exception as e:
+        return JsonResponse({
+            'error': 'Failed to process request',
+            'details': str(e)
+        }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+@csrf_exempt
+@require_POST
+async def generate_summary_from_file(request):
+    """
+    Generate AI summary from uploaded medical report file (async)
+    POST /patient-app/api/async/summary/file/ as multipart/form-data with a 'file' field
+
+    OCR and PDF parsing run in a worker thread so they do not block the event loop.
+    """
+    try:
+        uploaded_file = request.FILES.get('file')
+
+        if not uploaded_file:
+            return JsonResponse({
+                'error': 'No file uploaded',
+                'details': 'Please upload a medical report file'
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        # Get file info
+        filename = uploaded_file.name
+        file_size = uploaded_file.size
+        file_extension = os.path.splitext(filename)[1].lower()
+
+        if file_extension not in SUPPORTED_EXTENSIONS:
+            return JsonResponse({
+                'error': 'Unsupported file type',
+                'details': f'Supported formats: {", ".join(SUPPORTED_EXTENSIONS)}',
+                'uploaded_extension': file_extension
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        # Read file content
+        try:
+            extracted_text = await sync_to_async(extract_text_from_file, thread_sensitive=False)(uploaded_file)
+        except FileExtractionError as fe:
+            return JsonResponse(fe.payload, status=fe.status_code)
+
+        if not extracted_text.strip():
+            return JsonResponse({
+                'error': 'No text extracted from file',
+                'details': 'The file appears to be empty or unreadable',
+                'filename': filename
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            summary = await get_engine().asummarize('file', extracted_text)
+
+            return JsonResponse({
+                'success': True,
+                'summary': summary,
+                'filename': filename,
+                'file_size': file_size,
+                'extracted_text': extracted_text[:500] + '...' if len(extracted_text) > 500 else extracted_text,
+                'source': 'file_upload'
+            }, status=status.HTTP_200_OK)
+
+        except ValueError as ve:
+            return JsonResponse({
+                'error': 'AI API key not found',
+                'details': str(ve),
+                'note': 'Please set GOOGLE_API_KEY environment variable in .env file'
+            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+        except Exception as ai_error:
+            return JsonResponse({
+                'error': 'Failed to generate AI summary',
+                'details': str(ai_error)
+            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    except Exception as e:
+        return JsonResponse({
+            'error': 'Failed to process request',
+            'details': str(e)
+        }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
@@ -0,0 +1,263 @@
+"""
+Bulk import of complete patient records
+
+Validates an array of complete patient payloads (the same shape accepted by
+POST /api/patients/) in list form and writes every table with bulk_create,
+one transaction per chunk of records and shard (patients/sharding.py).
+Records that fail validation or hit a database constraint are reported back
+instead of aborting the batch.
+"""
+from django.db import IntegrityError
+from django.db.models import Q
+
+from . import sharding
+from .models import Patient, MedicalHistory, CheckUp, LabTests, TreatmentPlan, AdditionalNote
+from .serializer import (
+    BulkPatientSerializer,
+    BulkMedicalHistorySerializer,
+    BulkCheckUpSerializer,
+    BulkLabTestsSerializer,
+    BulkTreatmentPlanSerializer,
+    BulkAdditionalNoteSerializer,
+)
+from .signals import send_rows_changed
+
+
+DEFAULT_CHUNK_SIZE = 500
+
+# Payload key -> (model, serializer) for the list sections of a record
+LIST_SECTIONS = {
+    'checkups': (CheckUp, BulkCheckUpSerializer),
+    'lab_tests': (LabTests, BulkLabTestsSerializer),
+    'treatments': (TreatmentPlan, BulkTreatmentPlanSerializer),
+    'notes': (AdditionalNote, BulkAdditionalNoteSerializer),
+}
+
+
+def _as_list(value):
+    """Sections may be sent as a single object or a list, skip empty items"""
+    if not value:
+        return []
+    if not isinstance(value, list):
+        value = [value]
+    return [item for item in value if item]
+
+
+def _normalize(record):
+    """Split one complete patient payload into its sections"""
+    if not isinstance(record, dict):
+        return None
+    normalized = {
+        'patient': record.get('patient') or {},
+        'medical_history': record.get('medical_history') or None,
+    }
+    for section in LIST_SECTIONS:
+        normalized[section] = _as_list(record.get(section))
+    return normalized
+
+
+class _ValidatedRecord:
+    """Validated data of one payload, kept with its position in the request"""
+
+    def __init__(self, index):
+        self.index = index
+        self.patient = None
+        self.medical_history = None
+        self.sections = {section: [] for section in LIST_SECTIONS}
+        self.errors = {}
+
+
+def _validate_chunk(chunk):
+    """
+    Validate a chunk of (index, payload) pairs.
+    Every section is validated with one list serializer across the chunk.
+    """
+    records = []
+    normalized = []
+    for index, payload in chunk:
+        record = _ValidatedRecord(index)
+        data = _normalize(payload)
+        if data is None:
+            record.errors['record'] = ['Expected a complete patient object.']
+        records.append(record)
+        normalized.append(data)
+
+    valid = [(record, data) for record, data in zip(records, normalized) if data is not None]
+
+    # Patients
+    serializer = BulkPatientSerializer(data=[data['patient'] for _, data in valid], many=True)
+    serializer.is_valid()
+    for position, (record, _) in enumerate(valid):
+        if serializer.item_errors[position]:
+            record.errors['patient'] = serializer.item_errors[position]
+        else:
+            record.patient = serializer.validated_data[position]
+
+    _check_contacts([record for record, _ in valid if record.patient is not None])
+
+    # Medical history (one object per record)
+    histories = [(record, data['medical_history']) for record, data in valid if data['medical_history']]
+    serializer = BulkMedicalHistorySerializer(data=[history for _, history in histories], many=True)
+    serializer.is_valid()
+    for position, (record, _) in enumerate(histories):
+        if serializer.item_errors[position]:
+            record.errors['medical_history'] = serializer.item_errors[position]
+        else:
+            record.medical_history = serializer.validated_data[position]
+
+    # List sections, flattened across the chunk
+    for section, (_, serializer_class) in LIST_SECTIONS.items():
+        owners = [(record, item) for record, data in valid for item in data[section]]
+        serializer = serializer_class(data=[item for _, item in owners], many=True)
+        serializer.is_valid()
+        for position, (record, _) in enumerate(owners):
+            errors = serializer.item_errors[position]
+            checkup = None if errors else serializer.validated_data[position].get('checkup')
+            if checkup is not None:
+                # Every existing checkup belongs to another patient than the new one
+                errors = {'checkup': [f'No CheckUp with id {checkup.pk} for this patient.']}
+            if errors:
+                record.errors.setdefault(section, []).append(errors)
+            else:
+                record.sections[section].append(serializer.validated_data[position])
+
+    return records
+
+
+def _check_contacts(records):
+    """
+    Reject records whose phone number or email is taken on any shard or by an
+    earlier record: the unique constraints only cover the shard of a record.
+    """
+    phones = {str(record.patient['phone_number']) for record in records}
+    emails = {record.patient.get('email_address') for record in records} - {None, ''}
+    taken = set()
+    for _ in sharding.each_shard():
+        rows = Patient.all_objects.filter(Q(phone_number__in=phones) | Q(email_address__in=emails))
+        for phone_number, email_address in rows.values_list('phone_number', 'email_address'):
+            taken.update({('phone_number', str(phone_number)), ('email_address', email_address)})
+
+    for record in records:
+        errors = {}
+        for field in ('phone_number', 'email_address'):
+            value = record.patient.get(field)
+            if value in (None, ''):
+                continue
+            if (field, str(value)) in taken:
+                errors[field] = [f'patient with this {Patient._meta.get_field(field).verbose_name} already exists.']
+            taken.add((field, str(value)))
+        if errors:
+            record.errors['patient'] = errors
+            record.patient = None
+
+
+def _write_records(records):
+    """
+    Insert validated records with one bulk_create per table.
+    Must run inside a transaction. Returns the created Patient objects.
+    """
+    patients = Patient.objects.bulk_create([Patient(**record.patient) for record in records])
+
+    histories = [
+        MedicalHistory(patient=patient, **record.medical_history)
+        for record, patient in zip(records, patients) if record.medical_history
+    ]
+    MedicalHistory.objects.bulk_create(histories)
+
+    checkups = []
+    owners = []
+    for record, patient in zip(records, patients):
+        for data in record.sections['checkups']:
+            checkup = CheckUp(patient=patient, **data)
+            checkup.fill_derived_fields()
+            checkups.append(checkup)
+            owners.append(patient.pk)
+    CheckUp.objects.bulk_create(checkups)
+
+    # Treatments link to the first checkup of their record, as in create_complete_patient,
+    # unless sent with "checkup": null
+    first_checkup = {}
+    for patient_id, checkup in zip(owners, checkups):
+        first_checkup.setdefault(patient_id, checkup)
+
+    written = [(Patient, patients), (MedicalHistory, histories), (CheckUp, checkups)]
+    for section in ('lab_tests', 'treatments', 'notes'):
+        model, _ = LIST_SECTIONS[section]
+        objects = []
+        for record, patient in zip(records, patients):
+            for data in record.sections[section]:
+                obj = model(patient=patient, **data)
+                if section == 'treatments' and 'checkup' not in data:
+                    obj.checkup = first_checkup.get(patient.pk)
+                objects.append(obj)
+        model.objects.bulk_create(objects)
+        written.append((model, objects))
+
+    # bulk_create does not send post_save
+    for model, objects in written:
+        send_rows_changed(model, 'create', objects)
+
+    return patients
+
+
+def _write_chunk(records, report):
+    """
+    Write records in one transaction per shard. On a constraint error the
+    records are retried one by one so only the conflicting ones are rejected.
+    """
+    if not sharding.enabled():
+        _write_shard_chunk(records, report)
+        return
+    # Allocate the patient ids up front, they decide the shard of each record
+    placed = {}
+    for record, (patient_id, shard) in zip(records, sharding.allocate(len(records))):
+        record.patient = {**record.patient, 'id': patient_id}
+        placed.setdefault(shard, []).append(record)
+    for shard, shard_records in placed.items():
+        with sharding.using_shard(shard):
+            _write_shard_chunk(shard_records, report)
+
+
+def _write_shard_chunk(records, report):
+    try:
+        with sharding.atomic():
+            patients = _write_records(records)
+    except IntegrityError as e:
+        if len(records) == 1:
+            report['errors'].append({'index': records[0].index, 'errors': {'database': [str(e)]}})
+            return
+        for record in records:
+            _write_shard_chunk([record], report)
+        return
+    report['patient_ids'].extend(patient.pk for patient in patients)
+
+
+def bulk_import(payloads, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Validate and insert a list of complete patient payloads.
+    Returns a report with the created patient ids and per-record errors.
+    """
+    report = {
+        'received': len(payloads),
+        'patient_ids': [],
+        'errors': [],
+    }
+
+    for start in range(0, len(payloads), chunk_size):
+        chunk = list(enumerate(payloads[start:start + chunk_size], start=start))
+        records = _validate_chunk(chunk)
+
+        valid = []
+        for record in records:
+            if record.errors:
+                report['errors'].append({'index': record.index, 'errors': record.errors})
+            else:
+                valid.append(record)
+
+        if valid:
+            _write_chunk(valid, report)
+
+    report['errors'].sort(key=lambda error: error['index'])
+    report['created'] = len(report['patient_ids'])
+    report['failed'] = len(report['errors'])
+    return report
@@ -0,0 +1,168 @@
+"""
+Materialized complete patient records
+
+Keeps the complete record document of each patient (the GET /api/patients/<id>/
+payload) in a Django cache so repeated reads of an unchanged patient cost one
+cache lookup. Entries are invalidated by the receivers in patients/signals.py.
+
+Each patient has a version token stored next to its document. Invalidation
+replaces the token, so a document built from data read before a write can never
+be served after it, even if it reaches the cache late.
+
+The cache alias is settings.PATIENT_RECORD_CACHE (locmem by default). Use a
+shared backend (file based, memcached, redis) when running several processes,
+so every process sees the invalidations.
+"""
+import threading
+import uuid
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.http import Http404
+
+from .models import Patient
+from .records import complete_record, project_record
+from .replica import use_primary
+
+
+DEFAULT_TIMEOUT = 60 * 60 * 24
+
+
+class CacheStats:
+    """Process wide hit and miss counters"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def hit(self):
+        with self._lock:
+            self.hits += 1
+
+    def miss(self):
+        with self._lock:
+            self.misses += 1
+
+    def reset(self):
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+
+    def as_dict(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / total, 4) if total else None,
+            }
+
+
+stats = CacheStats()
+
+
+def get_cache():
+    return caches[getattr(settings, 'PATIENT_RECORD_CACHE', 'default')]
+
+
+def _record_key(patient_id):
+    return f'patient-record:{patient_id}'
+
+
+def _version_key(patient_id):
+    return f'patient-record-version:{patient_id}'
+
+
+def _cached_entry(cached, record_key, version_key):
+    """Record from a get_many() result when it matches the current version token"""
+    version = cached.get(version_key)
+    entry = cached.get(record_key)
+    if entry is not None and version is not None and entry['version'] == version:
+        return version, entry['record']
+    return version, None
+
+
+def _full_record(patient_id):
+    """Complete record for the cache, read from the primary so it is never older than the version token"""
+    with use_primary():
+        return complete_record(patient_id)
+
+
+def get_complete_record(patient_id, selected=None):
+    """
+    Complete record document of a patient, served from the cache when the
+    patient has not changed since it was stored.
+
+    `selected` (records.parse_selection()) cuts the document down. A cached
+    full document is projected; otherwise only the selected sections are
+    read from the database and nothing is cached.
+    Raises Patient.DoesNotExist for unknown patients.
+    """
+    record_cache = get_cache()
+    record_key, version_key = _record_key(patient_id), _version_key(patient_id)
+    version, record = _cached_entry(record_cache.get_many([record_key, version_key]), record_key, version_key)
+    if record is not None:
+        stats.hit()
+        return project_record(record, selected)
+
+    stats.miss()
+    if selected is not None:
+        return complete_record(patient_id, selected)
+    if version is None:
+        record_cache.add(version_key, uuid.uuid4().hex, None)
+        version = record_cache.get(version_key)
+
+    record = _full_record(patient_id)
+    timeout = getattr(settings, 'PATIENT_RECORD_CACHE_TIMEOUT', DEFAULT_TIMEOUT)
+    record_cache.set(record_key, {'version': version, 'record': record}, timeout)
+    return record
+
+
+async def aget_complete_record(patient_id, selected=None):
+    """Async get_complete_record, for views running on the event loop"""
+    record_cache = get_cache()
+    record_key, version_key = _record_key(patient_id), _version_key(patient_id)
+    version, record = _cached_entry(await record_cache.aget_many([record_key, version_key]), record_key, version_key)
+    if record is not None:
+        stats.hit()
+        return project_record(record, selected)
+
+    stats.miss()
+    if selected is not None:
+        return await sync_to_async(complete_record)(patient_id, selected)
+    if version is None:
+        await record_cache.aadd(version_key, uuid.uuid4().hex, None)
+        version = await record_cache.aget(version_key)
+
+    record = await sync_to_async(_full_record)(patient_id)
+    timeout = getattr(settings, 'PATIENT_RECORD_CACHE_TIMEOUT', DEFAULT_TIMEOUT)
+    await record_cache.aset(record_key, {'version': version, 'record': record}, timeout)
+    return record
+
+
+def get_complete_record_or_404(patient_id, selected=None):
+    """get_complete_record raising Http404 like get_object_or_404"""
+    try:
+        return get_complete_record(patient_id, selected)
+    except Patient.DoesNotExist:
+        raise Http404('No Patient matches the given query.')
+
+
+async def aget_complete_record_or_404(patient_id, selected=None):
+    """aget_complete_record raising Http404 like get_object_or_404"""
+    try:
+        return await aget_complete_record(patient_id, selected)
+    except Patient.DoesNotExist:
+        raise Http404('No Patient matches the given query.')
+
+
+def invalidate(patient_ids):
+    """Invalidate the cached documents of the given patients"""
+    patient_ids = [patient_id for patient_id in patient_ids if patient_id is not None]
+    if not patient_ids:
+        return
+    record_cache = get_cache()
+    record_cache.set_many({_version_key(patient_id): uuid.uuid4().hex for patient_id in patient_ids}, None)
+    record_cache.delete_many([_record_key(patient_id) for patient_id in patient_ids])
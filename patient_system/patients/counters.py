@@ -0,0 +1,136 @@
+"""
+Denormalized per-patient counters
+
+Patient stores how many rows it has in each related table and the date of its
+latest checkup, so the roster reads one table with no joins. The receivers in
+patients/signals.py keep them current on every write: creates and deletes move
+the counts by the number of rows written, and checkup writes recompute
+last_checkup_date from the patient's checkups. Archived rows
+(patients/archive.py) are still counted, so archiving and restoring leave the
+counts alone. rebuild_counters() and find_drift() recompute everything from
+the related tables and the archives (manage.py rebuild_patient_counters).
+"""
+from collections import Counter, defaultdict
+
+from django.db.models import Count, F, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce, Greatest
+
+from . import sharding
+from .models import Patient, MedicalHistory, CheckUp, LabTests, TreatmentPlan, AdditionalNote, PatientArchive
+
+
+# Related model -> Patient column counting its rows
+COUNTER_FIELDS = {
+    MedicalHistory: 'medical_history_count',
+    CheckUp: 'checkups_count',
+    LabTests: 'lab_tests_count',
+    TreatmentPlan: 'treatments_count',
+    AdditionalNote: 'notes_count',
+}
+
+DENORMALIZED_FIELDS = tuple(COUNTER_FIELDS.values()) + ('last_checkup_date',)
+
+# Counters that also count archived rows, from the PatientArchive column of the same name
+ARCHIVED_FIELDS = ('checkups_count', 'lab_tests_count', 'notes_count')
+
+
+def _count_subquery(model):
+    """Correlated COUNT(*) of `model` rows belonging to the outer patient"""
+    counts = (
+        model.objects
+        .filter(patient=OuterRef('pk'))
+        .order_by()
+        .values('patient')
+        .annotate(total=Count('pk'))
+        .values('total')
+    )
+    return Coalesce(Subquery(counts, output_field=IntegerField()), 0)
+
+
+def _archived_subquery(field):
+    """Archived rows counted by `field` of the outer patient"""
+    archived = PatientArchive.objects.filter(patient=OuterRef('pk')).values(field)
+    return Coalesce(Subquery(archived, output_field=IntegerField()), 0)
+
+
+def _last_checkup_subquery():
+    """Most recent checkup date of the outer patient"""
+    latest = (
+        CheckUp.objects
+        .filter(patient=OuterRef('pk'), date_of_checkup__isnull=False)
+        .order_by('-date_of_checkup')
+        .values('date_of_checkup')[:1]
+    )
+    return Subquery(latest)
+
+
+def actual_values():
+    """Expressions computing each denormalized column from the related tables"""
+    expressions = {field: _count_subquery(model) for model, field in COUNTER_FIELDS.items()}
+    for field in ARCHIVED_FIELDS:
+        expressions[field] += _archived_subquery(field)
+    expressions['last_checkup_date'] = _last_checkup_subquery()
+    return expressions
+
+
+def apply_row_changes(model, op, rows):
+    """
+    Adjust the counters of the patients owning `rows`, a list of
+    (row id, patient id) pairs of `model` that were created, updated, deleted,
+    archived or restored.
+    """
+    field = COUNTER_FIELDS.get(model)
+    if field is None:
+        return
+
+    per_patient = Counter(patient_id for _, patient_id in rows if patient_id is not None)
+    if op not in ('create', 'delete'):
+        # Updates, archives and restores only move the last checkup date
+        if model is CheckUp and per_patient:
+            Patient.objects.filter(pk__in=per_patient).update(last_checkup_date=_last_checkup_subquery())
+        return
+
+    # One UPDATE per distinct number of rows written per patient
+    patients_by_amount = defaultdict(list)
+    for patient_id, amount in per_patient.items():
+        patients_by_amount[amount].append(patient_id)
+
+    for amount, patient_ids in patients_by_amount.items():
+        if op == 'create':
+            updates = {field: F(field) + amount}
+        else:
+            updates = {field: Greatest(F(field) - amount, Value(0))}
+        if model is CheckUp:
+            updates['last_checkup_date'] = _last_checkup_subquery()
+        Patient.objects.filter(pk__in=patient_ids).update(**updates)
+
+
+def rebuild_counters(patient_ids=None):
+    """Recompute the columns of the given (or all) patients on every shard, returns rows updated"""
+    patients = Patient.objects.all()
+    if patient_ids is not None:
+        patients = patients.filter(pk__in=list(patient_ids))
+    return sum(sharding.fan_out(lambda: patients.update(**actual_values())))
+
+
+def find_drift(batch_size=1000):
+    """
+    Yield (patient id, {field: (stored, actual)}) for every patient whose
+    stored columns differ from the related tables.
+    """
+    actual = {f'actual_{field}': expression for field, expression in actual_values().items()}
+    rows = (
+        Patient.objects
+        .annotate(**actual)
+        .order_by('pk')
+        .values('pk', *DENORMALIZED_FIELDS, *actual)
+    )
+    for shard in sharding.shards():
+        for row in sharding.iterate_on(shard, rows.iterator(chunk_size=batch_size)):
+            drift = {
+                field: (row[field], row[f'actual_{field}'])
+                for field in DENORMALIZED_FIELDS
+                if row[field] != row[f'actual_{field}']
+            }
+            if drift:
+                yield row['pk'], drift
@@ -0,0 +1,52 @@
+"""
+Streaming export of complete patient records
+
+Yields one complete patient record per line (NDJSON). Patients are read in
+keyset chunks by id and each chunk is built with one query per table, so
+memory use depends on the chunk size and not on the number of exported patients.
+With several shards (patients/sharding.py) the shards are exported one after
+the other.
+"""
+from django.db.models import Exists, OuterRef
+
+from . import sharding
+from .models import CheckUp, Patient
+from .records import complete_records
+from .renderers import dumps
+
+
+DEFAULT_CHUNK_SIZE = 200
+
+
+def export_queryset(since=None):
+    """
+    Patients to export.
+    `since` (a date) keeps patients with a checkup on or after that date.
+    """
+    queryset = Patient.objects.all()
+    if since is not None:
+        recent_checkups = CheckUp.objects.filter(patient=OuterRef('pk'), date_of_checkup__gte=since)
+        queryset = queryset.filter(Exists(recent_checkups))
+    return queryset
+
+
+def iter_records(queryset, selected=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Yield complete records of every shard, reading `chunk_size` patients at a time"""
+    for shard in sharding.shards():
+        yield from sharding.iterate_on(shard, _iter_shard_records(queryset, selected, chunk_size))
+
+
+def _iter_shard_records(queryset, selected, chunk_size):
+    last_id = 0
+    while True:
+        chunk = list(queryset.filter(pk__gt=last_id).order_by('pk').values_list('pk', flat=True)[:chunk_size])
+        if not chunk:
+            return
+        yield from complete_records(chunk, selected)
+        last_id = chunk[-1]
+
+
+def iter_ndjson(queryset, selected=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Yield complete records encoded as newline-delimited JSON"""
+    for record in iter_records(queryset, selected, chunk_size):
+        yield dumps(record) + b'\n'
@@ -0,0 +1,85 @@
+"""
+Read-only serializers for values() rows
+
+Produce the same representation as the DRF serializers in serializer.py for
+rows fetched with QuerySet.values(), without building model instances or
+running the ModelSerializer field machinery for every row. The plan of each
+serializer (output key, values() column, converter) is compiled once from the
+DRF serializer itself, so the output follows changes to its field list.
+"""
+from functools import lru_cache
+
+from django.db import models
+from rest_framework import serializers
+
+
+# Text fields return the stored value unchanged when the database gives a str
+TEXT_FIELDS = (serializers.CharField, serializers.EmailField, serializers.ChoiceField)
+TEXT_MODEL_FIELDS = (models.CharField, models.TextField, models.EmailField)
+
+
+def _model_field(model, source):
+    """Model field a dotted serializer source points at"""
+    field = None
+    for part in source.split('.'):
+        field = model._meta.get_field(part)
+        model = field.related_model
+    return field
+
+
+def _passes_through(field, model_field):
+    """True when field.to_representation returns the values() value as is"""
+    if isinstance(field, serializers.PrimaryKeyRelatedField):
+        return True
+    if type(field) in TEXT_FIELDS:
+        # Model field subclasses (e.g. PhoneNumberField) hold non-str values
+        return type(model_field) in TEXT_MODEL_FIELDS
+    if isinstance(field, serializers.IntegerField):
+        return not getattr(field, 'coerce_to_string', False)
+    return False
+
+
+class RowSerializer:
+    """
+    Serializes values() rows like `serializer_class` serializes instances.
+
+    fields: output keys to keep, None for all of them
+    provided: columns the caller puts in the rows itself (e.g. the patient
+              name it already knows), left out of `columns`
+    """
+
+    def __init__(self, serializer_class, fields=None, provided=()):
+        model = serializer_class.Meta.model
+        self.plan = []
+        for key, field in serializer_class().fields.items():
+            if fields is not None and key not in fields:
+                continue
+            parts = field.source.split('.')
+            column = '__'.join(parts)
+            # DRF leaves a dotted source out of the output when a relation on
+            # its path is null, so the relation columns are read as well
+            guards = tuple('__'.join(parts[:depth]) for depth in range(1, len(parts)))
+            convert = None if _passes_through(field, _model_field(model, field.source)) else field.to_representation
+            self.plan.append((key, column, convert, guards))
+        columns = []
+        for _, column, _, guards in self.plan:
+            columns.extend(guards + (column,))
+        self.columns = tuple(column for column in dict.fromkeys(columns) if column not in provided)
+
+    def to_representation(self, row):
+        data = {}
+        for key, column, convert, guards in self.plan:
+            if guards and any(row[guard] is None for guard in guards):
+                continue
+            value = row[column]
+            data[key] = value if convert is None or value is None else convert(value)
+        return data
+
+    def many(self, rows):
+        return [self.to_representation(row) for row in rows]
+
+
+@lru_cache(maxsize=None)
+def row_serializer(serializer_class, fields=None, provided=()):
+    """Compiled RowSerializer, `fields` and `provided` given as frozensets/tuples"""
+    return RowSerializer(serializer_class, fields, provided)
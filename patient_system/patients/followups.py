@@ -0,0 +1,123 @@
+"""
+Follow-up schedule
+
+Lists treatment plans whose next follow-up falls in a date range, optionally
+for one doctor, with a stub of the patient joined in the same query. Pages
+are keyset based on (next_followup_date, id), walking the
+next_followup_date or (assigned_doctor, next_followup_date) index of
+TreatmentPlan, so a page costs the same however many follow-ups precede it.
+With several shards (patients/sharding.py) every shard returns its first
+page after the cursor and the pages are merged; treatment plan ids are per
+shard, so the cursor then also carries the position of the shard.
+"""
+from datetime import date, timedelta
+
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from . import sharding
+from .models import TreatmentPlan
+
+
+DEFAULT_DAYS = 7
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+COLUMNS = (
+    'id', 'next_followup_date', 'related_disease', 'assigned_doctor', 'checkup_id',
+    'patient_id', 'patient__patient_name', 'patient__age', 'patient__gender', 'patient__phone_number',
+)
+
+
+def _date(params, key):
+    raw = params.get(key)
+    try:
+        value = parse_date(raw) if raw else None
+    except ValueError:
+        value = None
+    if raw and value is None:
+        raise ValueError(f"'{key}' must be a date (YYYY-MM-DD).")
+    return value
+
+
+def parse_params(params):
+    """
+    Read from (default today), to (default from + 7 days), doctor, after and
+    limit from query parameters. `after` is the next_after cursor of the
+    previous page, read as (date, id, shard position). Raises ValueError
+    with a readable message on bad input.
+    """
+    start = _date(params, 'from') or timezone.localdate()
+    end = _date(params, 'to') or start + timedelta(days=DEFAULT_DAYS)
+    if end < start:
+        raise ValueError("'to' must not be before 'from'.")
+
+    after = None
+    if params.get('after'):
+        day, _, rest = params['after'].partition(':')
+        pk, _, shard = rest.partition(':')
+        try:
+            after = (date.fromisoformat(day), int(pk), int(shard or 0))
+        except ValueError:
+            raise ValueError("'after' must be the next_after value of a previous page.")
+
+    try:
+        limit = int(params.get('limit') or DEFAULT_PAGE_SIZE)
+    except ValueError:
+        raise ValueError("'limit' must be an integer.")
+    if limit < 1:
+        raise ValueError("'limit' must be at least 1.")
+
+    return start, end, params.get('doctor') or None, after, min(limit, MAX_PAGE_SIZE)
+
+
+def _entry(row):
+    return {
+        'id': row['id'],
+        'next_followup_date': row['next_followup_date'],
+        'related_disease': row['related_disease'],
+        'assigned_doctor': row['assigned_doctor'],
+        'checkup': row['checkup_id'],
+        'patient': {
+            'id': row['patient_id'],
+            'patient_name': row['patient__patient_name'],
+            'age': row['patient__age'],
+            'gender': row['patient__gender'],
+            'phone_number': str(row['patient__phone_number']),
+        },
+    }
+
+
+def followups_page(start, end, doctor=None, after=None, limit=DEFAULT_PAGE_SIZE):
+    """
+    Return (follow-ups, next_after) for the page of follow-ups due between
+    `start` and `end` (inclusive) that come after the `after` cursor.
+    `next_after` is None when there are no further pages.
+    """
+    queryset = TreatmentPlan.objects.filter(
+        next_followup_date__gte=start, next_followup_date__lte=end, patient__deleted_at__isnull=True
+    )
+    if doctor is not None:
+        queryset = queryset.filter(assigned_doctor=doctor)
+
+    rows = []
+    for position, _ in enumerate(sharding.each_shard()):
+        shard_rows = queryset
+        if after is not None:
+            day, pk, after_position = after
+            later = Q(next_followup_date__gt=day) | Q(next_followup_date=day, pk__gt=pk)
+            if position > after_position:
+                later |= Q(next_followup_date=day, pk=pk)
+            shard_rows = shard_rows.filter(later)
+        # Fetch one extra row to know whether another page exists
+        for row in shard_rows.order_by('next_followup_date', 'pk').values(*COLUMNS)[:limit + 1]:
+            rows.append((row['next_followup_date'], row['id'], position, row))
+    rows.sort(key=lambda entry: entry[:3])
+
+    next_after = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        day, pk, position, _ = rows[-1]
+        next_after = f"{day.isoformat()}:{pk}" + (f":{position}" if sharding.enabled() else '')
+    return [_entry(row) for *_, row in rows], next_after
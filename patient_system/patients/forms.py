@@ -75,6 +75,9 @@ class MedicalHistoryForm(forms.ModelForm):
 
 
 class CheckUpForm(forms.ModelForm):
+    # Id of the stored row being edited, empty for new rows
+    id = forms.IntegerField(required=False, widget=forms.HiddenInput())
+
     class Meta:
         model = CheckUp
         fields = [
@@ -130,6 +133,9 @@ class CheckUpForm(forms.ModelForm):
 
 
 class LabTestsForm(forms.ModelForm):
+    # Id of the stored row being edited, empty for new rows
+    id = forms.IntegerField(required=False, widget=forms.HiddenInput())
+
     class Meta:
         model = LabTests
         fields = ['lab_results', 'imaging', 'other_tests']
@@ -153,6 +159,9 @@ class LabTestsForm(forms.ModelForm):
 
 
 class TreatmentPlanForm(forms.ModelForm):
+    # Id of the stored row being edited, empty for new rows
+    id = forms.IntegerField(required=False, widget=forms.HiddenInput())
+
     class Meta:
         model = TreatmentPlan
         fields = [
@@ -197,6 +206,9 @@ class TreatmentPlanForm(forms.ModelForm):
 
 
 class AdditionalNoteForm(forms.ModelForm):
+    # Id of the stored row being edited, empty for new rows
+    id = forms.IntegerField(required=False, widget=forms.HiddenInput())
+
     class Meta:
         model = AdditionalNote
         fields = ['doctor_remarks', 'special_warnings']
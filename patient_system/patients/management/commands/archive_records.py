@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from patients import archive, sharding
+
+
+class Command(BaseCommand):
+    help = (
+        "Move checkups, lab tests and notes older than settings.ARCHIVE_AFTER_DAYS into the "
+        "patients' compressed archives, or put the archived rows of a patient back with --restore."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than', type=int, metavar='DAYS',
+                            help='Archive rows older than this many days (default: settings.ARCHIVE_AFTER_DAYS).')
+        parser.add_argument('--restore', type=int, metavar='PATIENT_ID',
+                            help='Move every archived row of this patient back to its table.')
+
+    def handle(self, *args, **options):
+        if options['restore'] is not None:
+            shard = sharding.shard_of(options['restore'])
+            if shard is None:
+                raise CommandError(f"Patient {options['restore']} does not exist.")
+            with sharding.using_shard(shard):
+                restored = archive.restore(options['restore'])
+            self.stdout.write(self.style.SUCCESS(f"Restored {restored} rows of patient {options['restore']}."))
+            return
+
+        if options['older_than'] is not None and options['older_than'] < 0:
+            raise CommandError('--older-than must be zero or more days.')
+
+        def report(patient_id, rows):
+            if options['verbosity'] > 1:
+                self.stdout.write(f'Patient {patient_id}: archived {rows} rows')
+
+        patients, rows = archive.archive_old_records(days=options['older_than'], report=report)
+        self.stdout.write(self.style.SUCCESS(f'Archived {rows} rows of {patients} patients.'))
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from patients import sharding, vitals
+from patients.models import CheckUp
+
+
+class Command(BaseCommand):
+    help = (
+        "Parse the free-text vital signs of every checkup into the numeric "
+        "shadow columns (systolic_bp, heart_rate_bpm, temperature_c, ...)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        counts = sharding.fan_out(vitals.backfill, CheckUp, batch_size=options['batch_size'])
+        read, updated = (sum(column) for column in zip(*counts))
+        self.stdout.write(self.style.SUCCESS(f'Read {read} checkups, updated {updated}.'))
@@ -0,0 +1,100 @@
+import time
+
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from rest_framework.renderers import JSONRenderer
+
+from django.core.management.base import BaseCommand, CommandError
+
+from patients.models import Patient, MedicalHistory, CheckUp, LabTests, TreatmentPlan, AdditionalNote
+from patients.records import build_complete_record, complete_patient_queryset, complete_records
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        "Time building complete patient documents with the DRF serializers on "
+        "prefetched instances against the values()-based fast serializers, and "
+        "check that both render byte-identical JSON."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--patients', type=int, default=200,
+                            help='Number of patients per run (default 200).')
+        parser.add_argument('--repeat', type=int, default=5,
+                            help='Runs per implementation; the best run is reported (default 5).')
+        parser.add_argument('--synthetic', action='store_true',
+                            help='Benchmark generated patients inside a transaction that is rolled back.')
+
+    def handle(self, *args, **options):
+        if not options['synthetic']:
+            self.run(options)
+            return
+        try:
+            with transaction.atomic():
+                self.create_patients(options['patients'])
+                self.run(options)
+                raise Rollback
+        except Rollback:
+            pass
+
+    def create_patients(self, count):
+        start = Patient.objects.order_by('-pk').values_list('pk', flat=True).first() or 0
+        patients = Patient.objects.bulk_create([
+            Patient(
+                patient_name=f'Benchmark {start + i}', guardian_name='Guardian', age=40,
+                gender='Female', blood_group='A+', date_of_birth='1985-05-05',
+                phone_number=f'+1202{start + i:07d}', email_address=f'bench{start + i}@example.com',
+            )
+            for i in range(count)
+        ])
+        checkups = CheckUp.objects.bulk_create([
+            CheckUp(patient=patient, symptoms='Cough', current_diagnosis='Flu', date_of_checkup=f'2024-0{day}-01',
+                    blood_pressure='120/80', heart_rate='72', temperature='98.6', weight='70', height='170', bmi='24.2')
+            for patient in patients for day in range(1, 4)
+        ])
+        MedicalHistory.objects.bulk_create([MedicalHistory(patient=p, allergies='Penicillin') for p in patients])
+        LabTests.objects.bulk_create([LabTests(patient=p, lab_results='Normal') for p in patients])
+        TreatmentPlan.objects.bulk_create([
+            TreatmentPlan(patient=c.patient, checkup=c, related_disease='Flu', assigned_doctor='Dr. Ali')
+            for c in checkups[::3]
+        ])
+        AdditionalNote.objects.bulk_create([AdditionalNote(patient=p, doctor_remarks='Rest') for p in patients])
+
+    def run(self, options):
+        ids = list(Patient.objects.order_by('pk').values_list('pk', flat=True)[:options['patients']])
+        if not ids:
+            raise CommandError('No patients to benchmark; use --synthetic to generate some.')
+
+        def drf():
+            return [build_complete_record(patient) for patient in complete_patient_queryset().filter(pk__in=ids).order_by('pk')]
+
+        def fast():
+            return complete_records(ids)
+
+        renderer = JSONRenderer()
+        if renderer.render(drf()) != renderer.render(fast()):
+            raise CommandError('Fast serializers produced different JSON than the DRF serializers.')
+
+        self.stdout.write(f'{len(ids)} patients, best of {options["repeat"]} runs')
+        results = {}
+        for name, build in (('DRF serializers', drf), ('fast serializers', fast)):
+            with CaptureQueriesContext(connection) as queries:
+                build()
+            best = min(self.timed(build) for _ in range(options['repeat']))
+            results[name] = best
+            self.stdout.write(
+                f'  {name:<17} {best * 1e6 / len(ids):10.1f} us/record  '
+                f'{best * 1e3:8.1f} ms total  {len(queries)} queries'
+            )
+        speedup = results['DRF serializers'] / results['fast serializers']
+        self.stdout.write(self.style.SUCCESS(f'Output identical; fast path is {speedup:.1f}x faster.'))
+
+    @staticmethod
+    def timed(build):
+        started = time.perf_counter()
+        build()
+        return time.perf_counter() - started
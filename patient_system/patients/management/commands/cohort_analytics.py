@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from patients import analytics
+from patients.renderers import dumps
+
+
+class Command(BaseCommand):
+    help = (
+        "Compute the cohort analytics (BMI distribution, blood pressure percentiles "
+        "by age band and gender, diagnosis frequencies), store them in the analytics "
+        "cache and print them as JSON."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--from', dest='start', help='First checkup date (YYYY-MM-DD).')
+        parser.add_argument('--to', dest='end', help='Last checkup date (YYYY-MM-DD).')
+        parser.add_argument('--top', type=int, default=analytics.DEFAULT_TOP,
+                            help='Number of diagnoses to list.')
+        parser.add_argument('--chunk-size', type=int, default=analytics.CHUNK_SIZE,
+                            help='Rows read per query.')
+
+    def handle(self, *args, **options):
+        try:
+            start, end, top = analytics.parse_params({
+                'from': options['start'], 'to': options['end'], 'top': options['top'],
+            })
+        except ValueError as ve:
+            raise CommandError(str(ve))
+
+        result = analytics.compute(start, end, top, chunk_size=options['chunk_size'])
+        analytics.store(result, start, end, top)
+        self.stdout.write(dumps(result, indent=True).decode())
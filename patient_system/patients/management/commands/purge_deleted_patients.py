@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from patients import purge
+
+
+class Command(BaseCommand):
+    help = (
+        "Remove the rows of deleted patients in small batches, one short transaction per batch, "
+        "for purge jobs that did not finish in the background (e.g. after a restart)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None,
+                            help='Rows deleted per transaction (default: settings.PURGE_BATCH_SIZE).')
+        parser.add_argument('--pause', type=float, default=None,
+                            help='Seconds to sleep between batches (default: settings.PURGE_PAUSE).')
+
+    def handle(self, *args, **options):
+        def report(job):
+            if options['verbosity'] > 1:
+                self.stdout.write(f'Patient {job.patient_id}: {job.deleted_rows}/{job.total_rows} rows')
+
+        failed = 0
+        jobs = list(purge.pending_jobs())
+        for job in jobs:
+            try:
+                purge.purge(job, batch_size=options['batch_size'], pause=options['pause'], report=report)
+            except Exception as e:
+                failed += 1
+                self.stderr.write(f'Patient {job.patient_id}: {e}')
+                continue
+            self.stdout.write(f'Patient {job.patient_id}: removed {job.deleted_rows} rows')
+
+        if failed:
+            raise CommandError(f'{failed} of {len(jobs)} purges failed.')
+        self.stdout.write(self.style.SUCCESS(f'Purged {len(jobs)} patients.'))
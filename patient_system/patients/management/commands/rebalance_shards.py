@@ -0,0 +1,54 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from patients import sharding
+from patients.models import Patient
+
+
+class Command(BaseCommand):
+    help = (
+        "Move patients, with all their related rows, between the shards in settings.SHARDS: "
+        "one patient with --move/--to, or enough to even out the shards with --even."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--move', type=int, metavar='PATIENT_ID', help='Patient to move.')
+        parser.add_argument('--to', metavar='ALIAS', help='Shard to move --move to.')
+        parser.add_argument('--even', action='store_true',
+                            help='Move patients from the fullest to the emptiest shards until they are even.')
+        parser.add_argument('--limit', type=int, help='Move at most this many patients with --even.')
+        parser.add_argument('--dry-run', action='store_true', help='Only print the planned moves.')
+
+    def handle(self, *args, **options):
+        if not sharding.enabled():
+            raise CommandError('Sharding is off: settings.SHARDS lists a single database.')
+        if options['move'] is None and not options['even']:
+            raise CommandError('Pass --move PATIENT_ID --to ALIAS or --even.')
+        if options['move'] is not None and options['to'] not in sharding.shards():
+            raise CommandError(f"--to must be one of {', '.join(sharding.shards())}.")
+
+        # Patients created before sharding was turned on are not in the directory yet
+        registered = sharding.register_existing()
+        if registered:
+            self.stdout.write(f'Registered {registered} patients in the shard directory.')
+
+        if options['even']:
+            moves = sharding.plan_rebalance(limit=options['limit'])
+        else:
+            moves = [(options['move'], sharding.shard_of(options['move']), options['to'])]
+
+        moved = 0
+        for patient_id, source, target in moves:
+            if source is None:
+                raise CommandError(f'Patient {patient_id} does not exist.')
+            if source == target:
+                continue
+            self.stdout.write(f'Patient {patient_id}: {source} -> {target}')
+            if options['dry_run']:
+                continue
+            try:
+                sharding.move_patient(patient_id, target)
+            except Patient.DoesNotExist as e:
+                raise CommandError(str(e))
+            moved += 1
+
+        self.stdout.write(self.style.SUCCESS(f'Moved {moved} patients.'))
@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from patients.counters import find_drift, rebuild_counters
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare the denormalized per-patient counters and last checkup dates with "
+        "the related tables and rebuild the patients that drifted."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true',
+                            help='Only report drift; exit with an error if any is found.')
+        parser.add_argument('--all', action='store_true',
+                            help='Rebuild every patient without checking for drift first.')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        if options['all']:
+            updated = rebuild_counters()
+            self.stdout.write(self.style.SUCCESS(f'Rebuilt counters of {updated} patients.'))
+            return
+
+        drifted = []
+        for patient_id, drift in find_drift(batch_size=options['batch_size']):
+            drifted.append(patient_id)
+            details = ', '.join(f'{field} {stored} != {actual}' for field, (stored, actual) in drift.items())
+            self.stdout.write(f'Patient {patient_id}: {details}')
+
+        if not drifted:
+            self.stdout.write(self.style.SUCCESS('No drift found.'))
+            return
+        if options['check']:
+            raise CommandError(f'{len(drifted)} patients have drifted counters.')
+
+        rebuild_counters(drifted)
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt counters of {len(drifted)} patients.'))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from patients import search
+
+
+class Command(BaseCommand):
+    help = "Rebuild the full-text search index over the clinical text fields."
+
+    def handle(self, *args, **options):
+        if not search.is_enabled():
+            raise CommandError('Full-text search needs the SQLite database backend.')
+        total = search.rebuild()
+        self.stdout.write(self.style.SUCCESS(f'Indexed {total} rows.'))
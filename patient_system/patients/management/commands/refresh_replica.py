@@ -0,0 +1,34 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from patients import replica
+
+
+class Command(BaseCommand):
+    help = (
+        "Copy db.sqlite3 to the read-only replica snapshot (settings.REPLICA_DB_PATH) "
+        "with SQLite's online backup API, without stopping the server."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', default=str(settings.REPLICA_DB_PATH),
+                            help='Snapshot file to write.')
+        parser.add_argument('--pages', type=int, default=1024,
+                            help='Pages copied per step; writers can run between steps.')
+        parser.add_argument('--pause', type=float, default=0.0,
+                            help='Seconds to sleep between steps.')
+
+    def handle(self, *args, **options):
+        def progress(copied, total):
+            if options['verbosity'] > 1:
+                self.stdout.write(f'{copied}/{total} pages')
+
+        try:
+            pages = replica.refresh(options['path'], pages=options['pages'], pause=options['pause'],
+                                    progress=progress)
+        except ValueError as ve:
+            raise CommandError(str(ve))
+
+        self.stdout.write(self.style.SUCCESS(f"Copied {pages} pages to {options['path']}."))
+        if settings.READ_REPLICA is None:
+            self.stdout.write('Set PATIENTS_READ_REPLICA=replica and restart the server to read from the replica.')
@@ -0,0 +1,54 @@
+# Generated by Django 5.2.18 on 2026-10-18 01:08
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patients', '0003_alter_checkup_blood_pressure_alter_checkup_bmi_and_more'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='additionalnote',
+            name='doctor_remarks',
+            field=models.TextField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='labtests',
+            name='lab_results',
+            field=models.TextField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='treatmentplan',
+            name='assigned_doctor',
+            field=models.CharField(blank=True, max_length=100, null=True),
+        ),
+        migrations.AlterField(
+            model_name='treatmentplan',
+            name='checkup',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='treatments', to='patients.checkup'),
+        ),
+        migrations.AlterField(
+            model_name='treatmentplan',
+            name='next_followup_date',
+            field=models.DateField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='treatmentplan',
+            name='prescribed_medications',
+            field=models.TextField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='treatmentplan',
+            name='procedures',
+            field=models.TextField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='treatmentplan',
+            name='related_disease',
+            field=models.CharField(blank=True, max_length=100, null=True),
+        ),
+    ]
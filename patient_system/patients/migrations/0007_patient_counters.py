@@ -0,0 +1,72 @@
+# Generated by Django 5.2.18 on 2026-10-18 01:21
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def fill_counters(apps, schema_editor):
+    """Compute the new columns for existing patients"""
+    Patient = apps.get_model('patients', 'Patient')
+    CheckUp = apps.get_model('patients', 'CheckUp')
+    counted = {
+        'medical_history_count': apps.get_model('patients', 'MedicalHistory'),
+        'checkups_count': CheckUp,
+        'lab_tests_count': apps.get_model('patients', 'LabTests'),
+        'treatments_count': apps.get_model('patients', 'TreatmentPlan'),
+        'notes_count': apps.get_model('patients', 'AdditionalNote'),
+    }
+    updates = {
+        field: Coalesce(Subquery(
+            model.objects.filter(patient=OuterRef('pk')).order_by().values('patient')
+            .annotate(total=Count('pk')).values('total'),
+            output_field=IntegerField()
+        ), 0)
+        for field, model in counted.items()
+    }
+    updates['last_checkup_date'] = Subquery(
+        CheckUp.objects.filter(patient=OuterRef('pk'), date_of_checkup__isnull=False)
+        .order_by('-date_of_checkup').values('date_of_checkup')[:1]
+    )
+    Patient.objects.update(**updates)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patients', '0006_changeevent'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='patient',
+            name='checkups_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='patient',
+            name='lab_tests_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='patient',
+            name='last_checkup_date',
+            field=models.DateField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='patient',
+            name='medical_history_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='patient',
+            name='notes_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='patient',
+            name='treatments_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
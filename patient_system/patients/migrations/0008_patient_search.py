@@ -0,0 +1,45 @@
+from django.db import migrations
+
+
+# (model code, table, indexed text columns), see patients/search.py
+SOURCES = [
+    (1, 'patients_medicalhistory', ('past_conditions', 'family_history', 'previous_surgeries', 'allergies')),
+    (2, 'patients_checkup', ('symptoms', 'current_diagnosis', 'physical_exam_findings')),
+    (3, 'patients_labtests', ('lab_results', 'imaging', 'other_tests')),
+    (4, 'patients_treatmentplan', ('related_disease', 'prescribed_medications', 'procedures',
+                                   'lifestyle_recommendations', 'physiotherapy_advice')),
+    (5, 'patients_additionalnote', ('doctor_remarks', 'special_warnings')),
+]
+
+
+def create_search_index(apps, schema_editor):
+    """FTS5 index over the clinical text fields, filled from the existing rows"""
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(
+        "CREATE VIRTUAL TABLE patients_search USING fts5("
+        "body, patient_id UNINDEXED, tokenize='porter unicode61 remove_diacritics 2')"
+    )
+    for code, table, columns in SOURCES:
+        body = " || char(10) || ".join(f"coalesce({column}, '')" for column in columns)
+        schema_editor.execute(
+            f"INSERT INTO patients_search (rowid, body, patient_id) "
+            f"SELECT (id << 3) | {code}, trim({body}, char(10)), patient_id FROM {table} "
+            f"WHERE trim({body}, char(10)) <> ''"
+        )
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute("DROP TABLE IF EXISTS patients_search")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patients', '0007_patient_counters'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
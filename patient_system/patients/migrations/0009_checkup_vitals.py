@@ -0,0 +1,56 @@
+# Generated by Django 5.2.18 on 2026-10-18 01:30
+
+from django.db import migrations, models
+
+from patients import vitals
+
+
+def fill_vitals(apps, schema_editor):
+    """Parse the vitals of existing checkups"""
+    vitals.backfill(apps.get_model('patients', 'CheckUp'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patients', '0008_patient_search'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='checkup',
+            name='bmi_value',
+            field=models.FloatField(blank=True, db_index=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='checkup',
+            name='diastolic_bp',
+            field=models.PositiveSmallIntegerField(blank=True, db_index=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='checkup',
+            name='heart_rate_bpm',
+            field=models.PositiveSmallIntegerField(blank=True, db_index=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='checkup',
+            name='height_cm',
+            field=models.FloatField(blank=True, db_index=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='checkup',
+            name='systolic_bp',
+            field=models.PositiveSmallIntegerField(blank=True, db_index=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='checkup',
+            name='temperature_c',
+            field=models.FloatField(blank=True, db_index=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='checkup',
+            name='weight_kg',
+            field=models.FloatField(blank=True, db_index=True, editable=False, null=True),
+        ),
+        migrations.RunPython(fill_vitals, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-18 01:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patients', '0009_checkup_vitals'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='checkup',
+            index=models.Index(fields=['patient', 'date_of_checkup'], name='checkup_patient_date_idx'),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.2.18 on 2026-10-18 01:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patients', '0010_checkup_patient_date_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='treatmentplan',
+            index=models.Index(fields=['next_followup_date'], name='treatment_followup_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='treatmentplan',
+            index=models.Index(fields=['assigned_doctor', 'next_followup_date'], name='treatment_doctor_followup_idx'),
+        ),
+    ]
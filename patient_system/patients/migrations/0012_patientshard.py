@@ -0,0 +1,20 @@
+# Generated by Django 5.2.18 on 2026-10-18 01:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patients', '0011_treatmentplan_followup_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PatientShard',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('shard', models.CharField(db_index=True, max_length=50)),
+            ],
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 02:03
+
+import django.db.models.functions.text
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patients', '0012_patientshard'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='patient',
+            index=models.Index(django.db.models.functions.text.Lower('patient_name'), name='patient_name_lower_idx'),
+        ),
+    ]
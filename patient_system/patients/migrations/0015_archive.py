@@ -0,0 +1,64 @@
+# Generated by Django 5.2.18 on 2026-10-18 02:10
+
+from collections import defaultdict
+from datetime import datetime, time
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def backfill_created_at(apps, schema_editor):
+    """
+    Date existing lab tests and notes by the latest checkup of their patient
+    instead of this migration, so they can be archived. Rows of patients
+    without a dated checkup keep the migration time.
+    """
+    alias = schema_editor.connection.alias
+    Patient = apps.get_model('patients', 'Patient')
+    patients_by_day = defaultdict(list)
+    patients = Patient._base_manager.using(alias).filter(last_checkup_date__isnull=False)
+    for patient_id, day in patients.values_list('pk', 'last_checkup_date'):
+        patients_by_day[day].append(patient_id)
+
+    for model_name in ('LabTests', 'AdditionalNote'):
+        model = apps.get_model('patients', model_name)
+        for day, patient_ids in patients_by_day.items():
+            created_at = django.utils.timezone.make_aware(datetime.combine(day, time.min))
+            for start in range(0, len(patient_ids), 500):
+                model._base_manager.using(alias).filter(patient_id__in=patient_ids[start:start + 500]).update(
+                    created_at=created_at
+                )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patients', '0014_soft_delete'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='additionalnote',
+            name='created_at',
+            field=models.DateTimeField(db_index=True, default=django.utils.timezone.now, editable=False),
+        ),
+        migrations.AddField(
+            model_name='labtests',
+            name='created_at',
+            field=models.DateTimeField(db_index=True, default=django.utils.timezone.now, editable=False),
+        ),
+        migrations.CreateModel(
+            name='PatientArchive',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('data', models.BinaryField()),
+                ('checkups_count', models.PositiveIntegerField(default=0)),
+                ('lab_tests_count', models.PositiveIntegerField(default=0)),
+                ('notes_count', models.PositiveIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('patient', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='archive', to='patients.patient')),
+            ],
+        ),
+        migrations.RunPython(backfill_created_at, migrations.RunPython.noop),
+    ]
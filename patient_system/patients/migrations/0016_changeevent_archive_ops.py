@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 02:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patients', '0015_archive'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='changeevent',
+            name='op',
+            field=models.CharField(choices=[('create', 'create'), ('update', 'update'), ('delete', 'delete'), ('archive', 'archive'), ('restore', 'restore')], max_length=10),
+        ),
+    ]
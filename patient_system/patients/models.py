@@ -1,6 +1,17 @@
 from django.db import models
+from django.db.models.functions import Lower
+from django.utils import timezone
 from phonenumber_field.modelfields import PhoneNumberField
 
+from . import sharding, vitals
+
+
+class VisiblePatientManager(models.Manager):
+    """Patients that have not been deleted"""
+
+    def get_queryset(self):
+        return super().get_queryset().filter(deleted_at__isnull=True)
+
 
 class Patient(models.Model):
     patient_name = models.CharField(max_length=200)
@@ -19,9 +30,59 @@ class Patient(models.Model):
     email_address = models.EmailField(max_length=254, unique=True, blank=True, null=True)
     address = models.TextField(blank=True, null=True)
 
+    # Bumped on every write to the patient or its related rows (patients/versioning.py)
+    version = models.PositiveIntegerField(default=1, editable=False)
+    updated_at = models.DateTimeField(default=timezone.now, editable=False)
+
+    # Related row counts and latest checkup date (patients/counters.py)
+    medical_history_count = models.PositiveIntegerField(default=0, editable=False)
+    checkups_count = models.PositiveIntegerField(default=0, editable=False)
+    lab_tests_count = models.PositiveIntegerField(default=0, editable=False)
+    treatments_count = models.PositiveIntegerField(default=0, editable=False)
+    notes_count = models.PositiveIntegerField(default=0, editable=False)
+    last_checkup_date = models.DateField(blank=True, null=True, editable=False)
+
+    # Set when the patient is deleted; its rows are removed later (patients/purge.py)
+    deleted_at = models.DateTimeField(blank=True, null=True, editable=False)
+
+    # Patient.objects hides deleted patients. Django's own lookups (uniqueness
+    # checks, the admin) use all_objects, as deleted patients still hold their rows.
+    all_objects = models.Manager()
+    objects = VisiblePatientManager()
+
+    # Columns written only by UPDATE queries in the database. An instance loaded
+    # before such an update holds stale values, so save() never writes them back.
+    MAINTAINED_FIELDS = (
+        'version', 'updated_at', 'medical_history_count', 'checkups_count',
+        'lab_tests_count', 'treatments_count', 'notes_count', 'last_checkup_date', 'deleted_at',
+    )
+
+    class Meta:
+        default_manager_name = 'all_objects'
+        indexes = [
+            # Name search of the patient list (patients/roster.py)
+            models.Index(Lower('patient_name'), name='patient_name_lower_idx'),
+        ]
+
     def __str__(self):
         return f"{self.patient_name} {self.age} {self.gender}"
 
+    def save(self, *args, **kwargs):
+        if self.pk is None and sharding.enabled():
+            # Ids come from the shard directory so they are unique across shards
+            self.pk, kwargs['using'] = sharding.allocate(shard=sharding.active())[0]
+        if not self._state.adding and kwargs.get('update_fields') is None and not kwargs.get('force_insert'):
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.MAINTAINED_FIELDS
+            ]
+        super().save(*args, **kwargs)
+
+    def validate_unique(self, exclude=None):
+        # Phone numbers and emails are unique across shards, not only on the patient's
+        for _ in sharding.each_shard():
+            super().validate_unique(exclude=exclude)
+
 
 class MedicalHistory(models.Model):
     patient = models.ForeignKey(Patient, on_delete=models.CASCADE, related_name="medical_history")
@@ -50,9 +111,38 @@ class CheckUp(models.Model):
 
     physical_exam_findings = models.TextField(blank=True, null=True)
 
+    # Vital signs as numbers, parsed from the text fields on every write (patients/vitals.py)
+    systolic_bp = models.PositiveSmallIntegerField(blank=True, null=True, editable=False, db_index=True)
+    diastolic_bp = models.PositiveSmallIntegerField(blank=True, null=True, editable=False, db_index=True)
+    heart_rate_bpm = models.PositiveSmallIntegerField(blank=True, null=True, editable=False, db_index=True)
+    temperature_c = models.FloatField(blank=True, null=True, editable=False, db_index=True)
+    weight_kg = models.FloatField(blank=True, null=True, editable=False, db_index=True)
+    height_cm = models.FloatField(blank=True, null=True, editable=False, db_index=True)
+    bmi_value = models.FloatField(blank=True, null=True, editable=False, db_index=True)
+
+    # Columns computed from other fields. bulk_create/bulk_update skip save(),
+    # so bulk writers call fill_derived_fields() themselves.
+    DERIVED_FIELDS = vitals.SHADOW_FIELDS
+
+    class Meta:
+        indexes = [
+            # A patient's checkups in date order, for vitals trends
+            models.Index(fields=['patient', 'date_of_checkup'], name='checkup_patient_date_idx'),
+        ]
+
     def __str__(self):
         return f"Checkup for {self.patient.patient_name} on {self.date_of_checkup}"
 
+    def fill_derived_fields(self):
+        return vitals.fill(self)
+
+    def save(self, *args, **kwargs):
+        self.fill_derived_fields()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and set(update_fields) & set(vitals.SOURCE_FIELDS):
+            kwargs['update_fields'] = {*update_fields, *self.DERIVED_FIELDS}
+        super().save(*args, **kwargs)
+
 
 class LabTests(models.Model):
     patient = models.ForeignKey(Patient, on_delete=models.CASCADE, related_name="labtests")
@@ -60,6 +150,9 @@ class LabTests(models.Model):
     imaging = models.TextField(blank=True, null=True)
     other_tests = models.TextField(blank=True, null=True)
 
+    # Age used to move old rows to the patient's archive (patients/archive.py)
+    created_at = models.DateTimeField(default=timezone.now, editable=False, db_index=True)
+
     def __str__(self):
         return f"Lab Tests for {self.patient.patient_name}"
 
@@ -74,6 +167,13 @@ class TreatmentPlan(models.Model):
     lifestyle_recommendations = models.TextField(blank=True, null=True)
     physiotherapy_advice = models.TextField(blank=True, null=True)
 
+    class Meta:
+        indexes = [
+            # Follow-up schedule (patients/followups.py)
+            models.Index(fields=['next_followup_date'], name='treatment_followup_idx'),
+            models.Index(fields=['assigned_doctor', 'next_followup_date'], name='treatment_doctor_followup_idx'),
+        ]
+
     def __str__(self):
         return f"Treatment plan for {self.patient.patient_name}"
 
@@ -82,5 +182,82 @@ class AdditionalNote(models.Model):
     doctor_remarks = models.TextField(blank=True, null=True)
     special_warnings = models.TextField(blank=True, null=True)
 
+    # Age used to move old rows to the patient's archive (patients/archive.py)
+    created_at = models.DateTimeField(default=timezone.now, editable=False, db_index=True)
+
     def __str__(self):
         return f"Notes for {self.patient.patient_name}"
+
+
+class TableVersion(models.Model):
+    """Version counter of a whole set of tables, bumped on every write to them"""
+    name = models.CharField(max_length=50, unique=True)
+    version = models.PositiveBigIntegerField(default=0)
+    updated_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"{self.name} v{self.version}"
+
+
+class ChangeEvent(models.Model):
+    """
+    One write to a patient or a related row. The auto-incrementing id is the
+    change sequence number used by the changes feed.
+    """
+    OPERATIONS = [
+        ("create", "create"), ("update", "update"), ("delete", "delete"),
+        ("archive", "archive"), ("restore", "restore"),
+    ]
+
+    model = models.CharField(max_length=50)
+    object_id = models.BigIntegerField()
+    op = models.CharField(max_length=10, choices=OPERATIONS)
+    patient_id = models.BigIntegerField(null=True, db_index=True)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"#{self.pk} {self.op} {self.model} {self.object_id}"
+
+
+class PatientShard(models.Model):
+    """
+    Shard directory entry of a patient (see patients/sharding.py). The id is
+    the patient id, allocated here so that ids are unique across shards.
+    """
+    shard = models.CharField(max_length=50, db_index=True)
+
+    def __str__(self):
+        return f"Patient {self.pk} on {self.shard}"
+
+
+class PurgeJob(models.Model):
+    """Removal of the rows of a deleted patient, in batches (patients/purge.py)"""
+    STATUSES = [("pending", "pending"), ("running", "running"), ("done", "done"), ("failed", "failed")]
+
+    patient_id = models.BigIntegerField(unique=True)
+    status = models.CharField(max_length=10, choices=STATUSES, default="pending", db_index=True)
+    total_rows = models.PositiveIntegerField(default=0)
+    deleted_rows = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+    updated_at = models.DateTimeField(default=timezone.now)
+    finished_at = models.DateTimeField(blank=True, null=True)
+
+    def __str__(self):
+        return f"Purge of patient {self.patient_id}: {self.status} {self.deleted_rows}/{self.total_rows}"
+
+
+class PatientArchive(models.Model):
+    """
+    Old checkups, lab tests and notes of a patient, moved out of their tables
+    into one compressed document (patients/archive.py)
+    """
+    patient = models.OneToOneField(Patient, on_delete=models.CASCADE, related_name="archive")
+    data = models.BinaryField()
+    checkups_count = models.PositiveIntegerField(default=0)
+    lab_tests_count = models.PositiveIntegerField(default=0)
+    notes_count = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"Archive of patient {self.patient_id}"
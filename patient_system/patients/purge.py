@@ -0,0 +1,175 @@
+"""
+Soft delete and batched purge of patients
+
+Deleting a patient cascades to all its rows in one transaction, which for a
+long history holds the SQLite write lock long enough to stall every other
+writer. soft_delete() instead only sets Patient.deleted_at, which hides the
+patient at once (Patient.objects leaves it out), records the delete in the
+change log and queues a PurgeJob.
+
+purge() then removes the related rows `batch_size` at a time, each batch in
+its own short transaction followed by a pause so other writers get the lock,
+and finally the patient row. The job records its progress after every batch
+(total_rows, deleted_rows, status), served by GET
+/api/patients/<id>/purge/.
+
+Jobs run on a background thread of the process that queued them when
+settings.PURGE_IN_BACKGROUND is set; `manage.py purge_deleted_patients` runs
+whatever is left, e.g. jobs interrupted by a restart.
+"""
+import logging
+import queue
+import threading
+import time
+
+from django.conf import settings
+from django.db import connections, router, transaction
+from django.utils import timezone
+
+from . import sharding
+from .models import Patient, MedicalHistory, CheckUp, LabTests, TreatmentPlan, AdditionalNote, PatientArchive, PurgeJob
+from .signals import delete_rows, rows_changed, send_rows_changed
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 500
+DEFAULT_PAUSE = 0.05
+
+# Treatments go before the checkups they point to
+PURGE_ORDER = (TreatmentPlan, CheckUp, LabTests, AdditionalNote, MedicalHistory)
+
+_jobs = queue.SimpleQueue()
+_worker = None
+_worker_lock = threading.Lock()
+
+
+def progress(job):
+    """Progress of a purge job for API responses"""
+    return {
+        'patient_id': job.patient_id,
+        'status': job.status,
+        'total_rows': job.total_rows,
+        'deleted_rows': job.deleted_rows,
+        'percent': round(100 * job.deleted_rows / job.total_rows, 1) if job.total_rows else None,
+        'error': job.error or None,
+        'updated_at': job.updated_at,
+        'finished_at': job.finished_at,
+    }
+
+
+def soft_delete(patient):
+    """Hide a patient now and queue the removal of its rows, returns the PurgeJob"""
+    Patient.objects.filter(pk=patient.pk).update(deleted_at=timezone.now())
+    send_rows_changed(Patient, 'delete', [patient])
+    job, _ = PurgeJob.objects.update_or_create(
+        patient_id=patient.pk,
+        defaults={'status': 'pending', 'error': '', 'updated_at': timezone.now(), 'finished_at': None},
+    )
+    transaction.on_commit(lambda: enqueue(job))
+    return job
+
+
+def enqueue(job):
+    """Run a job on the background worker thread, started on first use"""
+    global _worker
+    if not getattr(settings, 'PURGE_IN_BACKGROUND', True):
+        return
+    _jobs.put(job.pk)
+    with _worker_lock:
+        if _worker is None or not _worker.is_alive():
+            _worker = threading.Thread(target=_work, name='patient-purge', daemon=True)
+            _worker.start()
+
+
+def _work():
+    while True:
+        job_id = _jobs.get()
+        try:
+            job = PurgeJob.objects.filter(pk=job_id).exclude(status='done').first()
+            if job is not None:
+                purge(job)
+        except Exception:
+            logger.exception('Purge job %s failed', job_id)
+        finally:
+            # This thread's connections, not the request threads'
+            connections.close_all()
+
+
+def _save(job, *fields):
+    job.updated_at = timezone.now()
+    job.save(update_fields=[*fields, 'updated_at'])
+
+
+def _delete_batch(model, patient_id, batch_size):
+    """Delete up to `batch_size` rows of `model` of a patient in one transaction, returns how many"""
+    with sharding.atomic():
+        ids = list(model.objects.filter(patient_id=patient_id).order_by('pk').values_list('pk', flat=True)[:batch_size])
+        if not ids:
+            return 0
+        if model is CheckUp:
+            # Treatments of other patients can point at these checkups
+            linked = list(TreatmentPlan.objects.filter(checkup_id__in=ids).values_list('pk', 'patient_id'))
+            if linked:
+                TreatmentPlan.objects.filter(pk__in=[pk for pk, _ in linked]).update(checkup=None)
+                rows_changed.send(sender=TreatmentPlan, op='update', rows=linked,
+                                  using=router.db_for_write(TreatmentPlan))
+        delete_rows(model, ids)
+        rows_changed.send(sender=model, op='delete', rows=[(pk, patient_id) for pk in ids],
+                          using=router.db_for_write(model))
+    return len(ids)
+
+
+def purge(job, batch_size=None, pause=None, report=None):
+    """
+    Remove the rows of the deleted patient of `job` in batches, then the
+    patient. `report(job)` is called after every batch. Returns the job.
+    """
+    batch_size = batch_size or getattr(settings, 'PURGE_BATCH_SIZE', DEFAULT_BATCH_SIZE)
+    pause = getattr(settings, 'PURGE_PAUSE', DEFAULT_PAUSE) if pause is None else pause
+    patient_id = job.patient_id
+
+    try:
+        with sharding.using_shard(sharding.shard_of(patient_id)):
+            if not Patient.all_objects.filter(pk=patient_id, deleted_at__isnull=False).exists():
+                raise ValueError(f'Patient {patient_id} is not deleted.')
+
+            job.status = 'running'
+            job.total_rows = job.deleted_rows + sum(
+                model.objects.filter(patient_id=patient_id).count() for model in PURGE_ORDER
+            )
+            _save(job, 'status', 'total_rows')
+
+            for model in PURGE_ORDER:
+                while True:
+                    deleted = _delete_batch(model, patient_id, batch_size)
+                    if not deleted:
+                        break
+                    job.deleted_rows += deleted
+                    _save(job, 'deleted_rows')
+                    if report is not None:
+                        report(job)
+                    if pause:
+                        time.sleep(pause)
+
+            # Without post_delete: soft_delete() logged the delete of the patient
+            with sharding.atomic():
+                PatientArchive.objects.filter(patient_id=patient_id).delete()
+                delete_rows(Patient, [patient_id])
+    except Exception as e:
+        job.status, job.error = 'failed', str(e)
+        _save(job, 'status', 'error')
+        raise
+
+    job.status, job.error, job.finished_at = 'done', '', timezone.now()
+    _save(job, 'status', 'error', 'finished_at')
+    return job
+
+
+def pending_jobs():
+    """Jobs still to run, queuing deleted patients that have no job yet"""
+    for _ in sharding.each_shard():
+        deleted = Patient.all_objects.filter(deleted_at__isnull=False).values_list('pk', flat=True)
+        for patient_id in deleted:
+            PurgeJob.objects.get_or_create(patient_id=patient_id)
+    return PurgeJob.objects.exclude(status='done').order_by('pk')
@@ -0,0 +1,170 @@
+"""
+Per-request SQL instrumentation and query budgets
+
+QueryBudgetMiddleware wraps every database connection for the duration of a
+request and records the number of queries, their total time and the slowest
+statement. It reports them in a Server-Timing header (visible in the browser
+dev tools) and in one log line per request on the `patients.querybudget`
+logger, with the numbers in the record's `query_stats` attribute for
+structured log handlers.
+
+settings.QUERY_BUDGETS maps URL names to the most queries a request may run,
+either one number for every method or a {method: number} dict:
+
+    QUERY_BUDGETS = {'patient-list-create': {'GET': 2}, 'patient_list': 2}
+
+Views that read every shard run some of their queries once per shard; their
+budget is a (fixed, per shard) pair, (1, 2) allowing 3 queries on one shard
+and 5 on two.
+
+A request over its budget logs a warning, or raises QueryBudgetExceeded when
+settings.QUERY_BUDGET_STRICT is set, which QueryBudgetTestRunner does so that
+an N+1 regression fails the test suite. Queries run while a streaming
+response is consumed happen after the middleware returns and are not counted.
+
+The middleware is async capable, so under ASGI it does not force the rest of
+the chain to sync and async views run on the event loop.
+"""
+import logging
+import time
+from contextlib import ExitStack
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connections
+from django.test.runner import DiscoverRunner
+
+from . import sharding
+
+
+logger = logging.getLogger(__name__)
+
+
+class QueryBudgetExceeded(AssertionError):
+    """A request ran more queries than the budget of its URL"""
+
+
+class QueryStats:
+    """execute_wrapper counting queries and timing them"""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.slowest_duration = 0.0
+        self.slowest_sql = None
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - start
+            self.count += 1
+            self.duration += elapsed
+            if self.slowest_sql is None or elapsed > self.slowest_duration:
+                self.slowest_duration = elapsed
+                self.slowest_sql = sql
+
+
+def query_budget(url_name, method):
+    """Query budget of a request to `url_name`, None when it has none"""
+    budget = getattr(settings, 'QUERY_BUDGETS', {}).get(url_name)
+    if isinstance(budget, dict):
+        budget = budget.get(method)
+    if isinstance(budget, tuple):
+        fixed, per_shard = budget
+        return fixed + per_shard * len(sharding.shards())
+    return budget
+
+
+def server_timing(stats, total):
+    return (
+        f'db;dur={stats.duration * 1000:.2f};desc="{stats.count} queries", '
+        f'db-slowest;dur={stats.slowest_duration * 1000:.2f}, '
+        f'total;dur={total * 1000:.2f}'
+    )
+
+
+def instrument(stats):
+    """ExitStack with `stats` wrapping the connections of the current thread"""
+    stack = ExitStack()
+    # Aliases can share a connection (test mirrors), wrap each one once
+    for connection in {id(c): c for c in connections.all()}.values():
+        stack.enter_context(connection.execute_wrapper(stats))
+    return stack
+
+
+class QueryBudgetMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        # Under ASGI the chain stays async, so async views do not hold a thread
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        stats = QueryStats()
+        start = time.perf_counter()
+        with instrument(stats):
+            response = self.get_response(request)
+        return self.report(request, response, stats, time.perf_counter() - start)
+
+    async def __acall__(self, request):
+        stats = QueryStats()
+        start = time.perf_counter()
+        # Async views query through sync_to_async, on the request's
+        # thread-sensitive thread: wrap the connections of that thread
+        stack = await sync_to_async(instrument)(stats)
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(stack.close)()
+        return self.report(request, response, stats, time.perf_counter() - start)
+
+    def report(self, request, response, stats, total):
+        """Add Server-Timing, log the request and check its budget"""
+        match = request.resolver_match
+        url_name = match.url_name if match else None
+        response['Server-Timing'] = server_timing(stats, total)
+
+        record = {
+            'method': request.method,
+            'path': request.path,
+            'url_name': url_name,
+            'status': response.status_code,
+            'queries': stats.count,
+            'sql_ms': round(stats.duration * 1000, 2),
+            'slowest_ms': round(stats.slowest_duration * 1000, 2),
+            'slowest_sql': stats.slowest_sql,
+            'total_ms': round(total * 1000, 2),
+        }
+        logger.info(
+            '%(method)s %(path)s url_name=%(url_name)s status=%(status)s queries=%(queries)s '
+            'sql_ms=%(sql_ms)s slowest_ms=%(slowest_ms)s total_ms=%(total_ms)s',
+            record, extra={'query_stats': record}
+        )
+
+        budget = query_budget(url_name, request.method)
+        if budget is not None and stats.count > budget:
+            message = (
+                f'{request.method} {request.path} ({url_name}) ran {stats.count} queries, '
+                f'over its budget of {budget}. Slowest: {stats.slowest_sql}'
+            )
+            if getattr(settings, 'QUERY_BUDGET_STRICT', False):
+                raise QueryBudgetExceeded(message)
+            logger.warning(message, extra={'query_stats': record})
+        return response
+
+
+class QueryBudgetTestRunner(DiscoverRunner):
+    """Test runner failing any request over its query budget"""
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        settings.QUERY_BUDGET_STRICT = True
+        # One log line per test request is noise
+        logger.setLevel(logging.WARNING)
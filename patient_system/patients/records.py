@@ -0,0 +1,225 @@
+"""
+Complete patient record documents
+
+Builds the nested document returned by GET /api/patients/<id>/ (patient,
+medical_history, checkups, lab_tests, treatments, notes) for one patient or a
+chunk of thousands with a fixed number of queries per chunk.
+
+complete_records() is the read path: it fetches values() rows and serializes
+them with the compiled RowSerializers from fast_serializers.py. The
+instance-based build_complete_record() runs the DRF serializers on prefetched
+patients; it defines the document and is the baseline the fast path is
+compared and benchmarked against.
+"""
+from django.db.models import Prefetch
+
+from .models import Patient, MedicalHistory, CheckUp, LabTests, TreatmentPlan, AdditionalNote
+from .serializer import (
+    PatientSerializer,
+    MedicalHistorySerializer,
+    CheckUpSerializer,
+    LabTestsSerializer,
+    TreatmentPlanSerializer,
+    AdditionalNoteSerializer,
+)
+from .fast_serializers import row_serializer
+
+
+# Section name -> (related accessor on Patient, serializer, queryset)
+# Querysets keep the ordering used by the single-patient endpoint.
+RELATED_SECTIONS = {
+    'medical_history': ('medical_history', MedicalHistorySerializer, MedicalHistory.objects.order_by('pk')),
+    'checkups': ('checkups', CheckUpSerializer, CheckUp.objects.order_by('-date_of_checkup')),
+    'lab_tests': ('labtests', LabTestsSerializer, LabTests.objects.order_by('pk')),
+    'treatments': ('treatments', TreatmentPlanSerializer,
+                   TreatmentPlan.objects.select_related('checkup').order_by('-next_followup_date')),
+    'notes': ('notes', AdditionalNoteSerializer, AdditionalNote.objects.order_by('pk')),
+}
+
+SECTIONS = ('patient',) + tuple(RELATED_SECTIONS)
+
+
+def parse_fields(value):
+    """
+    Parse a ?fields= value into {section: set of field names or None}.
+
+    A section name selects the whole section (`checkups`), a dotted name selects
+    one field of a section (`checkups.date_of_checkup`) and any other bare name
+    is a patient field (`patient_name`). Returns None when nothing is requested,
+    meaning every section with every field. The patient id is always kept.
+    Raises ValueError for unknown sections.
+    """
+    tokens = [token.strip() for token in (value or '').split(',') if token.strip()]
+    if not tokens:
+        return None
+
+    selected = {}
+    for token in tokens:
+        if token in SECTIONS:
+            selected[token] = None
+            continue
+        section, _, field = token.rpartition('.')
+        section = section or 'patient'
+        if section not in SECTIONS:
+            raise ValueError(f"Unknown section '{section}' in fields.")
+        if section not in selected:
+            selected[section] = set()
+        if selected[section] is not None:
+            selected[section].add(field)
+
+    if selected.get('patient') is not None:
+        selected['patient'].add('id')
+    selected.setdefault('patient', {'id'})
+    return selected
+
+
+def parse_selection(fields=None, include=None):
+    """
+    Combine ?fields= and ?include= into a parse_fields() selection.
+
+    `include` names related sections to return whole next to the patient
+    (`include=checkups,treatments`); `fields` works as in parse_fields().
+    Returns None when neither is given, meaning the full document.
+    Raises ValueError for unknown sections.
+    """
+    selected = parse_fields(fields)
+    sections = [token.strip() for token in (include or '').split(',') if token.strip()]
+    if not sections:
+        return selected
+
+    for section in sections:
+        if section not in RELATED_SECTIONS:
+            raise ValueError(f"Unknown section '{section}' in include.")
+    if selected is None:
+        selected = {'patient': None}
+    for section in sections:
+        selected[section] = None
+    return selected
+
+
+def _project(data, fields):
+    """Keep only the requested keys of a serialized row"""
+    if fields is None:
+        return data
+    return {key: value for key, value in data.items() if key in fields}
+
+
+def project_record(record, selected):
+    """Cut a full complete record document down to a selection"""
+    if selected is None:
+        return record
+    projected = {'patient': _project(record['patient'], selected['patient'])}
+    for section in RELATED_SECTIONS:
+        if section not in selected:
+            continue
+        fields, value = selected[section], record[section]
+        if section == 'medical_history':
+            projected[section] = None if value is None else _project(value, fields)
+        else:
+            projected[section] = [_project(row, fields) for row in value]
+    return projected
+
+
+def prefetch_complete(queryset, sections=None):
+    """
+    Prefetch the related rows needed to build complete records.
+    Sections left out of `sections` are not queried at all.
+    """
+    lookups = [
+        Prefetch(accessor, queryset=related_queryset)
+        for section, (accessor, _, related_queryset) in RELATED_SECTIONS.items()
+        if sections is None or section in sections
+    ]
+    return queryset.prefetch_related(*lookups)
+
+
+def complete_patient_queryset(sections=None):
+    """Patients with every (or the selected) related section prefetched"""
+    return prefetch_complete(Patient.objects.all(), sections)
+
+
+def build_complete_record(patient, selected=None):
+    """
+    Build the complete record document for a prefetched patient.
+    `selected` is the result of parse_fields(); None returns everything.
+    """
+    record = {
+        'patient': _project(PatientSerializer(patient).data, None if selected is None else selected['patient']),
+    }
+
+    for section, (accessor, serializer_class, _) in RELATED_SECTIONS.items():
+        if selected is not None and section not in selected:
+            continue
+        fields = None if selected is None else selected[section]
+        rows = list(getattr(patient, accessor).all())
+
+        if section == 'medical_history':
+            record[section] = _project(serializer_class(rows[0]).data, fields) if rows else None
+        else:
+            record[section] = [_project(row, fields) for row in serializer_class(rows, many=True).data]
+
+    return record
+
+
+def _frozen(fields):
+    return None if fields is None else frozenset(fields)
+
+
+# Related rows get the patient name from the patient row instead of a join
+PROVIDED_COLUMNS = ('patient__patient_name',)
+
+
+def complete_records(patient_ids, selected=None):
+    """
+    Complete record documents of the given patients, in the given order, built
+    from values() rows: one query per selected table and no model instances.
+    Same documents as build_complete_record(); unknown ids are skipped.
+    """
+    patient_ids = list(patient_ids)
+    if not patient_ids:
+        return []
+
+    patient_serializer = row_serializer(PatientSerializer, _frozen(None if selected is None else selected['patient']))
+    patient_columns = dict.fromkeys(('id', 'patient_name') + patient_serializer.columns)
+    patient_rows = {
+        row['id']: row
+        for row in Patient.objects.filter(pk__in=patient_ids).values(*patient_columns)
+    }
+    records = {
+        patient_id: {'patient': patient_serializer.to_representation(row)}
+        for patient_id, row in patient_rows.items()
+    }
+
+    for section, (_, serializer_class, queryset) in RELATED_SECTIONS.items():
+        if selected is not None and section not in selected:
+            continue
+        serializer = row_serializer(
+            serializer_class, _frozen(None if selected is None else selected[section]), PROVIDED_COLUMNS
+        )
+        needs_name = any(column in PROVIDED_COLUMNS for _, column, _, _ in serializer.plan)
+        single = section == 'medical_history'
+        for record in records.values():
+            record[section] = None if single else []
+
+        columns = dict.fromkeys(('patient',) + serializer.columns)
+        for row in queryset.filter(patient__in=list(records)).values(*columns):
+            record = records[row['patient']]
+            if needs_name:
+                row['patient__patient_name'] = patient_rows[row['patient']]['patient_name']
+            if not single:
+                record[section].append(serializer.to_representation(row))
+            elif record[section] is None:
+                record[section] = serializer.to_representation(row)
+
+    return [records[patient_id] for patient_id in patient_ids if patient_id in records]
+
+
+def complete_record(patient_id, selected=None):
+    """
+    Complete record document of one patient.
+    Raises Patient.DoesNotExist for unknown patients.
+    """
+    records = complete_records([patient_id], selected)
+    if not records:
+        raise Patient.DoesNotExist('Patient matching query does not exist.')
+    return records[0]
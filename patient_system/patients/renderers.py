@@ -0,0 +1,92 @@
+"""
+Fast JSON and MessagePack renderers and parsers
+
+ORJSONRenderer/ORJSONParser replace DRF's JSON renderer and parser with
+orjson when it is installed and fall back to the standard json module
+otherwise, so the output stays the same either way. MessagePackRenderer and
+MessagePackParser handle `application/msgpack` and need the msgpack package;
+settings.py only enables them when it is installed.
+
+Clients pick the format through the Accept header (Accept: application/msgpack)
+and send request bodies in either format with the matching Content-Type.
+"""
+from rest_framework import renderers
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser, JSONParser
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+_encoder = JSONEncoder()
+
+
+def _default(obj):
+    """Types orjson/msgpack do not handle natively are encoded like DRF does"""
+    return _encoder.default(obj)
+
+
+def dumps(data, indent=False):
+    """JSON bytes of `data`, encoded with orjson when available"""
+    if orjson is None:
+        return renderers.JSONRenderer().render(data, renderer_context={'indent': 2 if indent else None})
+    option = orjson.OPT_NON_STR_KEYS | orjson.OPT_UTC_Z
+    if indent:
+        option |= orjson.OPT_INDENT_2
+    content = orjson.dumps(data, default=_default, option=option)
+    # Same escaping as DRF, so the output can be embedded in HTML/JS
+    return content.replace('\u2028'.encode(), b'\\u2028').replace('\u2029'.encode(), b'\\u2029')
+
+
+class ORJSONRenderer(renderers.JSONRenderer):
+    """JSONRenderer backed by orjson"""
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None:
+            return super().render(data, accepted_media_type, renderer_context)
+        if data is None:
+            return b''
+        return dumps(data, indent=bool(self.get_indent(accepted_media_type, renderer_context or {})))
+
+
+class ORJSONParser(JSONParser):
+    """JSONParser backed by orjson"""
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        if orjson is None:
+            return super().parse(stream, media_type, parser_context)
+        try:
+            return orjson.loads(stream.read())
+        except orjson.JSONDecodeError as exc:
+            raise ParseError('JSON parse error - %s' % str(exc))
+
+
+class MessagePackRenderer(renderers.BaseRenderer):
+    media_type = 'application/msgpack'
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        # Dates and times travel as ISO strings, like in the JSON responses
+        return msgpack.packb(data, default=_default, use_bin_type=True)
+
+
+class MessagePackParser(BaseParser):
+    media_type = 'application/msgpack'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        try:
+            return msgpack.unpackb(stream.read(), raw=False, strict_map_key=False)
+        except Exception as exc:
+            raise ParseError('MessagePack parse error - %s' % str(exc))
@@ -0,0 +1,144 @@
+"""
+Read replica routing
+
+ReplicaRouter sends the reads of views marked with @read_from_replica to the
+database alias in settings.READ_REPLICA and everything else, including every
+write, to the primary ('default'). With READ_REPLICA set to None every query
+goes to the primary.
+
+The replica lags behind the primary, so only views that can serve slightly
+old data are marked: the API patient list and detail GETs, exports,
+analytics and AI summaries, not pages shown right after a write. The record cache is always filled from the primary (see
+use_primary()), so a stale document never outlives the next write.
+
+Locally the replica is a read-only SQLite snapshot of db.sqlite3, copied
+with SQLite's online backup API by refresh() (manage.py refresh_replica).
+"""
+import functools
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+
+_replica_reads = ContextVar('replica_reads', default=False)
+
+
+def replica_alias():
+    """Alias reads go to inside @read_from_replica views, None without a replica"""
+    alias = getattr(settings, 'READ_REPLICA', None)
+    return alias if alias in connections.databases else None
+
+
+@contextmanager
+def reading_from_replica(enabled=True):
+    """Send the reads of the block to the replica (or, with enabled=False, to the primary)"""
+    token = _replica_reads.set(enabled)
+    try:
+        yield
+    finally:
+        _replica_reads.reset(token)
+
+
+def use_primary():
+    """Send the reads of the block to the primary, e.g. to fill a cache"""
+    return reading_from_replica(False)
+
+
+def read_from_replica(view=None, *, methods=None):
+    """
+    Mark a view as read-only: its queries go to the replica. `methods` limits
+    that to some request methods, for views that also write, e.g.
+    @read_from_replica(methods=('GET', 'HEAD')).
+    """
+    def decorator(view):
+        def enabled(request):
+            return methods is None or request.method in methods
+
+        if iscoroutinefunction(view):
+            @functools.wraps(view)
+            async def wrapper(request, *args, **kwargs):
+                with reading_from_replica(enabled(request)):
+                    return await view(request, *args, **kwargs)
+        else:
+            @functools.wraps(view)
+            def wrapper(request, *args, **kwargs):
+                with reading_from_replica(enabled(request)):
+                    return view(request, *args, **kwargs)
+        return wrapper
+
+    return decorator if view is None else decorator(view)
+
+
+def stream_from_replica(iterable):
+    """
+    Iterate `iterable` reading from the replica. For streaming responses,
+    which run their queries after the view has returned.
+    """
+    iterator = iter(iterable)
+    while True:
+        with reading_from_replica():
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+        yield item
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if _replica_reads.get():
+            return replica_alias() or DEFAULT_DB_ALIAS
+        return DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        # Also for instances read from the replica
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # The replica is a copy of the primary, schema included
+        return db != getattr(settings, 'READ_REPLICA', None)
+
+
+def refresh(path, pages=1024, pause=0.0, progress=None):
+    """
+    Copy the primary SQLite database to `path` with the online backup API,
+    `pages` pages at a time with `pause` seconds between steps so writers are
+    not locked out for the whole copy. The copy is written next to `path` and
+    renamed over it, so readers see either the old or the new snapshot.
+    Returns the number of pages copied.
+    """
+    primary = connections[DEFAULT_DB_ALIAS]
+    if primary.vendor != 'sqlite':
+        raise ValueError('refresh() copies SQLite databases only; use the database replication of your server.')
+    primary.ensure_connection()
+
+    path = str(path)
+    partial = f'{path}.partial'
+    if os.path.exists(partial):
+        os.remove(partial)
+    copied = 0
+
+    def step(status, remaining, total):
+        nonlocal copied
+        copied = total - remaining
+        if progress is not None:
+            progress(copied, total)
+        if pause and remaining:
+            time.sleep(pause)
+
+    target = sqlite3.connect(partial)
+    try:
+        primary.connection.backup(target, pages=pages, progress=step)
+    finally:
+        target.close()
+    os.replace(partial, path)
+    return copied
@@ -0,0 +1,149 @@
+"""
+Patient roster queries
+
+Serves the patient list with related-record counts and the last checkup date,
+read from the denormalized columns on Patient (patients/counters.py), and
+pages through it by patient id (keyset pagination) so the cost of a page does
+not grow with the size of the table.
+
+The roster can be narrowed to patients with a checkup whose vitals fall in
+given ranges (?systolic_min=140&heart_rate_max=60, see patients/vitals.py),
+answered from the indexed numeric vitals columns of CheckUp.
+
+With several shards (patients/sharding.py) every shard returns its first
+page after the cursor and the pages are merged by id.
+
+The HTML patient list (list_page()) pages newest first by id, or, when
+searched, through the patients whose name starts with the search text in
+name order, walking the LOWER(patient_name) index. Either way a page reads
+only its own rows.
+"""
+import string
+
+from django.db.models import Q
+from django.db.models.functions import Lower
+
+from . import sharding
+from .models import Patient, CheckUp
+
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+LIST_PAGE_SIZE = 50
+MAX_LIST_PAGE_SIZE = 200
+LIST_COLUMNS = (
+    'id', 'patient_name', 'version', 'updated_at', 'checkups_count', 'lab_tests_count', 'treatments_count', 'last_checkup_date',
+)
+# Above every other character, so name >= prefix < prefix + _MAX_CHAR keeps the names starting with prefix
+_MAX_CHAR = '\U0010ffff'
+# SQLite's LOWER() only folds ASCII letters
+_ASCII_LOWER = str.maketrans(string.ascii_uppercase, string.ascii_lowercase)
+
+
+def roster_queryset():
+    """Patients with their related-record counts and `last_checkup_date`"""
+    return Patient.objects.all()
+
+
+def with_vitals_in_range(queryset, lookups):
+    """Patients of `queryset` with at least one checkup matching every lookup"""
+    if not lookups:
+        return queryset
+    return queryset.filter(pk__in=CheckUp.objects.filter(**lookups).values('patient_id'))
+
+
+def parse_page_params(params, cursor='after'):
+    """
+    Read the keyset cursor (`after` by default) and `limit` from query parameters.
+    Raises ValueError with a readable message on bad input.
+    """
+    try:
+        after = int(params.get(cursor) or 0)
+        limit = int(params.get('limit') or DEFAULT_PAGE_SIZE)
+    except (TypeError, ValueError):
+        raise ValueError(f"'{cursor}' and 'limit' must be integers.")
+
+    if after < 0:
+        raise ValueError(f"'{cursor}' must not be negative.")
+    if limit < 1:
+        raise ValueError("'limit' must be at least 1.")
+    return after, min(limit, MAX_PAGE_SIZE)
+
+
+def roster_page(after=0, limit=DEFAULT_PAGE_SIZE, queryset=None):
+    """
+    Return (patients, next_after) for the page of patients with id > `after`.
+    `next_after` is None when there are no further pages.
+    """
+    queryset = roster_queryset() if queryset is None else queryset
+    # Fetch one extra row to know whether another page exists
+    pages = sharding.fan_out(lambda: list(queryset.filter(pk__gt=after).order_by('pk')[:limit + 1]))
+    patients = sorted((patient for page in pages for patient in page), key=lambda patient: patient.pk)
+
+    next_after = None
+    if len(patients) > limit:
+        patients = patients[:limit]
+        next_after = patients[-1].pk
+    return patients, next_after
+
+
+def parse_list_params(params):
+    """
+    Read q, cursor and limit of the HTML patient list from query parameters.
+    Raises ValueError with a readable message on bad input.
+    """
+    try:
+        limit = int(params.get('limit') or LIST_PAGE_SIZE)
+    except ValueError:
+        raise ValueError("'limit' must be an integer.")
+    if limit < 1:
+        raise ValueError("'limit' must be at least 1.")
+    return (params.get('q') or '').strip(), params.get('cursor') or None, min(limit, MAX_LIST_PAGE_SIZE)
+
+
+def _name_key(patient):
+    return (patient.patient_name.translate(_ASCII_LOWER), patient.pk)
+
+
+def list_page(query='', cursor=None, limit=LIST_PAGE_SIZE):
+    """
+    Return (patients, next_cursor) for a page of the HTML patient list:
+    newest first, or with `query` the patients whose name starts with it
+    (ignoring case) in name order. `cursor` is the next_cursor of the
+    previous page; next_cursor is None on the last page.
+    Raises ValueError on a cursor that is not one of ours.
+    """
+    queryset = Patient.objects.only(*LIST_COLUMNS)
+    prefix = query.translate(_ASCII_LOWER)
+    if prefix:
+        queryset = (
+            queryset.alias(name_key=Lower('patient_name'))
+            .filter(name_key__gte=prefix, name_key__lt=prefix + _MAX_CHAR)
+            .order_by('name_key', 'pk')
+        )
+        sort_key = _name_key
+    else:
+        queryset = queryset.order_by('-pk')
+        sort_key = lambda patient: -patient.pk
+
+    if cursor:
+        try:
+            if prefix:
+                name, _, pk = cursor.rpartition(':')
+                queryset = queryset.filter(Q(name_key__gt=name) | Q(name_key=name, pk__gt=int(pk)))
+            else:
+                queryset = queryset.filter(pk__lt=int(cursor))
+        except ValueError:
+            raise ValueError('The page link is no longer valid, showing the first page.')
+
+    # Fetch one extra row to know whether another page exists
+    pages = sharding.fan_out(lambda: list(queryset[:limit + 1]))
+    patients = sorted((patient for page in pages for patient in page), key=sort_key)
+
+    next_cursor = None
+    if len(patients) > limit:
+        patients = patients[:limit]
+        last = patients[-1]
+        next_cursor = '%s:%s' % _name_key(last) if prefix else str(last.pk)
+    return patients, next_cursor
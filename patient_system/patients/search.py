@@ -0,0 +1,167 @@
+"""
+Full-text search over clinical text
+
+An SQLite FTS5 table (patients_search, created by migration 0008) holds one
+row per medical history, checkup, lab test, treatment plan and note, with the
+row's clinical text fields as the indexed body and the patient id alongside.
+The FTS rowid encodes the source row: (row id << 3) | model code, so a source
+row is updated or removed with a rowid lookup.
+
+The receivers in patients/signals.py call index_rows() on every write. On
+other database backends the table does not exist and is_enabled() is False.
+Every shard (patients/sharding.py) indexes its own rows; search_patients()
+queries them all and merges the results.
+"""
+import re
+
+from django.db import connections, router
+from django.db.models.expressions import RawSQL
+
+from . import sharding
+from .models import MedicalHistory, CheckUp, LabTests, TreatmentPlan, AdditionalNote
+
+
+TABLE = 'patients_search'
+
+# Indexed model -> (code stored in the rowid, section name, indexed text fields)
+INDEXED_MODELS = {
+    MedicalHistory: (1, 'medical_history', ('past_conditions', 'family_history', 'previous_surgeries', 'allergies')),
+    CheckUp: (2, 'checkups', ('symptoms', 'current_diagnosis', 'physical_exam_findings')),
+    LabTests: (3, 'lab_tests', ('lab_results', 'imaging', 'other_tests')),
+    TreatmentPlan: (4, 'treatments', ('related_disease', 'prescribed_medications', 'procedures',
+                                      'lifestyle_recommendations', 'physiotherapy_advice')),
+    AdditionalNote: (5, 'notes', ('doctor_remarks', 'special_warnings')),
+}
+SECTION_BY_CODE = {code: section for code, section, _ in INDEXED_MODELS.values()}
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+HITS_PER_PATIENT = 5
+
+_WORD = re.compile(r'\w+', re.UNICODE)
+
+
+def _connection():
+    """Connection of the shard in context, where the indexed rows are"""
+    return connections[router.db_for_write(CheckUp)]
+
+
+def is_enabled():
+    return _connection().vendor == 'sqlite'
+
+
+def _rowid(code, pk):
+    return (pk << 3) | code
+
+
+def _body(row, fields):
+    return '\n'.join(row[field] for field in fields if row[field])
+
+
+def index_rows(model, op, rows):
+    """Update the index for `rows`, (row id, patient id) pairs of `model` that were written"""
+    if model not in INDEXED_MODELS or not rows or not is_enabled():
+        return
+    code, _, fields = INDEXED_MODELS[model]
+    pks = [pk for pk, _ in rows]
+
+    with _connection().cursor() as cursor:
+        cursor.executemany(f'DELETE FROM {TABLE} WHERE rowid = %s', [(_rowid(code, pk),) for pk in pks])
+        if op in ('delete', 'archive'):
+            return
+        entries = [
+            (_rowid(code, row['pk']), _body(row, fields), row['patient_id'])
+            for row in model.objects.filter(pk__in=pks).values('pk', 'patient_id', *fields)
+        ]
+        cursor.executemany(
+            f'INSERT INTO {TABLE} (rowid, body, patient_id) VALUES (%s, %s, %s)',
+            [entry for entry in entries if entry[1]]
+        )
+
+
+def rebuild():
+    """Re-index every row of every shard, returns the number of source rows read"""
+    return sum(sharding.fan_out(_rebuild_shard))
+
+
+def _rebuild_shard():
+    with _connection().cursor() as cursor:
+        cursor.execute(f'DELETE FROM {TABLE}')
+    total = 0
+    for model in INDEXED_MODELS:
+        last_id = 0
+        while True:
+            pks = list(model.objects.filter(pk__gt=last_id).order_by('pk').values_list('pk', flat=True)[:1000])
+            if not pks:
+                break
+            index_rows(model, 'create', [(pk, None) for pk in pks])
+            total += len(pks)
+            last_id = pks[-1]
+    return total
+
+
+def match_query(text):
+    """
+    FTS5 MATCH expression for free text: every word must match, as a prefix,
+    so user input can never be an FTS syntax error. None when there are no words.
+    """
+    words = _WORD.findall(text or '')
+    if not words:
+        return None
+    return ' '.join(f'"{word}"*' for word in words)
+
+
+def object_ids(model, match):
+    """Subquery of the ids of `model` rows matching a match_query() expression"""
+    code = INDEXED_MODELS[model][0]
+    return RawSQL(f'SELECT rowid >> 3 FROM {TABLE} WHERE {TABLE} MATCH %s AND (rowid & 7) = %s', (match, code))
+
+
+def search_patients(match, limit=DEFAULT_PAGE_SIZE, offset=0):
+    """
+    Patients with rows matching `match`, best match first, as
+    (results, has_more). Each result has the patient id, its score (higher
+    is better), its number of matching rows and up to HITS_PER_PATIENT
+    hits with a highlighted snippet.
+    """
+    if not sharding.enabled():
+        return _search_shard(match, limit, offset)
+    # Any patient of the page can come from any shard: take the first
+    # offset + limit of each shard and merge them by score
+    pages = sharding.fan_out(_search_shard, match, offset + limit, 0)
+    results = sorted((result for page, _ in pages for result in page), key=lambda r: (-r['score'], r['patient_id']))
+    has_more = len(results) > offset + limit or any(more for _, more in pages)
+    return results[offset:offset + limit], has_more
+
+
+def _search_shard(match, limit, offset):
+    with _connection().cursor() as cursor:
+        cursor.execute(
+            f'SELECT patient_id, min(rank) AS best, count(*) FROM {TABLE} WHERE {TABLE} MATCH %s '
+            # Rows of deleted patients stay indexed until they are purged
+            f'AND patient_id NOT IN (SELECT id FROM patients_patient WHERE deleted_at IS NOT NULL) '
+            f'GROUP BY patient_id ORDER BY best, patient_id LIMIT %s OFFSET %s',
+            (match, limit + 1, offset)
+        )
+        patients = cursor.fetchall()
+        has_more = len(patients) > limit
+        patients = patients[:limit]
+        if not patients:
+            return [], False
+
+        results = {
+            patient_id: {'patient_id': patient_id, 'score': round(-best, 6), 'matches': matches, 'hits': []}
+            for patient_id, best, matches in patients
+        }
+        placeholders = ', '.join(['%s'] * len(results))
+        cursor.execute(
+            f"SELECT rowid, patient_id, snippet({TABLE}, 0, '[', ']', '...', 12) FROM {TABLE} "
+            f'WHERE {TABLE} MATCH %s AND patient_id IN ({placeholders}) ORDER BY rank',
+            (match, *results)
+        )
+        for rowid, patient_id, snippet in cursor.fetchall():
+            hits = results[patient_id]['hits']
+            if len(hits) < HITS_PER_PATIENT:
+                hits.append({'section': SECTION_BY_CODE[rowid & 7], 'id': rowid >> 3, 'snippet': snippet})
+
+    return [results[patient_id] for patient_id, _, _ in patients], has_more
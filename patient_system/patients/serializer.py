@@ -1,7 +1,17 @@
 from rest_framework import serializers
+from rest_framework.validators import UniqueValidator
+from . import sharding
 from .models import Patient, MedicalHistory, CheckUp, LabTests, TreatmentPlan, AdditionalNote
 
 
+class ShardedUniqueValidator(UniqueValidator):
+    """UniqueValidator looking at the patients of every shard"""
+
+    def __call__(self, value, serializer_field):
+        for _ in sharding.each_shard():
+            super().__call__(value, serializer_field)
+
+
 class PatientSerializer(serializers.ModelSerializer):
     class Meta:
         model = Patient
@@ -15,6 +25,16 @@ class PatientSerializer(serializers.ModelSerializer):
             'address': {'required': False, 'allow_blank': True},
         }
 
+    def get_fields(self):
+        fields = super().get_fields()
+        for name in ('phone_number', 'email_address'):
+            fields[name].validators = [
+                ShardedUniqueValidator(validator.queryset, validator.message, validator.lookup)
+                if isinstance(validator, UniqueValidator) else validator
+                for validator in fields[name].validators
+            ]
+        return fields
+
     def validate_age(self, value):
         if value < 0 or value > 150:
             raise serializers.ValidationError("Age must be between 0 and 150.")
@@ -45,7 +65,10 @@ class CheckUpSerializer(serializers.ModelSerializer):
         fields = [
             'id', 'patient', 'patient_name', 'symptoms', 'current_diagnosis',
             'date_of_checkup', 'blood_pressure', 'heart_rate', 'temperature',
-            'weight', 'height', 'bmi', 'physical_exam_findings'
+            'weight', 'height', 'bmi', 'physical_exam_findings',
+            # Parsed from the text fields above, read only (patients/vitals.py)
+            'systolic_bp', 'diastolic_bp', 'heart_rate_bpm', 'temperature_c',
+            'weight_kg', 'height_cm', 'bmi_value'
         ]
         extra_kwargs = {
             'symptoms': {'required': False, 'allow_blank': True},
@@ -62,7 +85,7 @@ class CheckUpSerializer(serializers.ModelSerializer):
 
     def validate_date_of_checkup(self, value):
         from datetime import date
-        if value > date.today():
+        if value and value > date.today():
             raise serializers.ValidationError("Checkup date cannot be in the future.")
         return value
 
@@ -135,4 +158,79 @@ class AdditionalNoteSerializer(serializers.ModelSerializer):
         extra_kwargs = {
             'doctor_remarks': {'required': False, 'allow_blank': True},
             'special_warnings': {'required': False, 'allow_blank': True},
-        }
\ No newline at end of file
+        }
+
+# Bulk import serializers
+# These validate complete patient payloads in list form before any row exists.
+# The bulk writer fills in the patient/checkup relations after inserting the
+# patients (a treatment sent with "checkup": null stays unlinked),
+# and the database unique constraints replace the per-row lookups.
+
+class BulkListSerializer(serializers.ListSerializer):
+    """
+    Validates every item and keeps the valid ones, so a bulk import can report
+    per-record errors without discarding the rest of the list.
+    validated_data holds None and item_errors a non-empty dict for invalid items.
+    """
+    def run_validation(self, data=serializers.empty):
+        self.item_errors = []
+        validated = []
+        for item in data:
+            try:
+                validated.append(self.child.run_validation(item))
+                self.item_errors.append({})
+            except serializers.ValidationError as exc:
+                validated.append(None)
+                self.item_errors.append(exc.detail)
+        return validated
+
+
+class BulkPatientSerializer(PatientSerializer):
+    class Meta(PatientSerializer.Meta):
+        list_serializer_class = BulkListSerializer
+
+    def get_fields(self):
+        fields = super().get_fields()
+        for name in ('phone_number', 'email_address'):
+            fields[name].validators = [
+                validator for validator in fields[name].validators
+                if not isinstance(validator, UniqueValidator)
+            ]
+        return fields
+
+
+class BulkRelatedSerializerMixin:
+    relation_fields = ('patient', 'patient_name', 'checkup', 'checkup_date')
+
+    def get_fields(self):
+        fields = super().get_fields()
+        for name in self.relation_fields:
+            fields.pop(name, None)
+        return fields
+
+
+class BulkMedicalHistorySerializer(BulkRelatedSerializerMixin, MedicalHistorySerializer):
+    class Meta(MedicalHistorySerializer.Meta):
+        list_serializer_class = BulkListSerializer
+
+
+class BulkCheckUpSerializer(BulkRelatedSerializerMixin, CheckUpSerializer):
+    class Meta(CheckUpSerializer.Meta):
+        list_serializer_class = BulkListSerializer
+
+
+class BulkLabTestsSerializer(BulkRelatedSerializerMixin, LabTestsSerializer):
+    class Meta(LabTestsSerializer.Meta):
+        list_serializer_class = BulkListSerializer
+
+
+class BulkTreatmentPlanSerializer(BulkRelatedSerializerMixin, TreatmentPlanSerializer):
+    relation_fields = ('patient', 'patient_name', 'checkup_date')
+
+    class Meta(TreatmentPlanSerializer.Meta):
+        list_serializer_class = BulkListSerializer
+
+
+class BulkAdditionalNoteSerializer(BulkRelatedSerializerMixin, AdditionalNoteSerializer):
+    class Meta(AdditionalNoteSerializer.Meta):
+        list_serializer_class = BulkListSerializer
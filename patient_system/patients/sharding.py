@@ -0,0 +1,358 @@
+"""
+Patient sharding
+
+Spreads patients over the database aliases in settings.SHARDS. A patient and
+all its related rows (history, checkups, lab tests, treatments, notes, its
+archive and their search index entries) live on the same shard. With a single
+shard (the default) none of this is active and every query goes to 'default'.
+
+The PatientShard directory in 'default' maps every patient id to its shard
+and allocates patient ids, so they are unique across shards. New patients go
+to SHARDS[id % len(SHARDS)]; rebalance_shards moves patients afterwards.
+
+ShardRouter sends the queries of patient models to the shard active in the
+current context: views working on one patient run on its shard
+(@on_patient_shard), code working on all patients runs once per shard
+(fan_out(), each_shard(), iterate_on()) and merges the results. The change
+log, table versions and the directory stay in 'default'. Without an active
+shard, queries follow the instance they start from (patient.checkups.all())
+and go to 'default' otherwise, so code writing related rows through
+Model.objects must run inside using_shard().
+
+The unique constraints on phone numbers and emails only hold within a shard,
+so every write path checks them on all shards before writing a patient:
+Patient.validate_unique() (forms, the admin), PatientSerializer (the API) and
+the bulk import.
+"""
+import functools
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, router, transaction
+
+
+SHARDED_MODELS = {'patient', 'medicalhistory', 'checkup', 'labtests', 'treatmentplan', 'additionalnote', 'patientarchive'}
+
+_current_shard = ContextVar('current_shard', default=None)
+
+
+def shards():
+    """Shard aliases, [None] (no shard routing) when sharding is off"""
+    aliases = list(getattr(settings, 'SHARDS', [DEFAULT_DB_ALIAS]))
+    return aliases if len(aliases) > 1 else [None]
+
+
+def enabled():
+    return shards() != [None]
+
+
+def is_sharded(model):
+    return model._meta.app_label == 'patients' and model._meta.model_name in SHARDED_MODELS
+
+
+def active():
+    """Shard set with using_shard() in this context, None without one"""
+    return _current_shard.get()
+
+
+@contextmanager
+def using_shard(alias):
+    """Route the patient queries of the block to `alias` (None: the default routing)"""
+    token = _current_shard.set(alias)
+    try:
+        yield
+    finally:
+        _current_shard.reset(token)
+
+
+def atomic():
+    """transaction.atomic() on the shard of this context"""
+    return transaction.atomic(using=router.db_for_write(_patient_model()))
+
+
+def _patient_model():
+    from .models import Patient
+    return Patient
+
+
+def shard_of(patient_id):
+    """Shard holding a patient: None for unknown patients, 'default' when sharding is off"""
+    if not enabled():
+        return DEFAULT_DB_ALIAS
+    from .models import PatientShard
+    return PatientShard.objects.filter(pk=patient_id).values_list('shard', flat=True).first()
+
+
+def place(patient_id):
+    """Shard a new patient goes to"""
+    aliases = shards()
+    return aliases[patient_id % len(aliases)]
+
+
+def allocate(count=1, shard=None):
+    """Allocate ids for `count` new patients on `shard` (default: place()), as (id, shard) pairs"""
+    from .models import PatientShard
+    if shard is not None:
+        entries = PatientShard.objects.bulk_create([PatientShard(shard=shard) for _ in range(count)])
+        return [(entry.pk, shard) for entry in entries]
+    entries = PatientShard.objects.bulk_create([PatientShard(shard='') for _ in range(count)])
+    placed = {}
+    for entry in entries:
+        placed.setdefault(place(entry.pk), []).append(entry.pk)
+    for alias, ids in placed.items():
+        PatientShard.objects.filter(pk__in=ids).update(shard=alias)
+    return [(entry.pk, place(entry.pk)) for entry in entries]
+
+
+def new_patient():
+    """(id, shard) for a patient about to be created, (None, None) when sharding is off"""
+    return allocate()[0] if enabled() else (None, None)
+
+
+def register_existing():
+    """Add the patients of every shard missing from the directory, returns how many were added"""
+    from .models import Patient, PatientShard
+    added = 0
+    for alias in shards():
+        with using_shard(alias):
+            last_id = 0
+            while True:
+                ids = list(Patient.all_objects.filter(pk__gt=last_id).order_by('pk').values_list('pk', flat=True)[:1000])
+                if not ids:
+                    break
+                known = set(PatientShard.objects.filter(pk__in=ids).values_list('pk', flat=True))
+                PatientShard.objects.bulk_create([PatientShard(pk=pk, shard=alias) for pk in ids if pk not in known])
+                added += len(ids) - len(known)
+                last_id = ids[-1]
+    return added
+
+
+def fan_out(function, *args, **kwargs):
+    """Results of calling `function` once on every shard, in shard order"""
+    results = []
+    for alias in shards():
+        with using_shard(alias):
+            results.append(function(*args, **kwargs))
+    return results
+
+
+def each_shard():
+    """Loop over the shards with each one active in the loop body"""
+    for alias in shards():
+        with using_shard(alias):
+            yield alias
+
+
+def iterate_on(alias, iterable):
+    """Iterate `iterable` with `alias` active, e.g. a generator consumed by a streaming response"""
+    iterator = iter(iterable)
+    while True:
+        with using_shard(alias):
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+        yield item
+
+
+def on_patient_shard(view):
+    """Run a view taking a `patient_id` on the shard of that patient"""
+    if iscoroutinefunction(view):
+        @functools.wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            alias = await sync_to_async(shard_of)(kwargs['patient_id']) if enabled() and kwargs.get('patient_id') else None
+            with using_shard(alias):
+                return await view(request, *args, **kwargs)
+    else:
+        @functools.wraps(view)
+        def wrapper(request, *args, **kwargs):
+            alias = shard_of(kwargs['patient_id']) if enabled() and kwargs.get('patient_id') else None
+            with using_shard(alias):
+                return view(request, *args, **kwargs)
+    return wrapper
+
+
+def _patient_id(instance):
+    return instance.pk if instance._meta.model_name == 'patient' else getattr(instance, 'patient_id', None)
+
+
+class ShardRouter:
+    """Routes patient models to the shard of the current context"""
+
+    def _db(self, model, hints):
+        if not is_sharded(model) or not enabled():
+            return None
+        instance = hints.get('instance')
+        if instance is not None and instance._state.db:
+            return instance._state.db
+        alias = _current_shard.get()
+        if alias is None and instance is not None and _patient_id(instance):
+            alias = shard_of(_patient_id(instance))
+        return alias or DEFAULT_DB_ALIAS
+
+    def db_for_read(self, model, **hints):
+        return self._db(model, hints)
+
+    def db_for_write(self, model, **hints):
+        return self._db(model, hints)
+
+    def allow_relation(self, obj1, obj2, **hints):
+        if is_sharded(type(obj1)) and is_sharded(type(obj2)):
+            return obj1._state.db == obj2._state.db
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return None
+
+
+def _copy_rows(model, rows, target):
+    """
+    Insert `rows` on `target` with their ids, new ids for those already taken
+    there. Returns {old id: new id} of the rows that got a new id.
+    """
+    taken = set(model.objects.using(target).filter(pk__in=[row.pk for row in rows]).values_list('pk', flat=True))
+    old_ids = [row.pk for row in rows]
+    for row in rows:
+        if row.pk in taken:
+            row.pk = None
+        row._state.adding = True
+        row._state.db = target
+    model.objects.using(target).bulk_create(rows)
+    return {old: row.pk for old, row in zip(old_ids, rows) if old != row.pk}
+
+
+def _delete_patient(patient_id):
+    """Delete a patient, its related rows and their index entries from the shard of the context, unlogged"""
+    from .models import Patient, MedicalHistory, CheckUp, LabTests, TreatmentPlan, AdditionalNote, PatientArchive
+    from . import search
+    from .signals import delete_rows
+
+    # Treatments go before the checkups they point to
+    for model in (AdditionalNote, TreatmentPlan, LabTests, CheckUp, MedicalHistory):
+        ids = list(model.objects.filter(patient_id=patient_id).values_list('pk', flat=True))
+        search.index_rows(model, 'delete', [(pk, patient_id) for pk in ids])
+        delete_rows(model, ids)
+    PatientArchive.objects.filter(patient_id=patient_id).delete()
+    delete_rows(Patient, [patient_id])
+
+
+def move_patient(patient_id, target):
+    """
+    Move a patient and its related rows to the `target` shard. Rows keep their
+    ids unless another row of `target` has it; those get a new id, logged as
+    a delete of the old id and a create of the new one. Returns False when the
+    patient is already on `target`.
+
+    The copy to `target` and the delete from the source are two transactions;
+    the change log and the directory are written in a transaction on 'default'
+    that commits after both. A move that failed in between is finished or
+    redone by calling move_patient() again: the source stays authoritative
+    until the directory points to `target`.
+    """
+    from .models import (
+        Patient, MedicalHistory, CheckUp, LabTests, TreatmentPlan, AdditionalNote, PatientArchive, PatientShard,
+        ChangeEvent,
+    )
+    from . import search
+    from .signals import send_rows_changed
+
+    source = shard_of(patient_id)
+    if source is None:
+        raise Patient.DoesNotExist(f'Patient {patient_id} is not in the shard directory.')
+    if source == target:
+        return False
+
+    related_models = (MedicalHistory, CheckUp, LabTests, TreatmentPlan, AdditionalNote)
+    with using_shard(source):
+        patient = Patient.all_objects.filter(pk=patient_id).first()
+        related = {model: list(model.objects.filter(patient_id=patient_id).order_by('pk')) for model in related_models}
+        archive = PatientArchive.objects.filter(patient_id=patient_id).first()
+    with using_shard(target):
+        on_target = Patient.all_objects.filter(pk=patient_id).exists()
+
+    with transaction.atomic(using=DEFAULT_DB_ALIAS):
+        if patient is None:
+            # Interrupted after the source delete: only the directory is left to update
+            if not on_target:
+                raise Patient.DoesNotExist(f'Patient {patient_id} is not on {source} or {target}.')
+            PatientShard.objects.filter(pk=patient_id).update(shard=target)
+            with using_shard(target):
+                send_rows_changed(Patient, 'update', [Patient.all_objects.get(pk=patient_id)])
+            return True
+
+        moved_ids = {model: [row.pk for row in rows] for model, rows in related.items()}
+        # Copied as they are, counters included: the rows stay the same rows
+        with using_shard(target), transaction.atomic(using=target):
+            if on_target:
+                # Left by an interrupted move, the source copy is the current one
+                _delete_patient(patient_id)
+            patient._state.adding = True
+            patient._state.db = target
+            Patient.all_objects.using(target).bulk_create([patient])
+
+            checkup_ids = {pk: pk for pk in moved_ids[CheckUp]}
+            for model, rows in related.items():
+                if model is TreatmentPlan:
+                    # Links to checkups of other patients, left on the source, are dropped
+                    for row in rows:
+                        row.checkup_id = checkup_ids.get(row.checkup_id)
+                remapped = _copy_rows(model, rows, target)
+                if model is CheckUp:
+                    checkup_ids.update(remapped)
+                search.index_rows(model, 'create', [(row.pk, patient_id) for row in rows])
+                ChangeEvent.objects.bulk_create([
+                    ChangeEvent(model=model._meta.model_name, object_id=pk, op=op, patient_id=patient_id)
+                    for old, new in remapped.items()
+                    for op, pk in (('delete', old), ('create', new))
+                ])
+
+            if archive is not None:
+                # Archived rows keep their old ids, restore() picks new ones if taken
+                archive.pk = None
+                archive._state.adding = True
+                archive.save(force_insert=True, using=target)
+
+        with using_shard(source), transaction.atomic(using=source):
+            linked = list(
+                TreatmentPlan.objects.filter(checkup_id__in=moved_ids[CheckUp]).exclude(patient_id=patient_id)
+            )
+            if linked:
+                TreatmentPlan.objects.filter(pk__in=[row.pk for row in linked]).update(checkup=None)
+                send_rows_changed(TreatmentPlan, 'update', linked)
+            _delete_patient(patient_id)
+
+        PatientShard.objects.filter(pk=patient_id).update(shard=target)
+        with using_shard(target):
+            send_rows_changed(Patient, 'update', [patient])
+    return True
+
+
+def plan_rebalance(limit=None):
+    """
+    Moves that even out the number of patients per shard, as
+    (patient id, source, target) tuples, the newest patients of the fullest
+    shards first.
+    """
+    from django.db.models import Count
+    from .models import PatientShard
+
+    aliases = shards()
+    counts = dict.fromkeys(aliases, 0)
+    counts.update(PatientShard.objects.filter(shard__in=aliases).values_list('shard').annotate(n=Count('pk')))
+    moves = []
+    while limit is None or len(moves) < limit:
+        fullest = max(aliases, key=lambda alias: counts[alias])
+        emptiest = min(aliases, key=lambda alias: counts[alias])
+        if counts[fullest] - counts[emptiest] <= 1:
+            break
+        planned = {pk for pk, source, _ in moves if source == fullest}
+        candidate = (PatientShard.objects.filter(shard=fullest).exclude(pk__in=planned)
+                     .order_by('-pk').values_list('pk', flat=True).first())
+        if candidate is None:
+            break
+        moves.append((candidate, fullest, emptiest))
+        counts[fullest] -= 1
+        counts[emptiest] += 1
+    return moves
@@ -0,0 +1,107 @@
+"""
+Change notifications for patient data
+
+Every write to a Patient or one of its related models ends up calling the
+receivers registered here, either through Django's post_save/post_delete
+signals or, for bulk writes that bypass them (bulk_create, bulk_update), through
+the rows_changed signal sent by the bulk write paths. The receivers append
+every write to the change log and keep the per-patient counters, the search
+index, the record cache and the version stamps in step with the data.
+"""
+from django.db import connections, router, transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import Signal, receiver
+
+from .models import Patient, MedicalHistory, CheckUp, LabTests, TreatmentPlan, AdditionalNote, ChangeEvent
+from . import cache, counters, search, sharding, versioning
+
+
+PATIENT_MODELS = (Patient, MedicalHistory, CheckUp, LabTests, TreatmentPlan, AdditionalNote)
+
+# Ids per DELETE statement of delete_rows(), below SQLite's parameter limit
+DELETE_CHUNK_SIZE = 500
+
+# Sent by bulk write paths. sender=model class, op='create'|'update'|'delete'|
+# 'archive'|'restore' (rows moved to and from PatientArchive), rows=list of
+# (row id, patient id) pairs, using=database alias the rows were
+# written to (None: the shard of the current context)
+rows_changed = Signal()
+
+
+def patient_id_of(instance):
+    """Id of the patient a Patient or related row belongs to"""
+    if isinstance(instance, Patient):
+        return instance.pk
+    return instance.patient_id
+
+
+def send_rows_changed(model, op, objects):
+    """Notify receivers about rows written in bulk, all to the same database"""
+    rows = [(obj.pk, patient_id_of(obj)) for obj in objects]
+    if rows:
+        rows_changed.send(sender=model, op=op, rows=rows, using=objects[0]._state.db)
+
+
+def delete_rows(model, pks):
+    """
+    Delete rows of `model` by id with one DELETE per chunk and no post_delete,
+    on the shard of the context. Callers notify rows_changed themselves;
+    QuerySet.delete() would load and signal the rows one by one.
+    """
+    pks = list(pks)
+    connection = connections[router.db_for_write(model)]
+    table = connection.ops.quote_name(model._meta.db_table)
+    column = connection.ops.quote_name(model._meta.pk.column)
+    with connection.cursor() as cursor:
+        for start in range(0, len(pks), DELETE_CHUNK_SIZE):
+            chunk = pks[start:start + DELETE_CHUNK_SIZE]
+            cursor.execute(f'DELETE FROM {table} WHERE {column} IN ({", ".join(["%s"] * len(chunk))})', chunk)
+
+
+def patient_data_changed(model, op, rows, using=None):
+    """
+    Record writes to rows of `model`, given as (row id, patient id) pairs
+    written to the `using` database: append them to the change log, adjust
+    the patients' counters, update the full-text index, bump the version
+    stamps of the patients and of the tables, and drop the patients' cached
+    documents now and again once the transaction commits.
+    """
+    model_name = model._meta.model_name
+    ChangeEvent.objects.bulk_create([
+        ChangeEvent(model=model_name, object_id=pk, op=op, patient_id=patient_id)
+        for pk, patient_id in rows
+    ])
+
+    # The counters, index and versions are on the database of the rows, which
+    # is not the shard of the context when a row is saved through its instance
+    with sharding.using_shard(using or sharding.active()):
+        counters.apply_row_changes(model, op, rows)
+        search.index_rows(model, op, rows)
+        patient_ids = {patient_id for _, patient_id in rows}
+        versioning.bump_patients(patient_ids)
+        using = router.db_for_write(model)
+    versioning.bump_table()
+    cache.invalidate(patient_ids)
+    transaction.on_commit(lambda: cache.invalidate(patient_ids), using=using)
+
+
+def patient_data_saved(sender, instance, created, **kwargs):
+    patient_data_changed(
+        sender, 'create' if created else 'update', [(instance.pk, patient_id_of(instance))], kwargs['using']
+    )
+
+
+def patient_data_deleted(sender, instance, **kwargs):
+    patient_data_changed(sender, 'delete', [(instance.pk, patient_id_of(instance))], kwargs['using'])
+
+
+# Connected per model: a post_delete receiver for every sender would turn off
+# Django's fast deletes (one DELETE per query) for every model of the project
+for model in PATIENT_MODELS:
+    post_save.connect(patient_data_saved, sender=model, dispatch_uid=f'patient_data_saved_{model.__name__}')
+    post_delete.connect(patient_data_deleted, sender=model, dispatch_uid=f'patient_data_deleted_{model.__name__}')
+
+
+@receiver(rows_changed)
+def patient_rows_changed(sender, op, rows, using=None, **kwargs):
+    patient_data_changed(sender, op, rows, using)
@@ -0,0 +1,327 @@
+"""
+Shared pieces of the AI summary views
+
+Prompt templates, text extraction from uploaded reports and the summary
+engine, used by both the sync views in ai_views.py and the async views in
+async_ai_views.py so the two produce identical responses. The engine is
+created once per process when the app starts (apps.py) and shared by every
+request.
+"""
+import io
+import itertools
+import json
+import os
+import sys
+import threading
+
+import pytesseract
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from dotenv import load_dotenv
+from rest_framework import status
+
+pytesseract.pytesseract.tesseract_cmd = r'C:/Program Files/Tesseract-OCR/tesseract'  # manual path of tesseract if needed
+
+
+TEXT_SUMMARY_MODEL = "gemini-2.0-flash-exp"
+
+TEXT_SUMMARY_TEMPLATE = """
+You are a helpful medical assistant.
+
+Your job is to analyze the following medical report text and create a concise summary of 7-10 lines.
+
+Rules:
+- Extract patient name, age, and gender if mentioned
+- Identify the main diagnosis or medical condition
+- Mention key symptoms and vital signs
+- List prescribed medications if any
+- Include treatment recommendations
+- Highlight any allergies or warnings
+- Add a risk assessment at the end
+- Use bold (**text**) for important medical terms
+- Be clear, concise, and patient-friendly
+
+Medical Report Text:
+{text}
+"""
+
+FILE_SUMMARY_TEMPLATE = """
+You are a helpful medical assistant.
+
+Your job is to analyze the following medical report and create a concise summary of 7-10 lines.
+
+Rules:
+- Extract patient name, age, and gender if mentioned
+- Identify the main diagnosis or medical condition
+- Mention key symptoms and vital signs
+- List prescribed medications if any
+- Include treatment recommendations
+- Highlight any allergies or warnings
+- Add a risk assessment at the end
+- Use bold (**text**) for important medical terms
+- Be clear, concise, and patient-friendly
+
+Medical Report:
+{text}
+"""
+
+# Location of prompt_template.py, which holds the record summary prompt shared
+# with the Gradio app
+PROMPT_ENGINEERING_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+    'gradio', 'prompt_engineering'
+)
+
+RECORD_SUMMARY_MODEL = "gemini-2.5-flash-lite"
+
+# Prompt name -> (model, input variable of the template)
+PROMPTS = {
+    'record': (RECORD_SUMMARY_MODEL, 'record'),
+    'text': (TEXT_SUMMARY_MODEL, 'text'),
+    'file': (TEXT_SUMMARY_MODEL, 'text'),
+}
+
+DEFAULT_CLIENT_POOL_SIZE = 4
+
+NO_DATA_SUMMARY = "No Data Found!"
+
+SUPPORTED_EXTENSIONS = ['.txt', '.pdf', '.doc', '.docx', '.jpg', '.jpeg', '.png']
+
+
+class FileExtractionError(Exception):
+    """Text could not be extracted from an upload; carries the error response"""
+
+    def __init__(self, payload, status_code):
+        super().__init__(payload.get('error'))
+        self.payload = payload
+        self.status_code = status_code
+
+
+def _record_template():
+    """SUMMARY_TEMPLATE of gradio/prompt_engineering/prompt_template.py"""
+    if PROMPT_ENGINEERING_PATH not in sys.path:
+        sys.path.insert(0, PROMPT_ENGINEERING_PATH)
+
+    from prompt_template import SUMMARY_TEMPLATE
+    return SUMMARY_TEMPLATE
+
+
+class SummaryEngine:
+    """
+    Writes the summaries of the AI endpoints with prompts and Gemini clients
+    created once per process.
+
+    The API key is read when the engine is created. The prompt templates, a
+    pool of `pool_size` clients per model and a chain for every prompt and
+    client are built on the first summary, under a lock, and never change
+    afterwards. Calls take the chains of a prompt in turn and keep their
+    inputs in local variables, so one engine serves every thread and event
+    loop of the process.
+    """
+
+    def __init__(self, api_key=None, pool_size=DEFAULT_CLIENT_POOL_SIZE):
+        self.api_key = api_key
+        self.pool_size = pool_size
+        self._chains = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_settings(cls):
+        """Engine with the key from the environment (or .env) and settings.SUMMARY_CLIENT_POOL_SIZE"""
+        load_dotenv()
+        return cls(
+            api_key=os.getenv("GOOGLE_API_KEY"),
+            pool_size=getattr(settings, 'SUMMARY_CLIENT_POOL_SIZE', DEFAULT_CLIENT_POOL_SIZE),
+        )
+
+    def _build_chains(self):
+        """Prompt name -> list of prompt | model chains, one per pooled client"""
+        from langchain.prompts import PromptTemplate
+        from langchain_google_genai import ChatGoogleGenerativeAI
+
+        templates = {'record': _record_template(), 'text': TEXT_SUMMARY_TEMPLATE, 'file': FILE_SUMMARY_TEMPLATE}
+        clients = {
+            model: [
+                ChatGoogleGenerativeAI(model=model, google_api_key=self.api_key, temperature=0.7)
+                for _ in range(self.pool_size)
+            ]
+            for model in {model for model, _ in PROMPTS.values()}
+        }
+
+        chains = {}
+        for name, (model, variable) in PROMPTS.items():
+            prompt = PromptTemplate(input_variables=[variable], template=templates[name])
+            chains[name] = [prompt | llm for llm in clients[model]]
+        return chains
+
+    def _chain(self, name):
+        """Next chain of a prompt. Raises ValueError without an API key, ImportError without langchain."""
+        if self._chains is None:
+            if not self.api_key:
+                raise ValueError("No API key found. Please set GOOGLE_API_KEY environment variable and restart.")
+            with self._lock:
+                if self._chains is None:
+                    self._chains = {key: itertools.cycle(chains) for key, chains in self._build_chains().items()}
+        return next(self._chains[name])
+
+    @staticmethod
+    def _inputs(name, content):
+        if name == 'record':
+            content = json.dumps(content, indent=2)
+        return {PROMPTS[name][1]: content}
+
+    def summarize(self, name, content):
+        """
+        Summary of `content` with the `name` prompt: a complete record
+        document for 'record', report text for 'text' and 'file'.
+        """
+        if not content:
+            return NO_DATA_SUMMARY
+        return summary_text(self._chain(name).invoke(self._inputs(name, content)))
+
+    async def asummarize(self, name, content):
+        """summarize() awaiting the model instead of blocking on it"""
+        if not content:
+            return NO_DATA_SUMMARY
+        if self._chains is None:
+            # Building the clients imports langchain; keep it off the event loop
+            chain = await sync_to_async(self._chain, thread_sensitive=False)(name)
+        else:
+            chain = self._chain(name)
+        return summary_text(await chain.ainvoke(self._inputs(name, content)))
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def start_engine():
+    """Create the process wide engine, called by PatientsConfig.ready()"""
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = SummaryEngine.from_settings()
+    return _engine
+
+
+def get_engine():
+    """The process wide SummaryEngine"""
+    return _engine or start_engine()
+
+
+def summary_text(raw_summary):
+    """Plain text of a chain result"""
+    from langchain_core.messages.utils import get_buffer_string
+    return get_buffer_string([raw_summary])
+
+
+def extract_text_from_file(uploaded_file):
+    """
+    Text of an uploaded report (.txt, image via OCR, .pdf).
+    Raises FileExtractionError with the error response payload on failure.
+    """
+    filename = uploaded_file.name
+    file_size = uploaded_file.size
+    file_extension = os.path.splitext(filename)[1].lower()
+    extracted_text = ""
+
+    try:
+        if file_extension == '.txt':
+            # Read text file directly
+            extracted_text = uploaded_file.read().decode('utf-8')
+
+        elif file_extension in ['.jpg', '.jpeg', '.png']:
+            # Image file - OCR using pytesseract
+            try:
+                from PIL import Image
+
+                # Read image from uploaded file
+                image = Image.open(uploaded_file)
+
+                # Perform OCR
+                extracted_text = pytesseract.image_to_string(image)
+
+            except ImportError:
+                raise FileExtractionError({
+                    'error': 'OCR library not installed',
+                    'details': 'pytesseract or Pillow is not installed',
+                    'note': 'Install with: pip install pytesseract Pillow',
+                    'filename': filename
+                }, status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+            except Exception as ocr_error:
+                raise FileExtractionError({
+                    'error': 'OCR processing failed',
+                    'details': str(ocr_error),
+                    'note': 'Make sure Tesseract is installed on your system',
+                    'filename': filename
+                }, status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+            if not extracted_text.strip():
+                raise FileExtractionError({
+                    'error': 'No text found in image',
+                    'details': 'OCR could not extract any text from the image',
+                    'note': 'Please ensure the image contains readable text',
+                    'filename': filename
+                }, status.HTTP_400_BAD_REQUEST)
+
+        elif file_extension == '.pdf':
+            # PDF file - extract text using pdfplumber
+            try:
+                import pdfplumber
+
+                # Read PDF from uploaded file
+                pdf_bytes = uploaded_file.read()
+                pdf_file = io.BytesIO(pdf_bytes)
+
+                # Extract text from all pages
+                with pdfplumber.open(pdf_file) as pdf:
+                    for page in pdf.pages:
+                        page_text = page.extract_text()
+                        if page_text:
+                            extracted_text += page_text + "\n"
+
+            except ImportError:
+                raise FileExtractionError({
+                    'error': 'PDF library not installed',
+                    'details': 'pdfplumber is not installed',
+                    'note': 'Install with: pip install pdfplumber',
+                    'filename': filename
+                }, status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+            except Exception as pdf_error:
+                raise FileExtractionError({
+                    'error': 'PDF processing failed',
+                    'details': str(pdf_error),
+                    'filename': filename
+                }, status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+            if not extracted_text.strip():
+                raise FileExtractionError({
+                    'error': 'No text found in PDF',
+                    'details': 'PDF appears to be empty or contains only images',
+                    'note': 'For image-based PDFs, consider converting to images first',
+                    'filename': filename
+                }, status.HTTP_400_BAD_REQUEST)
+
+        elif file_extension in ['.doc', '.docx']:
+            # Word document - placeholder
+            raise FileExtractionError({
+                'error': 'Word document extraction not implemented',
+                'details': 'Word document extraction needs to be implemented manually',
+                'note': 'Please implement Word document extraction using python-docx',
+                'filename': filename,
+                'file_size': file_size
+            }, status.HTTP_501_NOT_IMPLEMENTED)
+
+    except FileExtractionError:
+        raise
+
+    except Exception as read_error:
+        raise FileExtractionError({
+            'error': 'Failed to read file',
+            'details': str(read_error),
+            'filename': filename
+        }, status.HTTP_400_BAD_REQUEST)
+
+    return extracted_text
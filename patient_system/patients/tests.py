@@ -1,3 +1,1432 @@
-from django.test import TestCase
+import io
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from datetime import date, timedelta
+from unittest import mock, skipIf, skipUnless
 
-# Create your tests here.
+import numpy as np
+from asgiref.sync import async_to_sync, iscoroutinefunction
+from django.core.management import CommandError, call_command
+from django.core.cache import caches
+from django.core.exceptions import ValidationError
+from django.db import connection, connections
+from django.db.models.deletion import Collector
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+
+from .models import (
+    Patient, MedicalHistory, CheckUp, LabTests, TreatmentPlan, AdditionalNote, ChangeEvent, PurgeJob, PatientArchive,
+)
+from . import analytics, cache as record_cache, counters, purge, replica, sharding, summaries, timeseries, vitals
+from .querybudget import QueryBudgetExceeded, QueryBudgetMiddleware
+from .renderers import dumps, msgpack
+from .records import build_complete_record, complete_patient_queryset, complete_records, parse_fields
+
+
+def make_patient(index, **extra):
+    """Create a patient with unique contact details"""
+    data = {
+        'patient_name': f'Patient {index}',
+        'guardian_name': f'Guardian {index}',
+        'age': 30 + index % 40,
+        'gender': 'Male' if index % 2 else 'Female',
+        'blood_group': 'O+',
+        'date_of_birth': date(1990, 1, 1),
+        'phone_number': f'+1202555{index:04d}',
+        'email_address': f'patient{index}@example.com',
+    }
+    data.update(extra)
+    return Patient.objects.create(**data)
+
+
+def make_history(patient, checkups=2):
+    """Attach one row of every related model, plus `checkups` checkups"""
+    MedicalHistory.objects.create(patient=patient, allergies='Penicillin')
+    for day in range(1, checkups + 1):
+        CheckUp.objects.create(
+            patient=patient, symptoms='Cough', date_of_checkup=date(2024, 1, day),
+            blood_pressure='120/80', heart_rate='72', temperature='98.6',
+            weight='70', height='170', bmi='24.2',
+        )
+    LabTests.objects.create(patient=patient, lab_results='Normal')
+    TreatmentPlan.objects.create(patient=patient, related_disease='Flu', assigned_doctor='Dr. Ali')
+    AdditionalNote.objects.create(patient=patient, doctor_remarks='Rest')
+
+
+class PatientRosterTests(TestCase):
+    url = '/patient-app/api/patients/'
+
+    def setUp(self):
+        self.client = APIClient()
+        self.patients = [make_patient(i) for i in range(5)]
+        for patient in self.patients:
+            make_history(patient, checkups=3)
+
+    def test_roster_uses_single_query(self):
+        # Table version for the ETag, then the roster itself
+        with self.assertNumQueries(2):
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['count'], 5)
+
+    def test_roster_counts_and_last_checkup(self):
+        response = self.client.get(self.url)
+        first = response.data['patients'][0]
+        self.assertEqual(first['medical_history_count'], 1)
+        self.assertEqual(first['checkups_count'], 3)
+        self.assertEqual(first['lab_tests_count'], 1)
+        self.assertEqual(first['treatments_count'], 1)
+        self.assertEqual(first['notes_count'], 1)
+        self.assertEqual(first['last_checkup_date'], date(2024, 1, 3))
+
+    def test_roster_keyset_pagination(self):
+        response = self.client.get(self.url, {'limit': 2})
+        ids = [p['id'] for p in response.data['patients']]
+        self.assertEqual(ids, [p.id for p in self.patients[:2]])
+        self.assertEqual(response.data['next_after'], ids[-1])
+
+        response = self.client.get(self.url, {'after': ids[-1], 'limit': 10})
+        self.assertEqual([p['id'] for p in response.data['patients']], [p.id for p in self.patients[2:]])
+        self.assertIsNone(response.data['next_after'])
+
+    def test_roster_rejects_bad_page_params(self):
+        response = self.client.get(self.url, {'limit': 'abc'})
+        self.assertEqual(response.status_code, 400)
+
+
+def complete_payload(index, **patient_extra):
+    """Complete patient payload as accepted by the create endpoints"""
+    patient = {
+        'patient_name': f'Bulk {index}',
+        'guardian_name': 'Guardian',
+        'age': 40,
+        'gender': 'Female',
+        'blood_group': 'A+',
+        'date_of_birth': '1985-05-05',
+        'phone_number': f'+1202556{index:04d}',
+        'email_address': f'bulk{index}@example.com',
+    }
+    patient.update(patient_extra)
+    return {
+        'patient': patient,
+        'medical_history': {'allergies': 'None'},
+        'checkups': [
+            {'symptoms': 'Fever', 'date_of_checkup': '2024-02-01', 'heart_rate': '80'},
+            {'symptoms': 'Follow-up', 'date_of_checkup': '2024-03-01'},
+        ],
+        'lab_tests': [{'lab_results': 'CBC normal'}],
+        'treatments': [{'related_disease': 'Flu', 'assigned_doctor': 'Dr. Ali'}],
+        'notes': [{'doctor_remarks': 'Hydrate'}],
+    }
+
+
+class BulkCreateTests(TestCase):
+    url = '/patient-app/api/patients/bulk/'
+
+    def setUp(self):
+        self.client = APIClient()
+
+    def test_bulk_create_writes_every_table(self):
+        payloads = [complete_payload(i) for i in range(3)]
+        response = self.client.post(self.url, payloads, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['created'], 3)
+        self.assertEqual(CheckUp.objects.count(), 6)
+        self.assertEqual(MedicalHistory.objects.count(), 3)
+        treatment = TreatmentPlan.objects.select_related('checkup').first()
+        self.assertEqual(treatment.checkup.patient_id, treatment.patient_id)
+
+    def test_bulk_create_rejects_checkups_of_other_patients(self):
+        existing = make_patient(9)
+        make_history(existing)
+        linked, unlinked = complete_payload(0), complete_payload(1)
+        linked['treatments'][0]['checkup'] = existing.checkups.first().id
+        unlinked['treatments'][0]['checkup'] = None
+        response = self.client.post(self.url, [linked, unlinked], format='json')
+        self.assertEqual(response.data['created'], 1)
+        self.assertEqual(response.data['errors'][0]['index'], 0)
+        self.assertIn('checkup', response.data['errors'][0]['errors']['treatments'][0])
+        self.assertFalse(TreatmentPlan.objects.filter(checkup=existing.checkups.first()).exclude(patient=existing))
+        self.assertIsNone(TreatmentPlan.objects.get(patient__patient_name='Bulk 1').checkup_id)
+
+    def test_bulk_create_reports_per_record_errors(self):
+        payloads = [
+            complete_payload(0),
+            complete_payload(1, age=500),
+            complete_payload(2, phone_number='+12025560000'),  # duplicates record 0
+            complete_payload(3),
+        ]
+        response = self.client.post(self.url, {'patients': payloads}, format='json')
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual(response.data['created'], 2)
+        self.assertEqual([error['index'] for error in response.data['errors']], [1, 2])
+        self.assertIn('patient', response.data['errors'][0]['errors'])
+        self.assertEqual(Patient.objects.count(), 2)
+
+
+class PatientExportTests(TestCase):
+    url = '/patient-app/api/patients/export/'
+
+    def setUp(self):
+        self.client = APIClient()
+        self.patients = [make_patient(i) for i in range(3)]
+        for patient in self.patients:
+            make_history(patient)
+
+    def read_lines(self, response):
+        content = b''.join(response.streaming_content).decode()
+        return [json.loads(line) for line in content.splitlines()]
+
+    def test_export_matches_detail_endpoint(self):
+        records = self.read_lines(self.client.get(self.url))
+        self.assertEqual(len(records), 3)
+        detail = self.client.get(f'/patient-app/api/patients/{self.patients[0].id}/')
+        self.assertEqual(records[0], json.loads(detail.content))
+
+    def test_export_fields_and_since(self):
+        CheckUp.objects.create(patient=self.patients[1], date_of_checkup=date(2025, 6, 1))
+        response = self.client.get(self.url, {'since': '2025-01-01', 'fields': 'patient_name,checkups.date_of_checkup'})
+        records = self.read_lines(response)
+        self.assertEqual(len(records), 1)
+        self.assertEqual(set(records[0]), {'patient', 'checkups'})
+        self.assertEqual(records[0]['patient'], {'id': self.patients[1].id, 'patient_name': 'Patient 1'})
+        self.assertEqual(records[0]['checkups'][0], {'date_of_checkup': '2025-06-01'})
+
+
+class PatientEditFormTests(TestCase):
+
+    def setUp(self):
+        self.patient = make_patient(1)
+        make_history(self.patient, checkups=2)
+        self.treatment = self.patient.treatments.get()
+        self.treatment.checkup = self.patient.checkups.order_by('pk').first()
+        self.treatment.save()
+        self.url = f'/patient-app/patients/{self.patient.id}/edit/'
+
+    def form_data(self):
+        """POST data equivalent to re-submitting the edit form unchanged"""
+        context = self.client.get(self.url).context
+        data = {}
+        for name in ('patient_form', 'medical_history_form'):
+            form = context[name]
+            for field in form:
+                value = form.initial.get(field.name)
+                data[field.html_name] = '' if value is None else str(value)
+        for name in ('checkup_formset', 'lab_tests_formset', 'treatment_formset', 'notes_formset'):
+            formset = context[name]
+            management = formset.management_form
+            for field in management:
+                data[field.html_name] = management.initial[field.name]
+            for form in formset.forms[:formset.initial_form_count()]:
+                for field in form:
+                    if field.name == 'DELETE':
+                        continue
+                    value = form.initial.get(field.name)
+                    data[field.html_name] = '' if value is None else str(value)
+            data[management['TOTAL_FORMS'].html_name] = formset.initial_form_count()
+        return data
+
+    def test_edit_updates_only_changed_rows(self):
+        checkup_ids = set(self.patient.checkups.values_list('pk', flat=True))
+        data = self.form_data()
+        data['checkups-0-symptoms'] = 'Headache'
+
+        response = self.client.post(self.url, data)
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(set(self.patient.checkups.values_list('pk', flat=True)), checkup_ids)
+        self.assertEqual(self.patient.checkups.filter(symptoms='Headache').count(), 1)
+        self.treatment.refresh_from_db()
+        self.assertIsNotNone(self.treatment.checkup_id)
+
+    def test_edit_deletes_removed_rows(self):
+        data = self.form_data()
+        data['checkups-1-DELETE'] = 'on'
+        self.client.post(self.url, data)
+        self.assertEqual(self.patient.checkups.count(), 1)
+
+
+class PatientPatchTests(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.patient = make_patient(1)
+        make_history(self.patient, checkups=2)
+        self.url = f'/patient-app/api/patients/{self.patient.id}/'
+
+    def test_patch_creates_updates_and_deletes_rows(self):
+        first, second = self.patient.checkups.order_by('pk')
+        note = self.patient.notes.get()
+        response = self.client.patch(self.url, {
+            'checkups': [
+                {'id': first.id, 'symptoms': 'Headache'},
+                {'id': second.id, '_delete': True},
+                {'symptoms': 'New visit', 'date_of_checkup': '2024-05-01'},
+            ],
+            'notes': [{'id': note.id, 'special_warnings': 'Fall risk'}],
+        }, format='json')
+        self.assertEqual(response.status_code, 200)
+
+        changed = response.data['data']
+        self.assertEqual(set(changed), {'checkups', 'notes'})
+        self.assertEqual(changed['checkups']['deleted'], [second.id])
+        self.assertEqual(changed['checkups']['updated'][0]['symptoms'], 'Headache')
+        self.assertEqual(changed['checkups']['created'][0]['symptoms'], 'New visit')
+        self.assertEqual(self.patient.checkups.count(), 2)
+        note.refresh_from_db()
+        self.assertEqual(note.special_warnings, 'Fall risk')
+        self.assertEqual(note.doctor_remarks, 'Rest')
+
+    def test_patch_rejects_rows_of_other_patients(self):
+        other = make_patient(2)
+        make_history(other)
+        foreign = other.checkups.first()
+        response = self.client.patch(self.url, {
+            'patient': {'age': 41},
+            'checkups': [{'id': foreign.id, 'symptoms': 'Hijack'}],
+        }, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.patient.refresh_from_db()
+        self.assertNotEqual(self.patient.age, 41)
+
+        treatment = self.patient.treatments.get()
+        response = self.client.patch(self.url, {'treatments': [{'id': treatment.id, 'checkup': foreign.id}]},
+                                     format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('checkup', response.data['details'][0])
+        treatment.refresh_from_db()
+        self.assertNotEqual(treatment.checkup_id, foreign.id)
+
+    def test_unknown_patient_is_not_found(self):
+        url = '/patient-app/api/patients/999999/'
+        self.assertEqual(self.client.patch(url, {'patient': {'age': 41}}, format='json').status_code, 404)
+        self.assertEqual(self.client.put(url, {'patient': {'age': 41}}, format='json').status_code, 404)
+
+
+class RecordCacheTests(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.patient = make_patient(1)
+        make_history(self.patient)
+        self.url = f'/patient-app/api/patients/{self.patient.id}/'
+        record_cache.get_cache().clear()
+        record_cache.stats.reset()
+
+    def test_unchanged_patient_is_served_from_cache(self):
+        first = self.client.get(self.url)
+        # Only the version stamp read for the ETag, no related tables
+        with self.assertNumQueries(1):
+            second = self.client.get(self.url)
+        self.assertEqual(first.data, second.data)
+        self.assertEqual(record_cache.stats.as_dict()['hits'], 1)
+        self.assertEqual(record_cache.stats.as_dict()['misses'], 1)
+
+    def test_writes_invalidate_cached_record(self):
+        self.client.get(self.url)
+        checkup = self.patient.checkups.first()
+        checkup.symptoms = 'Changed'
+        checkup.save()
+        self.assertIn('Changed', [c['symptoms'] for c in self.client.get(self.url).data['checkups']])
+
+        self.client.patch(self.url, {'notes': [{'doctor_remarks': 'Bulk inserted'}]}, format='json')
+        self.assertEqual(len(self.client.get(self.url).data['notes']), 2)
+
+        LabTests.objects.filter(patient=self.patient).delete()
+        self.assertEqual(self.client.get(self.url).data['lab_tests'], [])
+
+    def test_detail_page_renders_cached_record(self):
+        response = self.client.get(f'/patient-app/patients/{self.patient.id}/')
+        self.assertContains(response, 'Jan. 2, 2024')
+        self.assertContains(response, 'History for Patient 1')
+
+
+class ConditionalGetTests(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.patient = make_patient(1)
+        make_history(self.patient)
+        self.url = f'/patient-app/api/patients/{self.patient.id}/'
+
+    def test_detail_etag_and_not_modified(self):
+        response = self.client.get(self.url)
+        etag = response['ETag']
+        self.assertIn('Last-Modified', response)
+
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        checkup = self.patient.checkups.first()
+        checkup.heart_rate = '90'
+        checkup.save()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_etag_depends_on_the_negotiated_format(self):
+        response = self.client.get(self.url)
+        self.assertIn('Accept', response['Vary'])
+        html = self.client.get(self.url, HTTP_ACCEPT='text/html', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(html.status_code, 200)
+        self.assertNotEqual(html['ETag'], response['ETag'])
+        self.assertIn('Accept', html['Vary'])
+
+    def test_list_etag_follows_table_version(self):
+        url = '/patient-app/api/patients/'
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.assertNotEqual(self.client.get(url, {'limit': 5})['ETag'], etag)
+
+        make_patient(2)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+class ChangesFeedTests(TestCase):
+    url = '/patient-app/api/changes/'
+
+    def setUp(self):
+        self.client = APIClient()
+
+    def test_feed_reports_creates_updates_and_deletes(self):
+        since = self.client.get(self.url).data['next_since']
+        patient = make_patient(1)
+        checkup = CheckUp.objects.create(patient=patient, symptoms='Cough')
+        checkup.symptoms = 'Fever'
+        checkup.save()
+        checkup.delete()
+
+        changes = self.client.get(self.url, {'since': since}).data['changes']
+        self.assertEqual(
+            [(c['model'], c['op'], c['patient_id']) for c in changes],
+            [('patient', 'create', patient.id), ('checkup', 'create', patient.id),
+             ('checkup', 'update', patient.id), ('checkup', 'delete', patient.id)]
+        )
+
+    def test_feed_pages_and_includes_bulk_writes(self):
+        self.client.post('/patient-app/api/patients/bulk/', [complete_payload(1)], format='json')
+        first = self.client.get(self.url, {'limit': 3}).data
+        self.assertTrue(first['has_more'])
+        rest = self.client.get(self.url, {'since': first['next_since'], 'limit': 100}).data
+        self.assertFalse(rest['has_more'])
+        models = [c['model'] for c in first['changes'] + rest['changes']]
+        self.assertEqual(models.count('checkup'), 2)
+        self.assertEqual(len(models), 7)
+
+
+class AsyncSummaryTests(TestCase):
+    def test_async_record_read_matches_sync_and_uses_cache(self):
+        patient = make_patient(1)
+        make_history(patient)
+        record_cache.get_cache().clear()
+        record_cache.stats.reset()
+
+        record = async_to_sync(record_cache.aget_complete_record)(patient.id)
+        self.assertEqual(record, record_cache.get_complete_record(patient.id))
+        self.assertEqual(record_cache.stats.as_dict()['hits'], 1)
+
+    def test_async_text_summary_validates_like_sync(self):
+        url = '/patient-app/api/async/summary/text/'
+        response = self.client.post(url, {'text': '  '}, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['error'], 'No text provided')
+        self.assertEqual(self.client.get(url).status_code, 405)
+        for body in ([], '"x"'):
+            response = self.client.post(url, body, content_type='application/json')
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(response.json()['details'], 'Expected a JSON object')
+
+    def test_unknown_patient_summary_is_not_found(self):
+        for url in ('/patient-app/api/patients/999999/summary/', '/patient-app/api/async/patients/999999/summary/'):
+            self.assertEqual(self.client.post(url).status_code, 404, url)
+
+
+class EchoChain:
+    """Stands in for a prompt | model chain, answering with its input"""
+
+    def __init__(self, client):
+        self.client = client
+
+    def invoke(self, inputs):
+        return f'{self.client}:{next(iter(inputs.values()))}'
+
+
+class EchoEngine(summaries.SummaryEngine):
+    builds = 0
+
+    def _build_chains(self):
+        type(self).builds += 1
+        time.sleep(0.01)
+        return {name: [EchoChain(client) for client in range(self.pool_size)] for name in summaries.PROMPTS}
+
+
+class SummaryEngineTests(TestCase):
+    def setUp(self):
+        EchoEngine.builds = 0
+        self.engine = EchoEngine(api_key='key', pool_size=2)
+
+    def test_engine_is_created_once_at_startup(self):
+        self.assertIsNotNone(summaries._engine)
+        self.assertIs(summaries.get_engine(), summaries.get_engine())
+
+    def test_chains_are_built_once_and_shared_by_threads(self):
+        results = []
+        threads = [
+            threading.Thread(target=lambda i=i: results.append(self.engine._chain('text').invoke({'text': f'report {i}'})))
+            for i in range(8)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(EchoEngine.builds, 1)
+        self.assertEqual(sorted(result.split(':')[1] for result in results), [f'report {i}' for i in range(8)])
+        # Calls take the pooled clients in turn
+        self.assertEqual({result.split(':')[0] for result in results}, {'0', '1'})
+
+        self.assertEqual(self.engine._inputs('record', {'patient': {'id': 1}}), {'record': '{\n  "patient": {\n    "id": 1\n  }\n}'})
+        self.assertEqual(self.engine.summarize('record', {}), summaries.NO_DATA_SUMMARY)
+        self.assertEqual(async_to_sync(self.engine.asummarize)('file', ''), summaries.NO_DATA_SUMMARY)
+
+    def test_missing_api_key(self):
+        with self.assertRaises(ValueError):
+            EchoEngine(api_key=None).summarize('text', 'report')
+        self.assertEqual(EchoEngine.builds, 0)
+
+
+class FastDeleteTests(TestCase):
+    def test_only_patient_models_have_delete_receivers(self):
+        collector = Collector(using='default')
+        self.assertTrue(collector.can_fast_delete(ChangeEvent.objects.all()))
+        self.assertTrue(collector.can_fast_delete(PurgeJob.objects.all()))
+        self.assertFalse(collector.can_fast_delete(AdditionalNote.objects.all()))
+
+
+class PatientCounterTests(TestCase):
+    def counters(self, patient):
+        patient.refresh_from_db()
+        return (patient.checkups_count, patient.lab_tests_count, patient.treatments_count,
+                patient.notes_count, patient.last_checkup_date)
+
+    def test_counters_follow_creates_updates_and_deletes(self):
+        patient = make_patient(1)
+        make_history(patient, checkups=3)
+        self.assertEqual(self.counters(patient), (3, 1, 1, 1, date(2024, 1, 3)))
+
+        latest = patient.checkups.get(date_of_checkup=date(2024, 1, 3))
+        latest.date_of_checkup = date(2024, 2, 1)
+        latest.save()
+        self.assertEqual(self.counters(patient)[4], date(2024, 2, 1))
+
+        latest.delete()
+        patient.labtests.all().delete()
+        self.assertEqual(self.counters(patient), (2, 0, 1, 1, date(2024, 1, 2)))
+
+    def test_counters_follow_bulk_import(self):
+        self.client.post('/patient-app/api/patients/bulk/', [complete_payload(1)], content_type='application/json')
+        patient = Patient.objects.get()
+        self.assertEqual(self.counters(patient), (2, 1, 1, 1, date(2024, 3, 1)))
+
+    def test_saving_stale_instance_keeps_counters(self):
+        patient = make_patient(1)
+        make_history(patient)
+        patient.patient_name = 'Renamed'
+        patient.save()
+        self.assertEqual(self.counters(patient)[0], 2)
+
+    def test_rebuild_command_detects_and_fixes_drift(self):
+        patient = make_patient(1)
+        make_history(patient)
+        Patient.objects.update(checkups_count=9, last_checkup_date=None)
+
+        with self.assertRaises(CommandError):
+            call_command('rebuild_patient_counters', '--check', stdout=io.StringIO())
+        call_command('rebuild_patient_counters', stdout=io.StringIO())
+        self.assertEqual(self.counters(patient), (2, 1, 1, 1, date(2024, 1, 2)))
+
+
+class FastSerializerTests(TestCase):
+    def setUp(self):
+        self.patients = [make_patient(1), make_patient(2, email_address=None, address=None), make_patient(3)]
+        make_history(self.patients[0], checkups=3)
+        make_history(self.patients[1], checkups=1)
+        checkup = self.patients[0].checkups.first()
+        TreatmentPlan.objects.create(patient=self.patients[0], checkup=checkup, next_followup_date=date(2030, 1, 1))
+        CheckUp.objects.create(patient=self.patients[1])
+
+    def assertSameJson(self, selected=None):
+        ids = [patient.id for patient in self.patients]
+        patients = complete_patient_queryset().filter(pk__in=ids).order_by('pk')
+        expected = [build_complete_record(patient, selected) for patient in patients]
+        renderer = JSONRenderer()
+        self.assertEqual(renderer.render(complete_records(ids, selected)), renderer.render(expected))
+
+    def test_output_matches_drf_serializers(self):
+        self.assertSameJson()
+
+    def test_field_selection_matches_drf_serializers(self):
+        self.assertSameJson(parse_fields('phone_number,checkups.date_of_checkup,treatments'))
+
+    def test_one_query_per_table(self):
+        with self.assertNumQueries(6):
+            complete_records([patient.id for patient in self.patients])
+
+
+class RendererTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.patient = make_patient(1)
+        make_history(self.patient)
+        self.url = f'/patient-app/api/patients/{self.patient.id}/'
+
+    def test_json_matches_drf_renderer(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response['Content-Type'], 'application/json')
+        self.assertEqual(response.content, JSONRenderer().render(response.data))
+        self.assertEqual(dumps({'day': date(2024, 1, 2), 'text': 'a\u2028b'}), b'{"day":"2024-01-02","text":"a\\u2028b"}')
+
+    @skipUnless(msgpack, 'msgpack is not installed')
+    def test_msgpack_round_trip(self):
+        response = self.client.get(self.url, HTTP_ACCEPT='application/msgpack')
+        self.assertEqual(response['Content-Type'], 'application/msgpack')
+        self.assertEqual(msgpack.unpackb(response.content), json.loads(self.client.get(self.url).content))
+
+        body = msgpack.packb([complete_payload(1)])
+        response = self.client.post('/patient-app/api/patients/bulk/', body, content_type='application/msgpack')
+        self.assertEqual(response.status_code, 201)
+
+    @skipIf(msgpack, 'msgpack is installed')
+    def test_msgpack_not_acceptable_without_package(self):
+        response = self.client.get(self.url, HTTP_ACCEPT='application/msgpack')
+        self.assertEqual(response.status_code, 406)
+
+
+class FieldSelectionTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.patient = make_patient(1)
+        make_history(self.patient)
+        self.url = f'/patient-app/api/patients/{self.patient.id}/'
+        record_cache.get_cache().clear()
+
+    def test_unrequested_sections_are_not_queried(self):
+        # Version stamp for the ETag, then the patient row
+        with self.assertNumQueries(2):
+            response = self.client.get(self.url, {'fields': 'patient_name,age'})
+        self.assertEqual(response.data, {'patient': {'id': self.patient.id, 'patient_name': 'Patient 1', 'age': 31}})
+
+        # ... plus the checkups
+        with self.assertNumQueries(3):
+            response = self.client.get(self.url, {'include': 'checkups'})
+        self.assertEqual(list(response.data), ['patient', 'checkups'])
+        self.assertEqual(len(response.data['checkups']), 2)
+
+    def test_cached_record_is_projected(self):
+        full = self.client.get(self.url).data
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url, {'fields': 'age,checkups.date_of_checkup', 'include': 'notes'})
+        self.assertEqual(response.data, {
+            'patient': {'id': self.patient.id, 'age': 31},
+            'checkups': [{'date_of_checkup': c['date_of_checkup']} for c in full['checkups']],
+            'notes': full['notes'],
+        })
+
+    def test_unknown_section_is_rejected(self):
+        response = self.client.get(self.url, {'include': 'billing'})
+        self.assertEqual(response.status_code, 400)
+
+
+class SearchTests(TestCase):
+    url = '/patient-app/api/search/'
+
+    def setUp(self):
+        self.client = APIClient()
+        self.first, self.second = make_patient(1), make_patient(2)
+        self.checkup = CheckUp.objects.create(patient=self.first, symptoms='Severe migraine with aura')
+        AdditionalNote.objects.create(patient=self.second, doctor_remarks='Migraines', special_warnings='Migraine triggers')
+
+    def search(self, q, **params):
+        return self.client.get(self.url, {'q': q, **params}).data
+
+    def test_ranked_hits_grouped_by_patient(self):
+        data = self.search('migraine')
+        self.assertEqual([r['patient_id'] for r in data['results']], [self.second.id, self.first.id])
+        first_hit = data['results'][1]['hits'][0]
+        self.assertEqual((first_hit['section'], first_hit['id']), ('checkups', self.checkup.id))
+        self.assertIn('[migraine]', first_hit['snippet'])
+
+        page = self.search('migraine', limit=1)
+        self.assertEqual(page['next_offset'], 1)
+        self.assertEqual(self.search('migraine', limit=1, offset=1)['results'][0]['patient_id'], self.first.id)
+
+    def test_index_follows_writes(self):
+        self.checkup.symptoms = 'Chest pain'
+        self.checkup.save()
+        self.assertEqual([r['patient_id'] for r in self.search('aura')['results']], [])
+        self.assertEqual([r['patient_id'] for r in self.search('chest pain')['results']], [self.first.id])
+
+        self.checkup.delete()
+        self.assertEqual(self.search('chest')['results'], [])
+
+        self.client.post('/patient-app/api/patients/bulk/', [complete_payload(1)], format='json')
+        self.assertEqual(len(self.search('fever')['results']), 1)
+
+    def test_admin_search_uses_index(self):
+        from django.contrib.admin.sites import site
+        model_admin = site._registry[CheckUp]
+        queryset, _ = model_admin.get_search_results(None, CheckUp.objects.all(), 'migr')
+        self.assertEqual(list(queryset), [self.checkup])
+
+    def test_rebuild_and_bad_queries(self):
+        from . import search
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM patients_search')
+        call_command('rebuild_search_index', stdout=io.StringIO())
+        self.assertEqual(len(self.search('aura')['results']), 1)
+        self.assertEqual(search.match_query('"unbalanced AND ('), '"unbalanced"* "AND"*')
+        self.assertEqual(self.client.get(self.url, {'q': '  '}).status_code, 400)
+
+
+class VitalsTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.patient = make_patient(1)
+
+    def test_parses_common_formats(self):
+        self.assertEqual(vitals.parse_blood_pressure('120/80 mmHg'), (120, 80))
+        self.assertEqual(vitals.parse_blood_pressure('80/120'), (None, None))
+        self.assertEqual(vitals.parse_heart_rate('72 bpm'), 72)
+        self.assertEqual(vitals.parse_temperature('98.6 F'), 37.0)
+        self.assertEqual(vitals.parse_temperature('37.5°C'), 37.5)
+        self.assertEqual(vitals.parse_temperature('99.1'), 37.3)
+        self.assertEqual(vitals.parse_weight('70 kg'), 70.0)
+        self.assertEqual(vitals.parse_weight('154 lbs'), 69.9)
+        self.assertEqual(vitals.parse_height('1.75 m'), 175.0)
+        self.assertEqual(vitals.parse_height('5\'9"'), 175.3)
+        self.assertIsNone(vitals.parse_heart_rate('not taken'))
+        self.assertEqual(vitals.parse({'weight': '70', 'height': '175'})['bmi_value'], 22.9)
+
+    def test_shadow_columns_follow_writes(self):
+        checkup = CheckUp.objects.create(patient=self.patient, blood_pressure='150/95', temperature='101 F')
+        checkup.refresh_from_db()
+        self.assertEqual((checkup.systolic_bp, checkup.diastolic_bp, checkup.temperature_c), (150, 95, 38.3))
+
+        checkup.heart_rate = '110 bpm'
+        checkup.save(update_fields=['heart_rate'])
+        checkup.refresh_from_db()
+        self.assertEqual(checkup.heart_rate_bpm, 110)
+
+        self.client.patch(f'/patient-app/api/patients/{self.patient.id}/', {
+            'checkups': [{'id': checkup.id, 'blood_pressure': '118/76'}, {'weight': '80 kg', 'height': '180 cm'}],
+        }, format='json')
+        checkup.refresh_from_db()
+        self.assertEqual((checkup.systolic_bp, checkup.heart_rate_bpm), (118, 110))
+        self.assertEqual(self.patient.checkups.latest('pk').bmi_value, 24.7)
+
+        self.client.post('/patient-app/api/patients/bulk/', [complete_payload(1)], format='json')
+        self.assertEqual(CheckUp.objects.filter(heart_rate_bpm=80).count(), 1)
+
+    def test_backfill_command(self):
+        make_history(self.patient)
+        CheckUp.objects.update(systolic_bp=None, temperature_c=None, bmi_value=None)
+        out = io.StringIO()
+        call_command('backfill_vitals', stdout=out)
+        self.assertIn('updated 2', out.getvalue())
+        self.assertEqual(
+            set(CheckUp.objects.values_list('systolic_bp', 'temperature_c', 'bmi_value')), {(120, 37.0, 24.2)}
+        )
+
+    def test_roster_range_filters(self):
+        other = make_patient(2)
+        CheckUp.objects.create(patient=self.patient, blood_pressure='150/95', heart_rate='104')
+        CheckUp.objects.create(patient=other, blood_pressure='150/95', heart_rate='70')
+        CheckUp.objects.create(patient=other, blood_pressure='110/70', heart_rate='120')
+
+        def ids(**params):
+            response = self.client.get('/patient-app/api/patients/', params)
+            return [patient['id'] for patient in response.data['patients']]
+
+        self.assertEqual(ids(heart_rate_min=100), [self.patient.id, other.id])
+        # Both bounds must hold on the same checkup
+        self.assertEqual(ids(heart_rate_min=100, systolic_min=140), [self.patient.id])
+        self.assertEqual(ids(systolic_max=100), [])
+        response = self.client.get('/patient-app/api/patients/', {'bmi_min': 'high'})
+        self.assertEqual(response.status_code, 400)
+
+
+class VitalsSeriesTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.patient = make_patient(1)
+        self.url = f'/patient-app/api/patients/{self.patient.id}/vitals/'
+        readings = [('2024-01-01', '120/80'), ('2024-01-03', '140/90'), ('2024-02-10', '130/85'), ('2024-04-02', '')]
+        for day, pressure in readings:
+            CheckUp.objects.create(patient=self.patient, date_of_checkup=day, blood_pressure=pressure, heart_rate='70')
+
+    def test_monthly_buckets_and_rolling_stats(self):
+        response = self.client.get(self.url, {'metric': 'systolic', 'bucket': 'month', 'window': 2})
+        self.assertEqual(response.status_code, 200)
+        systolic = response.json()['metrics']['systolic']
+        self.assertEqual(systolic['start'], ['2024-01-01', '2024-02-01'])
+        self.assertEqual(systolic['count'], [2, 1])
+        self.assertEqual((systolic['min'], systolic['mean'], systolic['max']), ([120, 130], [130, 130], [140, 130]))
+        self.assertEqual(systolic['rolling_mean'], [130, 130])
+        self.assertEqual(systolic['unit'], 'mmHg')
+
+    def test_date_range_and_bucket_bound(self):
+        data = self.client.get(self.url, {'from': '2024-02-01', 'bucket': 'week'}).json()
+        self.assertEqual(data['metrics']['heart_rate']['start'], ['2024-02-05', '2024-04-01'])
+        self.assertEqual(set(data['metrics']), set(timeseries.METRICS))
+
+        dates = np.arange('2000-01-01', '2010-01-01', dtype='datetime64[D]')
+        self.assertEqual(timeseries.choose_bucket(dates, 'day'), 'month')
+        self.assertEqual(timeseries.choose_bucket(dates[:30]), 'day')
+
+    def test_rejects_bad_parameters(self):
+        for params in ({'metric': 'glucose'}, {'from': '2024-13-01'}, {'bucket': 'hour'}, {'window': 0}):
+            self.assertEqual(self.client.get(self.url, params).status_code, 400)
+        self.assertEqual(self.client.get('/patient-app/api/patients/999/vitals/').status_code, 404)
+
+
+class CohortAnalyticsTests(TestCase):
+    url = '/patient-app/api/analytics/cohort/'
+
+    def setUp(self):
+        self.client = APIClient()
+        analytics.get_cache().clear()
+        young, old = make_patient(1, age=25, gender='Male'), make_patient(2, age=65, gender='Female')
+        for systolic in (110, 120, 130, 140):
+            CheckUp.objects.create(patient=young, blood_pressure=f'{systolic}/80', weight='70', height='175',
+                                   current_diagnosis='Hypertension; Asthma', date_of_checkup='2024-01-01')
+        CheckUp.objects.create(patient=old, blood_pressure='160/95', bmi='31', current_diagnosis='hypertension',
+                               date_of_checkup='2023-01-01')
+
+    def test_aggregates_in_chunks(self):
+        result = analytics.compute(chunk_size=2)
+        self.assertEqual(result['checkups'], 5)
+        self.assertEqual(result['bmi']['categories'], {'underweight': 0, 'normal': 4, 'overweight': 0, 'obese': 1})
+        self.assertEqual(sum(result['bmi']['histogram']['Female']), 1)
+
+        male, female = result['blood_pressure']
+        self.assertEqual((male['age_band'], male['gender'], male['count']), ('18-39', 'Male', 4))
+        self.assertEqual(male['systolic'], {'p10': 110, 'p25': 110, 'p50': 120, 'p75': 130, 'p90': 140})
+        self.assertEqual((female['age_band'], female['diastolic']['p50']), ('60-79', 95))
+
+        self.assertEqual(result['diagnoses']['top'][0], {'diagnosis': 'hypertension', 'count': 5, 'share': 1.0})
+
+    def test_endpoint_caches_results(self):
+        first = self.client.get(self.url, {'from': '2024-01-01'}).json()
+        self.assertEqual(first['checkups'], 4)
+        CheckUp.objects.filter(date_of_checkup='2024-01-01').delete()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(self.url, {'from': '2024-01-01'}).json(), first)
+        self.assertEqual(self.client.get(self.url, {'from': '2024-01-01', 'refresh': 1}).json()['checkups'], 0)
+        self.assertEqual(self.client.get(self.url, {'top': 0}).status_code, 400)
+
+    def test_command_stores_results(self):
+        out = io.StringIO()
+        call_command('cohort_analytics', '--top', '1', stdout=out)
+        self.assertEqual(json.loads(out.getvalue())['diagnoses']['top'][0]['diagnosis'], 'hypertension')
+        with self.assertNumQueries(0):
+            analytics.cohort_analytics(top=1)
+
+
+class FollowupScheduleTests(TestCase):
+    url = '/patient-app/api/followups/'
+
+    def setUp(self):
+        self.client = APIClient()
+        self.patients = [make_patient(i) for i in range(3)]
+        for i, patient in enumerate(self.patients):
+            for day, doctor in ((2, 'Dr. Ali'), (5, 'Dr. Sara'), (20, 'Dr. Ali')):
+                TreatmentPlan.objects.create(patient=patient, assigned_doctor=doctor,
+                                             next_followup_date=date(2024, 6, day + i))
+
+    def test_pages_through_the_week_in_one_query_per_page(self):
+        seen = []
+        params = {'from': '2024-06-01', 'limit': 2}
+        while True:
+            with self.assertNumQueries(1):
+                data = self.client.get(self.url, params).json()
+            seen.extend((f['next_followup_date'], f['patient']['patient_name']) for f in data['followups'])
+            if data['next_after'] is None:
+                break
+            params['after'] = data['next_after']
+
+        self.assertEqual(data['to'], '2024-06-08')
+        self.assertEqual([day for day, _ in seen], ['2024-06-02', '2024-06-03', '2024-06-04', '2024-06-05',
+                                                    '2024-06-06', '2024-06-07'])
+        self.assertEqual(seen[0][1], 'Patient 0')
+
+    def test_filters_by_doctor(self):
+        data = self.client.get(self.url, {'from': '2024-06-01', 'to': '2024-06-30', 'doctor': 'Dr. Ali'}).json()
+        self.assertEqual(data['count'], 6)
+        self.assertEqual({f['assigned_doctor'] for f in data['followups']}, {'Dr. Ali'})
+        self.assertEqual(data['followups'][0]['patient']['phone_number'], '+12025550000')
+
+    def test_rejects_bad_parameters(self):
+        for params in ({'from': 'soon'}, {'from': '2024-06-10', 'to': '2024-06-01'}, {'after': 'x'}):
+            self.assertEqual(self.client.get(self.url, params).status_code, 400)
+
+
+class PatientPagesTests(TestCase):
+    url = '/patient-app/patients/'
+
+    def setUp(self):
+        caches['fragments'].clear()
+        self.patients = [make_patient(i, patient_name=name) for i, name in
+                         enumerate(['Ali Khan', 'alina Shah', 'Sara Ali', 'Bilal', 'Aliya'])]
+
+    def names(self, response):
+        return [patient.patient_name for patient in response.context['patients']]
+
+    def test_list_pages_newest_first(self):
+        first = self.client.get(self.url, {'limit': 2})
+        self.assertEqual(self.names(first), ['Aliya', 'Bilal'])
+        second = self.client.get(self.url, {'limit': 2, 'cursor': first.context['next_cursor']})
+        self.assertEqual(self.names(second), ['Sara Ali', 'alina Shah'])
+        last = self.client.get(self.url, {'limit': 2, 'cursor': second.context['next_cursor']})
+        self.assertEqual((self.names(last), last.context['next_cursor']), (['Ali Khan'], None))
+
+        response = self.client.get(self.url, {'cursor': 'bogus'})
+        self.assertEqual(len(self.names(response)), 5)
+
+    def test_search_by_name_prefix(self):
+        first = self.client.get(self.url, {'q': 'ALI', 'limit': 2})
+        self.assertEqual(self.names(first), ['Ali Khan', 'alina Shah'])
+        self.assertContains(first, 'cursor=')
+        second = self.client.get(self.url, {'q': 'ALI', 'limit': 2, 'cursor': first.context['next_cursor']})
+        self.assertEqual((self.names(second), second.context['next_cursor']), (['Aliya'], None))
+
+    def test_rows_are_cached_per_version(self):
+        self.client.get(self.url)
+        Patient.objects.filter(pk=self.patients[3].pk).update(patient_name='Stale')
+        self.assertContains(self.client.get(self.url), 'Bilal')
+
+        patient = self.patients[3]
+        patient.patient_name = 'Bilal Ahmed'
+        patient.save()
+        self.assertContains(self.client.get(self.url), 'Bilal Ahmed')
+
+    def test_detail_sections_are_cached_per_version(self):
+        patient = self.patients[0]
+        make_history(patient)
+        url = f'{self.url}{patient.id}/'
+        self.assertContains(self.client.get(url), 'No notes available.', count=0)
+        with self.assertNumQueries(1):
+            self.assertContains(self.client.get(url), 'Ali Khan')
+
+        CheckUp.objects.create(patient=patient, date_of_checkup=date(2024, 5, 1), current_diagnosis='Asthma')
+        self.assertContains(self.client.get(url), 'Asthma')
+        self.assertEqual(self.client.get(f'{self.url}999/').status_code, 404)
+
+
+@override_settings(PURGE_IN_BACKGROUND=False)
+class SoftDeleteTests(TestCase):
+    url = '/patient-app/api/patients/'
+
+    def setUp(self):
+        self.client = APIClient()
+        self.patient = make_patient(1)
+        make_history(self.patient, checkups=5)
+        self.other = make_patient(2)
+
+    def indexed_rows(self, patient):
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT count(*) FROM patients_search WHERE patient_id = %s', [patient.pk])
+            return cursor.fetchone()[0]
+
+    def test_delete_hides_patient_at_once(self):
+        response = self.client.delete(f'{self.url}{self.patient.id}/')
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.data['purge']['status'], 'pending')
+
+        self.assertEqual(self.client.get(f'{self.url}{self.patient.id}/').status_code, 404)
+        self.assertEqual([p['id'] for p in self.client.get(self.url).data['patients']], [self.other.id])
+        self.assertEqual(self.client.get('/patient-app/api/search/', {'q': 'cough'}).data['results'], [])
+        self.assertEqual(self.client.get(f'{self.url}{self.patient.id}/purge/').data['deleted_rows'], 0)
+        self.assertEqual(CheckUp.objects.filter(patient_id=self.patient.id).count(), 5)
+        self.assertEqual(ChangeEvent.objects.filter(model='patient', op='delete').count(), 1)
+        self.assertEqual(self.client.delete(f'{self.url}999999/').status_code, 404)
+
+        # A deleted patient keeps its phone number until it is purged
+        response = self.client.post(self.url, complete_payload(5, phone_number=str(self.patient.phone_number)),
+                                    format='json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_purge_removes_rows_in_batches(self):
+        treatment = TreatmentPlan.objects.create(patient=self.other, checkup=self.patient.checkups.first())
+        job = purge.soft_delete(self.patient)
+        reports = []
+        purge.purge(job, batch_size=2, pause=0, report=lambda job: reports.append(job.deleted_rows))
+
+        # 1 treatment, 5 checkups in batches of 2, 1 lab test, 1 note, 1 history
+        self.assertEqual(reports, [1, 3, 5, 6, 7, 8, 9])
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.total_rows, job.deleted_rows), ('done', 9, 9))
+        self.assertFalse(Patient.all_objects.filter(pk=self.patient.pk).exists())
+        self.assertEqual(ChangeEvent.objects.filter(model='patient', op='delete').count(), 1)
+        self.assertEqual(CheckUp.objects.count(), 0)
+        self.assertEqual(self.indexed_rows(self.patient), 0)
+        treatment.refresh_from_db()
+        self.assertIsNone(treatment.checkup_id)
+        self.assertEqual(self.client.get(f'{self.url}{self.patient.id}/purge/').data['percent'], 100.0)
+
+    def test_command_purges_leftovers(self):
+        self.client.post(f'/patient-app/patients/{self.patient.id}/delete/')
+        Patient.objects.filter(pk=self.other.pk).update(deleted_at=timezone.now())
+        out = io.StringIO()
+        call_command('purge_deleted_patients', pause=0, stdout=out)
+        self.assertIn('Purged 2 patients.', out.getvalue())
+        self.assertEqual(Patient.all_objects.count(), 0)
+        self.assertEqual(set(PurgeJob.objects.values_list('status', flat=True)), {'done'})
+
+        with self.assertRaises(ValueError):
+            purge.purge(PurgeJob.objects.create(patient_id=make_patient(3).pk))
+
+
+class BackgroundPurgeTests(TransactionTestCase):
+    def test_worker_thread_purges(self):
+        patient = make_patient(1)
+        make_history(patient)
+        job = purge.soft_delete(patient)
+        for _ in range(100):
+            job.refresh_from_db()
+            if job.status == 'done':
+                break
+            time.sleep(0.05)
+        self.assertEqual(job.status, 'done')
+        self.assertEqual(CheckUp.objects.count(), 0)
+
+
+class ArchiveTests(TestCase):
+    url = '/patient-app/api/patients/'
+
+    def setUp(self):
+        self.client = APIClient()
+        self.patient = make_patient(1)
+        make_history(self.patient, checkups=3)
+        old = timezone.now() - timedelta(days=400)
+        LabTests.objects.update(created_at=old)
+        AdditionalNote.objects.update(created_at=old)
+        self.detail = f'{self.url}{self.patient.id}/'
+
+    def archive(self):
+        out = io.StringIO()
+        call_command('archive_records', older_than=30, stdout=out)
+        return out.getvalue()
+
+    def test_old_rows_leave_the_tables(self):
+        full = self.client.get(self.detail).json()
+        self.assertIn('Archived 4 rows of 1 patients.', self.archive())
+
+        # The latest checkup stays
+        self.assertEqual(list(CheckUp.objects.values_list('date_of_checkup', flat=True)), [date(2024, 1, 3)])
+        self.assertEqual((LabTests.objects.count(), AdditionalNote.objects.count()), (0, 0))
+        stored = PatientArchive.objects.get(patient=self.patient)
+        self.assertEqual((stored.checkups_count, stored.lab_tests_count, stored.notes_count), (2, 1, 1))
+        # Archived rows are still the patient's: the counters keep them
+        self.patient.refresh_from_db()
+        self.assertEqual((self.patient.checkups_count, self.patient.last_checkup_date), (3, date(2024, 1, 3)))
+        roster = self.client.get(self.url).data['patients'][0]
+        self.assertEqual((roster['checkups_count'], roster['lab_tests_count']), (3, 1))
+        self.assertEqual(list(counters.find_drift()), [])
+        self.assertEqual(ChangeEvent.objects.filter(op='archive').count(), 4)
+        self.assertFalse(ChangeEvent.objects.filter(op='delete').exists())
+
+        hot = self.client.get(self.detail).json()
+        self.assertEqual((len(hot['checkups']), hot['lab_tests'], hot['notes']), (1, [], []))
+        self.assertEqual(self.client.get(self.detail, {'include_archived': 1}).json(), full)
+        dates = self.client.get(self.detail, {'fields': 'checkups.date_of_checkup', 'include_archived': 1}).json()
+        self.assertEqual([row['date_of_checkup'] for row in dates['checkups']], ['2024-01-03', '2024-01-02', '2024-01-01'])
+
+        # Nothing left to archive
+        self.assertIn('Archived 0 rows of 0 patients.', self.archive())
+
+    def test_linked_checkups_stay(self):
+        oldest = CheckUp.objects.order_by('date_of_checkup').first()
+        TreatmentPlan.objects.update(checkup=oldest)
+        self.archive()
+        self.assertEqual(CheckUp.objects.count(), 2)
+        self.assertTrue(CheckUp.objects.filter(pk=oldest.pk).exists())
+
+    def test_editing_an_archived_row_restores_it(self):
+        oldest = CheckUp.objects.order_by('date_of_checkup').first()
+        self.archive()
+        response = self.client.patch(self.detail, {'checkups': [{'id': oldest.pk, 'symptoms': 'Better'}]}, format='json')
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(CheckUp.objects.get(pk=oldest.pk).symptoms, 'Better')
+        self.assertEqual(PatientArchive.objects.get(patient=self.patient).checkups_count, 1)
+
+        response = self.client.patch(self.detail, {'notes': [{'id': 999, '_delete': True}]}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_invalid_edit_leaves_the_archive_alone(self):
+        oldest = CheckUp.objects.order_by('date_of_checkup').first()
+        self.archive()
+        response = self.client.patch(self.detail, {'checkups': [
+            {'id': oldest.pk, 'symptoms': 'Better'},
+            {'id': 999, 'symptoms': 'Unknown'},
+        ]}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(CheckUp.objects.filter(pk=oldest.pk).exists())
+        self.assertEqual(PatientArchive.objects.get(patient=self.patient).checkups_count, 2)
+        self.assertFalse(ChangeEvent.objects.filter(op='restore').exists())
+
+    def test_editing_an_archived_row_whose_id_was_taken(self):
+        oldest = CheckUp.objects.order_by('date_of_checkup').first()
+        self.archive()
+        other = make_patient(2)
+        CheckUp.objects.create(pk=oldest.pk, patient=other, symptoms='Other', date_of_checkup=date(2024, 1, 1))
+        response = self.client.patch(self.detail, {'checkups': [{'id': oldest.pk, 'symptoms': 'Better'}]}, format='json')
+        self.assertEqual(response.status_code, 200, response.data)
+        restored = response.data['data']['checkups']['updated'][0]
+        self.assertNotEqual(restored['id'], oldest.pk)
+        self.assertEqual(CheckUp.objects.get(pk=restored['id'], patient=self.patient).symptoms, 'Better')
+        self.assertEqual(CheckUp.objects.get(pk=oldest.pk).symptoms, 'Other')
+
+    def test_restore_command_puts_everything_back(self):
+        full = self.client.get(self.detail).json()
+        self.archive()
+        out = io.StringIO()
+        call_command('archive_records', restore=self.patient.id, stdout=out)
+        self.assertIn('Restored 4 rows', out.getvalue())
+        self.assertFalse(PatientArchive.objects.exists())
+        self.assertEqual(self.client.get(self.detail).json(), full)
+        self.assertEqual(ChangeEvent.objects.filter(op='restore').count(), 4)
+        self.assertEqual(len(self.client.get('/patient-app/api/search/', {'q': 'rest'}).data['results']), 1)
+
+
+class QueryBudgetTests(TestCase):
+    url = '/patient-app/api/patients/'
+
+    def setUp(self):
+        self.client = APIClient()
+        for i in range(3):
+            make_history(make_patient(i))
+
+    def test_reports_queries_in_header_and_log(self):
+        with self.assertLogs('patients.querybudget', 'INFO') as logs:
+            response = self.client.get(self.url)
+        self.assertIn('db;dur=', response['Server-Timing'])
+        self.assertIn('desc="2 queries"', response['Server-Timing'])
+        stats = logs.records[0].query_stats
+        self.assertEqual((stats['url_name'], stats['queries'], stats['status']), ('patient-list-create', 2, 200))
+        self.assertIn('patients_patient', stats['slowest_sql'])
+
+    def test_html_views_stay_within_budget(self):
+        patient = Patient.objects.first()
+        for url in ('/patient-app/patients/', f'/patient-app/patients/{patient.id}/',
+                    f'/patient-app/patients/{patient.id}/edit/'):
+            self.assertEqual(self.client.get(url).status_code, 200)
+
+    @override_settings(QUERY_BUDGETS={'patient-list-create': {'GET': 1}})
+    def test_over_budget_fails_in_tests_and_warns_otherwise(self):
+        with self.assertRaises(QueryBudgetExceeded):
+            self.client.get(self.url)
+        self.assertEqual(self.client.post(self.url, {}, format='json').status_code, 400)
+
+        with override_settings(QUERY_BUDGET_STRICT=False), self.assertLogs('patients.querybudget', 'WARNING') as logs:
+            self.assertEqual(self.client.get(self.url).status_code, 200)
+        self.assertIn('over its budget of 1', logs.output[0])
+
+    @override_settings(DEBUG=True)
+    async def test_async_views_run_on_the_event_loop(self):
+        # Django logs every sync middleware it has to adapt an async chain to.
+        # An unknown patient is looked up but never summarized.
+        with self.assertLogs('django.request', 'DEBUG') as logs:
+            response = await self.async_client.post('/patient-app/api/async/patients/999999/summary/')
+        self.assertFalse([line for line in logs.output if 'adapted' in line])
+        self.assertRegex(response['Server-Timing'], r'desc="[1-9]\d* queries"')
+
+        threads = []
+
+        async def view(request):
+            threads.append(threading.get_ident())
+            return HttpResponse()
+
+        middleware = QueryBudgetMiddleware(view)
+        self.assertTrue(iscoroutinefunction(middleware))
+        await middleware(RequestFactory().get('/'))
+        self.assertEqual(threads, [threading.get_ident()])
+
+
+class RecordingReplicaRouter(replica.ReplicaRouter):
+    """ReplicaRouter keeping the alias of every read"""
+    reads = []
+
+    def db_for_read(self, model, **hints):
+        alias = super().db_for_read(model, **hints)
+        self.reads.append(alias)
+        return alias
+
+
+@override_settings(READ_REPLICA='replica', DATABASE_ROUTERS=['patients.tests.RecordingReplicaRouter'])
+class ReplicaRoutingTests(TestCase):
+    def setUp(self):
+        # The replica mirrors the test database; a second connection to the
+        # in-memory SQLite database would be locked out by the test transaction
+        self.addCleanup(connections.__setitem__, 'replica', connections['replica'])
+        connections['replica'] = connections['default']
+        self.client = APIClient()
+        self.patient = make_patient(1)
+        make_history(self.patient)
+        RecordingReplicaRouter.reads = []
+
+    def test_router_sends_marked_reads_to_replica(self):
+        self.assertEqual(Patient.objects.all().db, 'default')
+        with replica.reading_from_replica():
+            self.assertEqual(Patient.objects.all().db, 'replica')
+            self.assertEqual(Patient.objects.get().checkups.all().db, 'replica')
+            with replica.use_primary():
+                self.assertEqual(Patient.objects.all().db, 'default')
+        with override_settings(READ_REPLICA=None), replica.reading_from_replica():
+            self.assertEqual(Patient.objects.all().db, 'default')
+
+    def test_read_only_views_query_the_replica(self):
+        url = f'/patient-app/api/patients/{self.patient.id}/'
+        self.assertEqual(self.client.get('/patient-app/api/patients/').status_code, 200)
+        self.assertEqual(self.client.get(f'{url}?include=checkups').status_code, 200)
+        export = self.client.get('/patient-app/api/patients/export/')
+        self.assertEqual(len(b''.join(export.streaming_content).splitlines()), 1)
+        self.assertEqual(set(RecordingReplicaRouter.reads), {'replica'})
+
+        RecordingReplicaRouter.reads = []
+        response = self.client.patch(url, {'patient': {'patient_name': 'Renamed'}}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('replica', RecordingReplicaRouter.reads)
+
+        # The HTML list is where the forms redirect after a write
+        self.assertEqual(self.client.get('/patient-app/patients/').status_code, 200)
+        self.assertNotIn('replica', RecordingReplicaRouter.reads)
+    def test_cache_is_filled_from_the_primary(self):
+        record_cache.get_cache().clear()
+        self.client.get(f'/patient-app/api/patients/{self.patient.id}/')
+        self.assertIn('default', RecordingReplicaRouter.reads)
+
+
+class ReplicaRefreshTests(TransactionTestCase):
+    def test_refresh_copies_the_primary(self):
+        make_patient(1)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'replica.sqlite3')
+            out = io.StringIO()
+            call_command('refresh_replica', '--path', path, '--pages', '4', stdout=out)
+            self.assertIn('Copied', out.getvalue())
+            snapshot = sqlite3.connect(path)
+            try:
+                names = snapshot.execute('SELECT patient_name FROM patients_patient').fetchall()
+            finally:
+                snapshot.close()
+        self.assertEqual(names, [('Patient 1',)])
+
+
+@override_settings(SHARDS=['default', 'shard_1'])
+class ShardingTests(TestCase):
+    databases = {'default', 'shard_1'}
+    url = '/patient-app/api/patients/'
+
+    def setUp(self):
+        self.client = APIClient()
+
+    def create(self, index):
+        response = self.client.post(self.url, complete_payload(index), format='json')
+        self.assertEqual(response.status_code, 201, response.data)
+        return response.data['data']['patient']['id']
+
+    def shard_ids(self, alias):
+        return sorted(Patient.objects.using(alias).values_list('pk', flat=True))
+
+    def test_patient_and_related_rows_share_a_shard(self):
+        ids = [self.create(i) for i in range(4)]
+        for patient_id in ids:
+            alias = sharding.shard_of(patient_id)
+            self.assertEqual(alias, sharding.place(patient_id))
+            self.assertEqual(CheckUp.objects.using(alias).filter(patient_id=patient_id).count(), 2)
+            self.assertEqual(Patient.objects.using(alias).get(pk=patient_id).checkups_count, 2)
+        self.assertEqual(sorted(self.shard_ids('default') + self.shard_ids('shard_1')), ids)
+        self.assertTrue(self.shard_ids('default') and self.shard_ids('shard_1'))
+
+        detail = self.client.get(f'{self.url}{ids[1]}/', {'include': 'checkups'})
+        self.assertEqual(len(detail.data['checkups']), 2)
+        response = self.client.patch(f'{self.url}{ids[1]}/', {'patient': {'patient_name': 'Renamed'}}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Patient.objects.using(sharding.shard_of(ids[1])).get(pk=ids[1]).patient_name, 'Renamed')
+
+    def test_writes_outside_a_shard_context_follow_the_row(self):
+        patient_id = next(pk for pk in (self.create(i) for i in range(2)) if sharding.shard_of(pk) == 'shard_1')
+        # Like the admin: a related row written through an instance, no using_shard()
+        patient = Patient.objects.using('shard_1').get(pk=patient_id)
+        checkup = patient.checkups.create(symptoms='Wheezing', date_of_checkup=date(2024, 5, 1))
+        self.assertEqual(checkup._state.db, 'shard_1')
+        patient.refresh_from_db()
+        self.assertEqual(patient.checkups_count, 3)
+        results = self.client.get('/patient-app/api/search/', {'q': 'wheezing'}).data['results']
+        self.assertEqual([result['patient_id'] for result in results], [patient_id])
+
+        checkup.delete()
+        patient.refresh_from_db()
+        self.assertEqual(patient.checkups_count, 2)
+        self.assertEqual(self.client.get('/patient-app/api/search/', {'q': 'wheezing'}).data['results'], [])
+
+    def test_contacts_are_unique_across_shards(self):
+        first = self.create(0)
+        duplicate = complete_payload(1, phone_number='+12025560000')
+        response = self.client.post(self.url, duplicate, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('phone_number', response.data['details'])
+
+        created = (self.create(i) for i in (2, 6))
+        second = next(pk for pk in created if sharding.shard_of(pk) != sharding.shard_of(first))
+        response = self.client.patch(f'{self.url}{second}/', {'patient': {'email_address': 'bulk0@example.com'}},
+                                     format='json')
+        self.assertEqual(response.status_code, 400)
+
+        response = self.client.post(f'{self.url}bulk/', [
+            complete_payload(3, email_address='bulk0@example.com'), complete_payload(4), complete_payload(4),
+        ], format='json')
+        self.assertEqual(response.data['created'], 1)
+        self.assertEqual([error['index'] for error in response.data['errors']], [0, 2])
+
+        # Without a shard context, Django's own check would only look at 'default'
+        on_shard_1 = Patient.objects.using('shard_1').values_list('phone_number', flat=True).first()
+        patient = Patient(**{**complete_payload(5)['patient'], 'phone_number': on_shard_1})
+        with self.assertRaises(ValidationError):
+            patient.validate_unique()
+
+    def test_bulk_import_spreads_records(self):
+        response = self.client.post(f'{self.url}bulk/', [complete_payload(i) for i in range(4)], format='json')
+        self.assertEqual(response.data['created'], 4)
+        self.assertEqual(len(self.shard_ids('default')), 2)
+        self.assertEqual(CheckUp.objects.using('shard_1').count(), 4)
+
+    def test_roster_search_and_export_fan_out(self):
+        ids = [self.create(i) for i in range(5)]
+        seen, after = [], None
+        while True:
+            page = self.client.get(self.url, {'limit': 2, **({'after': after} if after else {})}).data
+            seen += [patient['id'] for patient in page['patients']]
+            after = page['next_after']
+            if after is None:
+                break
+        self.assertEqual(seen, ids)
+
+        results = self.client.get('/patient-app/api/search/', {'q': 'fever', 'limit': 10}).data['results']
+        self.assertEqual(sorted(result['patient_id'] for result in results), ids)
+        self.assertTrue(all(result['patient_name'] for result in results))
+
+        TreatmentPlan.objects.using('default').update(next_followup_date=date(2024, 6, 1))
+        TreatmentPlan.objects.using('shard_1').update(next_followup_date=date(2024, 6, 1))
+        seen, params = [], {'from': '2024-06-01', 'limit': 2}
+        while True:
+            page = self.client.get('/patient-app/api/followups/', params).data
+            seen += [followup['patient']['id'] for followup in page['followups']]
+            if page['next_after'] is None:
+                break
+            params['after'] = page['next_after']
+        self.assertEqual(sorted(seen), ids)
+
+        export = self.client.get(f'{self.url}export/')
+        records = [json.loads(line) for line in b''.join(export.streaming_content).splitlines()]
+        self.assertEqual(sorted(record['patient']['id'] for record in records), ids)
+        self.assertEqual(analytics.compute()['checkups'], 10)
+
+    def test_move_patient_between_shards(self):
+        patient_id = self.create(0)
+        source = sharding.shard_of(patient_id)
+        target = 'shard_1' if source == 'default' else 'default'
+        checkup_ids = sorted(CheckUp.objects.using(source).values_list('pk', flat=True))
+        last_event = ChangeEvent.objects.order_by('-pk').values_list('pk', flat=True).first()
+        call_command('rebalance_shards', move=patient_id, to=target, stdout=io.StringIO())
+
+        self.assertEqual(sharding.shard_of(patient_id), target)
+        self.assertEqual(sorted(CheckUp.objects.using(target).values_list('pk', flat=True)), checkup_ids)
+        self.assertEqual(
+            list(ChangeEvent.objects.filter(pk__gt=last_event).values_list('model', 'op')), [('patient', 'update')]
+        )
+        self.assertEqual(self.shard_ids(source), [])
+        self.assertEqual(CheckUp.objects.using(source).count(), 0)
+        moved = Patient.objects.using(target).get(pk=patient_id)
+        self.assertEqual((moved.checkups_count, moved.treatments_count), (2, 1))
+        treatment = TreatmentPlan.objects.using(target).get(patient_id=patient_id)
+        self.assertEqual(treatment.checkup.patient_id, patient_id)
+
+        detail = self.client.get(f'{self.url}{patient_id}/', {'include': 'checkups'})
+        self.assertEqual(len(detail.data['checkups']), 2)
+        results = self.client.get('/patient-app/api/search/', {'q': 'fever'}).data['results']
+        self.assertEqual([result['patient_id'] for result in results], [patient_id])
+
+    def test_interrupted_move_is_redone(self):
+        # To 'shard_1': a copy to 'default' would be rolled back with the change log
+        patient_id = next(pk for pk in (self.create(i) for i in range(2)) if sharding.shard_of(pk) == 'default')
+        source, target = 'default', 'shard_1'
+        last_event = ChangeEvent.objects.order_by('-pk').values_list('pk', flat=True).first()
+        with mock.patch.object(sharding, '_delete_patient', side_effect=RuntimeError('crash')):
+            with self.assertRaises(RuntimeError):
+                sharding.move_patient(patient_id, target)
+
+        # The copy on the target is left behind, the directory and the change log are untouched
+        self.assertEqual(CheckUp.objects.using(target).filter(patient_id=patient_id).count(), 2)
+        self.assertEqual(sharding.shard_of(patient_id), source)
+        self.assertIn(patient_id, self.shard_ids(source))
+        self.assertFalse(ChangeEvent.objects.filter(pk__gt=last_event).exists())
+        self.assertEqual(self.client.get(f'{self.url}{patient_id}/').status_code, 200)
+
+        self.assertTrue(sharding.move_patient(patient_id, target))
+        self.assertEqual(sharding.shard_of(patient_id), target)
+        self.assertEqual(CheckUp.objects.using(target).filter(patient_id=patient_id).count(), 2)
+        self.assertNotIn(patient_id, self.shard_ids(source))
+        # Only the renumbering of the second attempt is logged
+        events = list(ChangeEvent.objects.filter(pk__gt=last_event).values_list('model', 'op', 'object_id'))
+        self.assertEqual(events[-1], ('patient', 'update', patient_id))
+        self.assertEqual(len(events), len(set(events)))
+        results = self.client.get('/patient-app/api/search/', {'q': 'fever'}).data['results']
+        self.assertEqual(sorted(result['patient_id'] for result in results), [patient_id - 1, patient_id])
+
+    def test_move_patient_renumbers_taken_ids(self):
+        ids = [self.create(i) for i in range(2)]
+        moving, staying = ids if sharding.shard_of(ids[0]) != sharding.shard_of(ids[1]) else (ids[0], self.create(2))
+        target = sharding.shard_of(staying)
+        taken = set(CheckUp.objects.using(target).values_list('pk', flat=True))
+        source = sharding.shard_of(moving)
+        old_ids = list(CheckUp.objects.using(source).filter(patient_id=moving).values_list('pk', flat=True))
+        self.assertTrue(taken & set(old_ids))
+        last_event = ChangeEvent.objects.order_by('-pk').values_list('pk', flat=True).first()
+        sharding.move_patient(moving, target)
+
+        new_ids = sorted(CheckUp.objects.using(target).filter(patient_id=moving).values_list('pk', flat=True))
+        self.assertFalse(taken & set(new_ids))
+        events = set(ChangeEvent.objects.filter(pk__gt=last_event, model='checkup').values_list('op', 'object_id'))
+        renumbered = {('delete', pk) for pk in old_ids if pk in taken}
+        self.assertEqual(events, renumbered | {('create', pk) for pk in new_ids if pk not in old_ids})
+        treatment = TreatmentPlan.objects.using(target).get(patient_id=moving)
+        self.assertIn(treatment.checkup_id, new_ids)
+        self.assertEqual(Patient.objects.using(target).get(pk=moving).checkups_count, 2)
+        self.assertEqual(CheckUp.objects.using(target).filter(patient_id=staying).count(), 2)
+
+    def test_rebalance_evens_out_shards(self):
+        # Patients created before sharding was turned on all sit on 'default'
+        with override_settings(SHARDS=['default']):
+            patients = [make_patient(i) for i in range(5)]
+        out = io.StringIO()
+        call_command('rebalance_shards', even=True, stdout=out)
+        self.assertIn('Registered 5 patients', out.getvalue())
+        self.assertEqual((len(self.shard_ids('default')), len(self.shard_ids('shard_1'))), (3, 2))
+        self.assertEqual(sorted(self.shard_ids('default') + self.shard_ids('shard_1')), [p.pk for p in patients])
+
+        # New ids continue after the registered ones
+        self.assertGreater(self.create(9), patients[-1].pk)
+
+    def test_rebalance_needs_shards(self):
+        with override_settings(SHARDS=['default']), self.assertRaises(CommandError):
+            call_command('rebalance_shards', even=True, stdout=io.StringIO())
+        with self.assertRaises(CommandError):
+            call_command('rebalance_shards', move=1, to='elsewhere', stdout=io.StringIO())
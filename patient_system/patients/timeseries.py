@@ -0,0 +1,171 @@
+"""
+Vital sign time series of a patient
+
+Reads the numeric vitals columns of a patient's checkups (patients/vitals.py)
+into NumPy arrays, ordered by checkup date through the (patient,
+date_of_checkup) index, and resamples them into calendar buckets with the
+min, mean and max of every bucket plus a rolling mean and standard deviation
+over the bucket means.
+
+Responses never hold more than MAX_BUCKETS buckets per metric: a bucket size
+that would exceed it is widened to the next one, and the default ('auto')
+picks the finest size that fits.
+"""
+import numpy as np
+from django.utils.dateparse import parse_date
+
+from .models import CheckUp
+from .vitals import RANGE_FILTERS
+
+
+BUCKETS = ('day', 'week', 'month', 'quarter', 'year')
+MAX_BUCKETS = 500
+DEFAULT_WINDOW = 3
+MAX_WINDOW = 50
+
+# Metric name -> column, the same names as the range filters of the patient list
+METRICS = RANGE_FILTERS
+UNITS = {
+    'systolic': 'mmHg',
+    'diastolic': 'mmHg',
+    'heart_rate': 'bpm',
+    'temperature': '°C',
+    'weight': 'kg',
+    'height': 'cm',
+    'bmi': 'kg/m²',
+}
+
+# 1970-01-05, day 4 of the epoch, is a Monday
+_MONDAY_OFFSET = 4
+
+
+def parse_params(params):
+    """
+    Read metric, from, to, bucket and window from query parameters.
+    Raises ValueError with a readable message on bad input.
+    """
+    names = [name.strip() for name in (params.get('metric') or '').split(',') if name.strip()]
+    unknown = [name for name in names if name not in METRICS]
+    if unknown:
+        raise ValueError(f"Unknown metric {', '.join(unknown)}; choose from {', '.join(METRICS)}.")
+
+    dates = {}
+    for key in ('from', 'to'):
+        raw = params.get(key)
+        try:
+            dates[key] = parse_date(raw) if raw else None
+        except ValueError:
+            dates[key] = None
+        if raw and dates[key] is None:
+            raise ValueError(f"'{key}' must be a date (YYYY-MM-DD).")
+
+    bucket = params.get('bucket') or 'auto'
+    if bucket != 'auto' and bucket not in BUCKETS:
+        raise ValueError(f"'bucket' must be auto or one of {', '.join(BUCKETS)}.")
+
+    try:
+        window = int(params.get('window') or DEFAULT_WINDOW)
+    except ValueError:
+        raise ValueError("'window' must be an integer.")
+    if not 1 <= window <= MAX_WINDOW:
+        raise ValueError(f"'window' must be between 1 and {MAX_WINDOW}.")
+
+    return names or list(METRICS), dates['from'], dates['to'], bucket, window
+
+
+def load(patient_id, metrics, start=None, end=None):
+    """(dates as datetime64[D], {metric: float array with NaN for missing values})"""
+    columns = [METRICS[metric] for metric in metrics]
+    rows = CheckUp.objects.filter(patient_id=patient_id, date_of_checkup__isnull=False)
+    if start:
+        rows = rows.filter(date_of_checkup__gte=start)
+    if end:
+        rows = rows.filter(date_of_checkup__lte=end)
+    rows = list(rows.order_by('date_of_checkup', 'pk').values_list('date_of_checkup', *columns))
+
+    dates = np.array([row[0] for row in rows], dtype='datetime64[D]')
+    values = np.array([row[1:] for row in rows], dtype=float).reshape(len(rows), len(columns))
+    return dates, {metric: values[:, i] for i, metric in enumerate(metrics)}
+
+
+def bucket_starts(dates, bucket):
+    """First day of the bucket of every date"""
+    if bucket == 'day':
+        return dates
+    if bucket == 'week':
+        weekday = (dates.astype('int64') - _MONDAY_OFFSET) % 7
+        return dates - weekday.astype('timedelta64[D]')
+    if bucket == 'month':
+        return dates.astype('datetime64[M]').astype('datetime64[D]')
+    if bucket == 'quarter':
+        months = dates.astype('datetime64[M]')
+        return (months - (months.astype('int64') % 3).astype('timedelta64[M]')).astype('datetime64[D]')
+    return dates.astype('datetime64[Y]').astype('datetime64[D]')
+
+
+def _bucket_edges(starts):
+    """Index of the first row of every bucket of sorted bucket starts"""
+    if not len(starts):
+        return np.zeros(0, dtype=np.int64)
+    return np.flatnonzero(np.concatenate(([True], starts[1:] != starts[:-1])))
+
+
+def choose_bucket(dates, bucket='auto'):
+    """`bucket`, widened until the dates fall in at most MAX_BUCKETS buckets"""
+    candidates = BUCKETS if bucket == 'auto' else BUCKETS[BUCKETS.index(bucket):]
+    for candidate in candidates:
+        if len(_bucket_edges(bucket_starts(dates, candidate))) <= MAX_BUCKETS:
+            return candidate
+    return BUCKETS[-1]
+
+
+def rolling(values, window):
+    """Rolling mean and population standard deviation over the last `window` values"""
+    sums = np.concatenate(([0.0], np.cumsum(values)))
+    squares = np.concatenate(([0.0], np.cumsum(values ** 2)))
+    ends = np.arange(1, len(values) + 1)
+    starts = np.maximum(ends - window, 0)
+    counts = ends - starts
+    mean = (sums[ends] - sums[starts]) / counts
+    variance = np.maximum((squares[ends] - squares[starts]) / counts - mean ** 2, 0.0)
+    return mean, np.sqrt(variance)
+
+
+def resample(dates, values, bucket, window=DEFAULT_WINDOW):
+    """Columnar per-bucket statistics of one metric, dates sorted ascending"""
+    present = ~np.isnan(values)
+    dates, values = dates[present], values[present]
+    starts = bucket_starts(dates, bucket)
+    edges = _bucket_edges(starts)
+    if not len(edges):
+        return {'start': [], 'count': [], 'min': [], 'mean': [], 'max': [], 'rolling_mean': [], 'rolling_std': []}
+
+    counts = np.diff(np.concatenate((edges, [len(values)])))
+    mean = np.add.reduceat(values, edges) / counts
+    rolling_mean, rolling_std = rolling(mean, window)
+    return {
+        'start': np.datetime_as_string(starts[edges]).tolist(),
+        'count': counts.tolist(),
+        'min': np.round(np.minimum.reduceat(values, edges), 2).tolist(),
+        'mean': np.round(mean, 2).tolist(),
+        'max': np.round(np.maximum.reduceat(values, edges), 2).tolist(),
+        'rolling_mean': np.round(rolling_mean, 2).tolist(),
+        'rolling_std': np.round(rolling_std, 2).tolist(),
+    }
+
+
+def patient_series(patient_id, metrics, start=None, end=None, bucket='auto', window=DEFAULT_WINDOW):
+    """Vitals time series document of a patient"""
+    dates, values = load(patient_id, metrics, start, end)
+    bucket = choose_bucket(dates, bucket)
+    return {
+        'patient_id': patient_id,
+        'from': start,
+        'to': end,
+        'bucket': bucket,
+        'window': window,
+        'metrics': {
+            metric: {'unit': UNITS[metric], **resample(dates, values[metric], bucket, window)}
+            for metric in metrics
+        },
+    }
@@ -0,0 +1,98 @@
+"""
+Diff-based writes for a patient's related rows
+
+Applies a set of submitted rows to one related table of a patient by id:
+rows whose values changed are updated, rows without a stored id are inserted
+in bulk and only removed rows are deleted. Unchanged rows cost no writes, so an
+edit costs writes proportional to what changed, not to the patient's history.
+"""
+from .signals import send_rows_changed
+
+
+class SyncResult:
+    """Rows touched by sync_rows"""
+
+    def __init__(self):
+        # Every kept row (stored or created) in submission order
+        self.rows = []
+        self.created = []
+        self.updated = []
+        self.deleted = []
+
+    @property
+    def changed(self):
+        return bool(self.created or self.updated or self.deleted)
+
+
+def sync_rows(model, patient, rows, fields, delete_ids=(), delete_missing=False, new_defaults=None):
+    """
+    Apply submitted rows to `model` rows of `patient`.
+
+    rows: list of (id or None, {field: value}) pairs. Rows with an id that
+          belongs to the patient are updated when a value differs; other rows
+          are inserted.
+    fields: model fields that may be written from the submitted values
+    delete_ids: ids to delete
+    delete_missing: also delete every stored row that was not submitted
+    new_defaults: extra attribute values for inserted rows
+
+    Must run inside a transaction. Returns a SyncResult.
+    """
+    result = SyncResult()
+    delete_ids = set(delete_ids)
+    submitted_ids = {pk for pk, _ in rows if pk is not None} - delete_ids
+    stored = model.objects.filter(patient=patient, pk__in=submitted_ids).in_bulk() if submitted_ids else {}
+    for row in stored.values():
+        row.patient = patient
+
+    changed_fields = set()
+    for pk, values in rows:
+        if pk in delete_ids:
+            continue
+        values = {name: value for name, value in values.items() if name in fields}
+        row = stored.get(pk)
+
+        if row is None:
+            row = model(patient=patient, **values)
+            for name, value in (new_defaults or {}).items():
+                setattr(row, name, value)
+            result.created.append(row)
+            result.rows.append(row)
+            continue
+
+        result.rows.append(row)
+
+        row_changes = [name for name, value in values.items() if getattr(row, name) != value]
+        if row_changes:
+            for name in row_changes:
+                setattr(row, name, values[name])
+            changed_fields.update(row_changes)
+            result.updated.append(row)
+
+    # bulk_create and bulk_update skip save(), which fills the derived columns
+    derived_fields = getattr(model, 'DERIVED_FIELDS', ())
+    if derived_fields:
+        for row in result.created + result.updated:
+            row.fill_derived_fields()
+        if result.updated:
+            changed_fields.update(derived_fields)
+
+    # bulk_create and bulk_update do not send post_save, deletes below do send post_delete
+    if result.created:
+        model.objects.bulk_create(result.created)
+        send_rows_changed(model, 'create', result.created)
+    if result.updated:
+        model.objects.bulk_update(result.updated, sorted(changed_fields))
+        send_rows_changed(model, 'update', result.updated)
+
+    removed = model.objects.filter(patient=patient)
+    if delete_missing:
+        removed = removed.exclude(pk__in=set(stored) | {row.pk for row in result.created})
+    else:
+        removed = removed.filter(pk__in=delete_ids)
+    if delete_missing or delete_ids:
+        result.deleted = list(removed.values_list('pk', flat=True))
+        if result.deleted:
+            model.objects.filter(pk__in=result.deleted).delete()
+
+    return result
@@ -2,6 +2,7 @@ from django.contrib import admin
 from django.urls import path, include
 from . import views
 from . import ai_views
+from . import async_ai_views
 
 urlpatterns = [
     path('admin/', admin.site.urls),
@@ -9,12 +10,26 @@ urlpatterns = [
     # Single endpoint for all patient CRUD operations
     path('api/patients/', views.complete_patient_data, name='patient-list-create'),
     path('api/patients/<int:patient_id>/', views.complete_patient_data, name='patient-detail'),
+    path('api/patients/<int:patient_id>/vitals/', views.patient_vitals, name='patient-vitals'),
+    path('api/patients/<int:patient_id>/purge/', views.purge_status, name='patient-purge-status'),
+    path('api/patients/bulk/', views.bulk_create_patients, name='patient-bulk-create'),
+    path('api/patients/export/', views.export_patients, name='patient-export'),
+    path('api/cache/stats/', views.record_cache_status, name='record-cache-stats'),
+    path('api/changes/', views.changes_feed, name='changes-feed'),
+    path('api/search/', views.search_patients, name='patient-search'),
+    path('api/analytics/cohort/', views.cohort_analytics, name='cohort-analytics'),
+    path('api/followups/', views.followup_schedule, name='followup-schedule'),
     
     # AI Summary endpoints
     path('api/patients/<int:patient_id>/summary/', ai_views.generate_ai_summary, name='patient-ai-summary'),
     path('api/summary/text/', ai_views.generate_summary_from_text, name='summary-from-text'),
     path('api/summary/file/', ai_views.generate_summary_from_file, name='summary-from-file'),
 
+    # Async AI Summary endpoints (for ASGI deployments)
+    path('api/async/patients/<int:patient_id>/summary/', async_ai_views.generate_ai_summary, name='patient-ai-summary-async'),
+    path('api/async/summary/text/', async_ai_views.generate_summary_from_text, name='summary-from-text-async'),
+    path('api/async/summary/file/', async_ai_views.generate_summary_from_file, name='summary-from-file-async'),
+
     # HTML form pages
     path('patients/new/', views.create_complete_patient_form, name='create_complete_patient_form'),
     path('patients/<int:patient_id>/edit/', views.edit_complete_patient_form, name='edit_complete_patient_form'),
@@ -0,0 +1,89 @@
+"""
+Version stamps for patient data
+
+Every patient carries a version number and an updated_at timestamp that change
+on any write to the patient or its related rows, and the patient tables as a
+whole share a TableVersion row. The API uses them as strong ETags and
+Last-Modified values, so conditional GETs can be answered from the patient
+table (or the single TableVersion row) without touching the related tables.
+The ETag also names the negotiated format (JSON, MessagePack, browsable API),
+so the views send Vary: Accept and caches keep one copy per format.
+"""
+import hashlib
+
+from django.db.models import F
+from django.utils import timezone
+from rest_framework.exceptions import NotAcceptable
+from rest_framework.negotiation import DefaultContentNegotiation
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+
+from .models import Patient, TableVersion
+
+
+PATIENT_TABLES = 'patients'
+
+
+def bump_patients(patient_ids):
+    """Give the patients a new version"""
+    patient_ids = {patient_id for patient_id in patient_ids if patient_id is not None}
+    if patient_ids:
+        Patient.objects.filter(pk__in=patient_ids).update(version=F('version') + 1, updated_at=timezone.now())
+
+
+def bump_table(name=PATIENT_TABLES):
+    """Give a set of tables a new version"""
+    updated = TableVersion.objects.filter(name=name).update(version=F('version') + 1, updated_at=timezone.now())
+    if not updated:
+        TableVersion.objects.get_or_create(name=name, defaults={'version': 1})
+
+
+def table_version(name=PATIENT_TABLES):
+    """(version, updated_at) of a set of tables"""
+    row = TableVersion.objects.filter(name=name).values_list('version', 'updated_at').first()
+    return row or (0, None)
+
+
+def _params_digest(request):
+    """Short digest of the query string, so each variant of a URL has its own ETag"""
+    query = request.GET.urlencode()
+    return hashlib.sha1(query.encode()).hexdigest()[:12] if query else ''
+
+
+def _response_format(request):
+    """Format of the renderer DRF will pick for the request, '' when none is acceptable"""
+    renderers = [renderer_class() for renderer_class in api_settings.DEFAULT_RENDERER_CLASSES]
+    try:
+        renderer, _ = DefaultContentNegotiation().select_renderer(Request(request), renderers)
+    except NotAcceptable:
+        return ''
+    return renderer.format
+
+
+def _request_version(request, patient_id=None):
+    """(kind, version, updated_at) for the request, read once per request"""
+    cached = getattr(request, '_patient_data_version', None)
+    if cached is not None:
+        return cached
+
+    if patient_id is not None:
+        row = Patient.objects.filter(pk=patient_id).values_list('version', 'updated_at').first()
+        cached = ('p%s' % patient_id,) + row if row else (None, None, None)
+    else:
+        cached = ('all',) + tuple(table_version())
+    request._patient_data_version = cached
+    return cached
+
+
+def patient_data_etag(request, patient_id=None):
+    """Strong ETag of a patient (or of the patient list when no id is given)"""
+    kind, version, _ = _request_version(request, patient_id)
+    if kind is None:
+        return None
+    digest = _params_digest(request)
+    return f'"{kind}-v{version}-{_response_format(request)}{"-" + digest if digest else ""}"'
+
+
+def patient_data_last_modified(request, patient_id=None):
+    """Last-Modified of a patient (or of the patient tables when no id is given)"""
+    return _request_version(request, patient_id)[2]
@@ -2,12 +2,16 @@ from rest_framework import status
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
 from django.shortcuts import  render, redirect, get_object_or_404
-from django.db import transaction
 from datetime import datetime
-from .models import Patient, MedicalHistory, CheckUp, LabTests, TreatmentPlan, AdditionalNote
+from .models import Patient, MedicalHistory, CheckUp, LabTests, TreatmentPlan, AdditionalNote, ChangeEvent, PurgeJob
 from django.contrib import messages
-from django.db import transaction
-from django.http import JsonResponse
+from django.conf import settings
+from django.http import Http404, JsonResponse, StreamingHttpResponse
+from django.utils.dateparse import parse_date
+from django.utils.functional import SimpleLazyObject
+from django.views.decorators.cache import cache_control
+from django.views.decorators.vary import vary_on_headers
+from django.views.decorators.http import condition
 from .forms import (
     PatientForm, MedicalHistoryForm, CheckUpFormSet, 
     LabTestsFormSet, TreatmentPlanFormSet, AdditionalNoteFormSet
@@ -20,19 +24,41 @@ from .serializer import (
     TreatmentPlanSerializer, 
     AdditionalNoteSerializer
 )
+from .roster import (
+    LIST_PAGE_SIZE, list_page, parse_list_params, parse_page_params, roster_page, roster_queryset,
+    with_vitals_in_range,
+)
+from .bulk import bulk_import
+from .records import parse_selection
+from .cache import get_complete_record, get_complete_record_or_404, stats as record_cache_stats
+from .export import export_queryset, iter_ndjson
+from .upsert import sync_rows
+from .versioning import patient_data_etag, patient_data_last_modified
+from .replica import read_from_replica, stream_from_replica
+from . import analytics, archive, followups, purge, search, sharding, timeseries, vitals
 import os
 import sys
 import json
 
 # Api Views
-@api_view(['POST', 'GET', 'PUT', 'DELETE'])
+@read_from_replica(methods=('GET', 'HEAD'))
+@sharding.on_patient_shard
+@cache_control(private=True, no_cache=True)
+@vary_on_headers('Accept')
+@condition(etag_func=patient_data_etag, last_modified_func=patient_data_last_modified)
+@api_view(['POST', 'GET', 'PUT', 'PATCH', 'DELETE'])
 def complete_patient_data(request, patient_id=None):
     """
     Single view to handle all CRUD operations for complete patient data
     POST: Create complete patient record with all related data
     GET: Retrieve patient with all related data  
-    PUT: Update patient and related data
+    PUT/PATCH: Update patient and related data
     DELETE: Delete patient and all related data
+
+    Responses carry a strong ETag and Last-Modified built from the patient's
+    version stamp (or the table version for the list), so GETs with
+    If-None-Match/If-Modified-Since get a 304 without reading related rows.
+    Cache-Control: no-cache makes browsers revalidate instead of refetching.
     """
     
     if request.method == 'POST':
@@ -44,16 +70,17 @@ def complete_patient_data(request, patient_id=None):
         else:
             return get_all_patients(request)
     
-    elif request.method == 'PUT':
+    elif request.method in ('PUT', 'PATCH'):
         return update_complete_patient(request, patient_id)
     
     elif request.method == 'DELETE':
-        return delete_patient(request, patient_id)
+        return delete_complete_patient(request, patient_id)
 
 
 def create_complete_patient(request):
     """Create a complete patient record with all related data"""
-    with transaction.atomic():
+    new_id, shard = sharding.new_patient()
+    with sharding.using_shard(shard), sharding.atomic():
         try:
             # Extract patient data
             patient_data = request.data.get('patient', {})
@@ -66,7 +93,7 @@ def create_complete_patient(request):
                 }, status=status.HTTP_400_BAD_REQUEST)
             
             # Create patient
-            patient = patient_serializer.save()
+            patient = patient_serializer.save(id=new_id)
             
             created_data = {
                 'patient': patient_serializer.data,
@@ -184,47 +211,78 @@ def create_complete_patient(request):
             }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
+@api_view(['POST'])
+def bulk_create_patients(request):
+    """
+    Create many complete patient records in one request
+    POST: Array of complete patient payloads (same shape as POST /api/patients/),
+          either as the request body or under a "patients" key
+
+    Records are validated in list form and written with bulk_create in chunked
+    transactions. Invalid records are reported by their index in the request
+    and do not stop the rest of the batch.
+    """
+    payloads = request.data
+    if isinstance(payloads, dict):
+        payloads = payloads.get('patients')
+
+    if not isinstance(payloads, list) or not payloads:
+        return Response({
+            'error': 'No patient records provided',
+            'details': 'Send a non-empty array of complete patient records'
+        }, status=status.HTTP_400_BAD_REQUEST)
+
+    try:
+        report = bulk_import(payloads)
+    except Exception as e:
+        return Response({
+            'error': 'Failed to import patient records',
+            'details': str(e)
+        }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    if not report['failed']:
+        response_status = status.HTTP_201_CREATED
+    elif report['created']:
+        response_status = status.HTTP_207_MULTI_STATUS
+    else:
+        response_status = status.HTTP_400_BAD_REQUEST
+
+    return Response({
+        'message': f"{report['created']} of {report['received']} patient records created",
+        **report
+    }, status=response_status)
+
+
 def get_complete_patient(request, patient_id):
-    """Retrieve a complete patient record with all related data"""
+    """
+    Retrieve a complete patient record with all related data
+
+    Query parameters:
+    - include: related sections to return next to the patient, e.g.
+      include=checkups,treatments
+    - fields: sections or fields to return, e.g. fields=patient_name,age,checkups.date_of_checkup
+    - include_archived: 1 to add the archived checkups, lab tests and notes
+    Sections that are not requested are not read from the database.
+    """
     try:
-        patient = get_object_or_404(Patient, id=patient_id)
-        
-        # Serialize patient data
-        patient_data = PatientSerializer(patient).data
-        
-        # Get all related data
-        complete_data = {
-            'patient': patient_data,
-            'medical_history': None,
-            'checkups': [],
-            'lab_tests': [],
-            'treatments': [],
-            'notes': []
-        }
-        
-        # Medical History
-        medical_history = patient.medical_history.first()
-        if medical_history:
-            complete_data['medical_history'] = MedicalHistorySerializer(medical_history).data
-        
-        # CheckUps (ordered by date)
-        checkups = patient.checkups.all().order_by('-date_of_checkup')
-        complete_data['checkups'] = CheckUpSerializer(checkups, many=True).data
-        
-        # Lab Tests
-        lab_tests = patient.labtests.all()
-        complete_data['lab_tests'] = LabTestsSerializer(lab_tests, many=True).data
-        
-        # Treatment Plans (ordered by follow-up date)
-        treatments = patient.treatments.all().order_by('-next_followup_date')
-        complete_data['treatments'] = TreatmentPlanSerializer(treatments, many=True).data
-        
-        # Additional Notes
-        notes = patient.notes.all()
-        complete_data['notes'] = AdditionalNoteSerializer(notes, many=True).data
+        selected = parse_selection(request.query_params.get('fields'), request.query_params.get('include'))
+    except ValueError as ve:
+        return Response({
+            'error': 'Invalid field selection',
+            'details': str(ve)
+        }, status=status.HTTP_400_BAD_REQUEST)
+
+    try:
+        # Patient, medical history, checkups (newest first), lab tests,
+        # treatment plans (by follow-up date) and notes, cached per patient
+        complete_data = get_complete_record_or_404(patient_id, selected)
+        if request.query_params.get('include_archived') in ('1', 'true'):
+            complete_data = archive.with_archived(complete_data, patient_id, selected)
         
         return Response(complete_data)
         
+    except Http404:
+        raise
     except Exception as e:
         return Response({
             'error': 'Failed to retrieve patient data',
@@ -232,27 +290,303 @@ def get_complete_patient(request, patient_id):
         }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
+@read_from_replica
+@api_view(['GET'])
+def export_patients(request):
+    """
+    Stream complete patient records as newline-delimited JSON
+    GET: One complete record (same shape as GET /api/patients/<id>/) per line
+
+    Query parameters:
+    - since: ISO date, only patients with a checkup on or after this date
+    - fields: comma separated sections or fields to export, e.g.
+      fields=patient_name,age,checkups.date_of_checkup,treatments
+    - include: related sections to export whole next to the patient
+    """
+    try:
+        selected = parse_selection(request.query_params.get('fields'), request.query_params.get('include'))
+        since = request.query_params.get('since')
+        since = datetime.strptime(since, '%Y-%m-%d').date() if since else None
+    except ValueError as ve:
+        return Response({
+            'error': 'Invalid export parameters',
+            'details': str(ve)
+        }, status=status.HTTP_400_BAD_REQUEST)
+
+    # The records are read while the response streams, after the view returned
+    response = StreamingHttpResponse(
+        stream_from_replica(iter_ndjson(export_queryset(since=since), selected)), content_type='application/x-ndjson'
+    )
+    response['Content-Disposition'] = 'attachment; filename="patients.ndjson"'
+    return response
+
+
+@api_view(['GET'])
+def record_cache_status(request):
+    """Hit and miss counters of the complete record cache in this process"""
+    return Response(record_cache_stats.as_dict())
+
+
+@api_view(['GET'])
+def changes_feed(request):
+    """
+    Feed of writes to patients and their related records, in change order
+    GET: ?since=<seq>&limit=<page size>
+
+    Each event is {"seq", "model", "id", "op", "patient_id", "at"} where op is
+    create, update, delete, or archive and restore for rows moved to and from
+    the patient's archive. Clients keep the last seq they processed and pass
+    it as since to receive only newer changes.
+    """
+    try:
+        since, limit = parse_page_params(request.query_params, cursor='since')
+    except ValueError as ve:
+        return Response({
+            'error': 'Invalid feed parameters',
+            'details': str(ve)
+        }, status=status.HTTP_400_BAD_REQUEST)
+
+    try:
+        events = list(
+            ChangeEvent.objects.filter(pk__gt=since).order_by('pk')
+            .values_list('pk', 'model', 'object_id', 'op', 'patient_id', 'created_at')[:limit + 1]
+        )
+        has_more = len(events) > limit
+        events = events[:limit]
+
+        return Response({
+            'changes': [
+                {'seq': seq, 'model': model, 'id': object_id, 'op': op, 'patient_id': patient_id, 'at': created_at}
+                for seq, model, object_id, op, patient_id, created_at in events
+            ],
+            'next_since': events[-1][0] if events else since,
+            'has_more': has_more
+        })
+
+    except Exception as e:
+        return Response({
+            'error': 'Failed to read changes feed',
+            'details': str(e)
+        }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+@api_view(['GET'])
+def search_patients(request):
+    """
+    Full-text search over the clinical text of all patients
+    GET: ?q=<words>&limit=<page size>&offset=<rows to skip>
+
+    Results are patients ordered by their best matching row, each with its
+    score, number of matching rows and highlighted hits:
+    {"patient_id", "patient_name", "score", "matches",
+     "hits": [{"section", "id", "snippet"}]}
+    """
+    match = search.match_query(request.query_params.get('q'))
+    try:
+        offset, limit = parse_page_params(request.query_params, cursor='offset')
+        if match is None:
+            raise ValueError("'q' must contain at least one word.")
+    except ValueError as ve:
+        return Response({
+            'error': 'Invalid search parameters',
+            'details': str(ve)
+        }, status=status.HTTP_400_BAD_REQUEST)
+
+    if not search.is_enabled():
+        return Response({
+            'error': 'Search not available',
+            'details': 'Full-text search needs the SQLite database backend'
+        }, status=status.HTTP_501_NOT_IMPLEMENTED)
+
+    limit = min(limit if 'limit' in request.query_params else search.DEFAULT_PAGE_SIZE, search.MAX_PAGE_SIZE)
+    try:
+        results, has_more = search.search_patients(match, limit=limit, offset=offset)
+        patient_ids = [r['patient_id'] for r in results]
+        names = {}
+        for shard_names in sharding.fan_out(
+            lambda: dict(Patient.objects.filter(pk__in=patient_ids).values_list('pk', 'patient_name'))
+        ):
+            names.update(shard_names)
+        for result in results:
+            result['patient_name'] = names.get(result['patient_id'])
+
+        return Response({
+            'query': request.query_params.get('q'),
+            'results': results,
+            'limit': limit,
+            'offset': offset,
+            'next_offset': offset + limit if has_more else None
+        })
+
+    except Exception as e:
+        return Response({
+            'error': 'Search failed',
+            'details': str(e)
+        }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+@read_from_replica
+@sharding.on_patient_shard
+@cache_control(private=True, no_cache=True)
+@vary_on_headers('Accept')
+@condition(etag_func=patient_data_etag, last_modified_func=patient_data_last_modified)
+@api_view(['GET'])
+def patient_vitals(request, patient_id):
+    """
+    Vital sign trends of a patient
+    GET: ?metric=systolic,heart_rate&from=2020-01-01&to=2024-12-31&bucket=month&window=3
+
+    Every metric comes back as columns of per-bucket statistics:
+    {"unit", "start", "count", "min", "mean", "max", "rolling_mean", "rolling_std"}
+    bucket is day, week, month, quarter, year or auto (the default); it is
+    widened when the range would need more than timeseries.MAX_BUCKETS buckets.
+    """
+    get_object_or_404(Patient.objects.only('pk'), pk=patient_id)
+    try:
+        metrics, start, end, bucket, window = timeseries.parse_params(request.query_params)
+    except ValueError as ve:
+        return Response({
+            'error': 'Invalid vitals parameters',
+            'details': str(ve)
+        }, status=status.HTTP_400_BAD_REQUEST)
+
+    try:
+        return Response(timeseries.patient_series(patient_id, metrics, start, end, bucket, window))
+    except Exception as e:
+        return Response({
+            'error': 'Failed to retrieve vitals',
+            'details': str(e)
+        }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+@api_view(['GET'])
+def purge_status(request, patient_id):
+    """
+    Progress of the removal of a deleted patient's data
+    GET: {"patient_id", "status": pending|running|done|failed, "total_rows",
+          "deleted_rows", "percent", "error", "updated_at", "finished_at"}
+    """
+    job = PurgeJob.objects.filter(patient_id=patient_id).first()
+    if job is None:
+        return Response({
+            'error': 'No purge for this patient',
+            'details': f'Patient {patient_id} has not been deleted.'
+        }, status=status.HTTP_404_NOT_FOUND)
+    return Response(purge.progress(job))
+
+
+@read_from_replica
+@api_view(['GET'])
+def cohort_analytics(request):
+    """
+    Cohort statistics across all patients and checkups
+    GET: ?from=<checkup date>&to=<checkup date>&top=<diagnoses>&refresh=1
+
+    BMI histogram and categories, blood pressure percentiles by age band and
+    gender and the most frequent diagnoses (patients/analytics.py). Results
+    are cached for settings.ANALYTICS_CACHE_TIMEOUT seconds; refresh=1
+    recomputes them.
+    """
+    try:
+        start, end, top = analytics.parse_params(request.query_params)
+    except ValueError as ve:
+        return Response({
+            'error': 'Invalid analytics parameters',
+            'details': str(ve)
+        }, status=status.HTTP_400_BAD_REQUEST)
+
+    try:
+        refresh = request.query_params.get('refresh') in ('1', 'true')
+        return Response(analytics.cohort_analytics(start, end, top, refresh=refresh))
+    except Exception as e:
+        return Response({
+            'error': 'Failed to compute cohort analytics',
+            'details': str(e)
+        }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+@read_from_replica
+@api_view(['GET'])
+def followup_schedule(request):
+    """
+    Treatment plans due for follow-up, soonest first
+    GET: ?from=<date, default today>&to=<date, default from + 7 days>&doctor=<assigned doctor>
+         &after=<next_after of the previous page>&limit=<page size>
+
+    Each follow-up carries a stub of its patient (id, name, age, gender, phone).
+    """
+    try:
+        start, end, doctor, after, limit = followups.parse_params(request.query_params)
+    except ValueError as ve:
+        return Response({
+            'error': 'Invalid follow-up parameters',
+            'details': str(ve)
+        }, status=status.HTTP_400_BAD_REQUEST)
+
+    try:
+        results, next_after = followups.followups_page(start, end, doctor=doctor, after=after, limit=limit)
+        return Response({
+            'from': start,
+            'to': end,
+            'doctor': doctor,
+            'count': len(results),
+            'followups': results,
+            'limit': limit,
+            'next_after': next_after
+        })
+    except Exception as e:
+        return Response({
+            'error': 'Failed to retrieve follow-ups',
+            'details': str(e)
+        }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
 def get_all_patients(request):
-    """Get all patients with basic info and counts of related records"""
+    """
+    Get a page of patients with basic info and counts of related records.
+    Counts and the last checkup date are columns of the patient table.
+    Pagination is keyset based: ?after=<last patient id>&limit=<page size>
+    Vital sign ranges (?systolic_min=140&heart_rate_max=60) keep the patients
+    with a checkup inside all of them.
+    """
     try:
-        patients = Patient.objects.all()
+        try:
+            after, limit = parse_page_params(request.query_params)
+        except ValueError as ve:
+            return Response({
+                'error': 'Invalid pagination parameters',
+                'details': str(ve)
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            vital_ranges = vitals.parse_range_filters(request.query_params)
+        except ValueError as ve:
+            return Response({
+                'error': 'Invalid vital sign filters',
+                'details': str(ve)
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        queryset = with_vitals_in_range(roster_queryset(), vital_ranges)
+        patients, next_after = roster_page(after=after, limit=limit, queryset=queryset)
         patients_data = []
-        
+
         for patient in patients:
             patient_info = PatientSerializer(patient).data
             patient_info.update({
-                'medical_history_count': patient.medical_history.count(),
-                'checkups_count': patient.checkups.count(),
-                'lab_tests_count': patient.labtests.count(),
-                'treatments_count': patient.treatments.count(),
-                'notes_count': patient.notes.count(),
-                'last_checkup_date': patient.checkups.first().date_of_checkup if patient.checkups.exists() else None
+                'medical_history_count': patient.medical_history_count,
+                'checkups_count': patient.checkups_count,
+                'lab_tests_count': patient.lab_tests_count,
+                'treatments_count': patient.treatments_count,
+                'notes_count': patient.notes_count,
+                'last_checkup_date': patient.last_checkup_date
             })
             patients_data.append(patient_info)
-        
+
         return Response({
             'count': len(patients_data),
-            'patients': patients_data
+            'patients': patients_data,
+            'limit': limit,
+            'next_after': next_after
         })
         
     except Exception as e:
@@ -262,68 +596,195 @@ def get_all_patients(request):
         }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
-def update_complete_patient(request, patient_id):
-    """Update patient and related data"""
-    with transaction.atomic():
+# Related sections that accept row level changes in updates
+ROW_SECTIONS = {
+    'checkups': CheckUpSerializer,
+    'lab_tests': LabTestsSerializer,
+    'treatments': TreatmentPlanSerializer,
+    'notes': AdditionalNoteSerializer,
+}
+
+
+def validate_row_changes(patient, serializer_class, items):
+    """
+    Validate the row changes sent for one related section of a patient.
+    Returns (rows, delete_ids, archived_ids, errors): archived_ids are the
+    ids of rows to restore from the archive (patients/archive.py) before the
+    changes are applied, and errors lines up with the items and holds an empty
+    dict for every valid item. Nothing is written.
+    """
+    if not isinstance(items, list):
+        items = [items]
+    model = serializer_class.Meta.model
+
+    def row_id(item):
         try:
-            patient = get_object_or_404(Patient, id=patient_id)
-            
-            # Update patient data if provided
-            patient_data = request.data.get('patient')
-            if patient_data:
-                patient_serializer = PatientSerializer(patient, data=patient_data, partial=True)
-                if patient_serializer.is_valid():
-                    patient_serializer.save()
-                else:
-                    return Response({
-                        'error': 'Patient update validation failed',
-                        'details': patient_serializer.errors
-                    }, status=status.HTTP_400_BAD_REQUEST)
-            
-            # Update or create medical history
-            medical_history_data = request.data.get('medical_history')
-            if medical_history_data:
-                medical_history = patient.medical_history.first()
-                if medical_history:
-                    history_serializer = MedicalHistorySerializer(medical_history, data=medical_history_data, partial=True)
-                else:
-                    medical_history_data['patient'] = patient.id
-                    history_serializer = MedicalHistorySerializer(data=medical_history_data)
-                
-                if history_serializer.is_valid():
-                    history_serializer.save()
-                else:
-                    return Response({
-                        'error': 'Medical history update failed',
-                        'details': history_serializer.errors
-                    }, status=status.HTTP_400_BAD_REQUEST)
+            return int(item['id']) if isinstance(item, dict) and item.get('id') is not None else None
+        except (TypeError, ValueError):
+            return None
+
+    ids = {row_id(item) for item in items} - {None}
+    known_ids = set(model.objects.filter(patient=patient, pk__in=ids).values_list('pk', flat=True)) if ids else set()
+    archived_ids = archive.archived_ids(patient.id, model, ids - known_ids) if ids - known_ids else set()
+    known_ids |= archived_ids
+
+    rows, delete_ids, errors = [], [], []
+    for item in items:
+        if not isinstance(item, dict):
+            errors.append({'non_field_errors': ['Expected an object.']})
+            continue
+
+        item = dict(item)
+        pk = row_id(item)
+        item.pop('id', None)
+        item.pop('patient', None)
+
+        if pk is None and item.get('_delete'):
+            errors.append({'id': ['An id is required to delete a row.']})
+            continue
+        if pk is not None and pk not in known_ids:
+            errors.append({'id': [f'No {model.__name__} with id {pk} for this patient.']})
+            continue
+        if item.pop('_delete', False):
+            delete_ids.append(pk)
+            errors.append({})
+            continue
+
+        if pk is None:
+            item['patient'] = patient.id
+        serializer = serializer_class(data=item, partial=pk is not None)
+        if not serializer.is_valid():
+            errors.append(serializer.errors)
+            continue
+        data = dict(serializer.validated_data)
+        data.pop('patient', None)
+        checkup = data.get('checkup')
+        if checkup is not None and checkup.patient_id != patient.id:
+            errors.append({'checkup': [f'No CheckUp with id {checkup.pk} for this patient.']})
+            continue
+        rows.append((pk, data))
+        errors.append({})
+
+    return rows, delete_ids, archived_ids, errors
+
+
+def update_complete_patient(request, patient_id):
+    """
+    Update patient and related data (PUT/PATCH, all sections are partial)
+
+    checkups, lab_tests, treatments and notes take a list of row changes:
+    - {"id": 3, "symptoms": "..."}  update row 3 of the patient
+    - {"symptoms": "..."}           create a new row
+    - {"id": 3, "_delete": true}    delete row 3
+    Archived rows (patients/archive.py) are restored before being changed.
+
+    Every section is validated before anything is written, and all changes are
+    applied in one transaction. The response holds only the changed sections.
+    """
+    try:
+        patient = get_object_or_404(Patient.objects, id=patient_id)
+        
+        # Validate patient data if provided
+        patient_data = request.data.get('patient')
+        patient_serializer = None
+        if patient_data:
+            patient_serializer = PatientSerializer(patient, data=patient_data, partial=True)
+            if not patient_serializer.is_valid():
+                return Response({
+                    'error': 'Patient update validation failed',
+                    'details': patient_serializer.errors
+                }, status=status.HTTP_400_BAD_REQUEST)
+        
+        # Validate medical history (updated in place or created)
+        medical_history_data = request.data.get('medical_history')
+        history_serializer = None
+        if medical_history_data:
+            medical_history = patient.medical_history.first()
+            if medical_history:
+                history_serializer = MedicalHistorySerializer(medical_history, data=medical_history_data, partial=True)
+            else:
+                medical_history_data['patient'] = patient.id
+                history_serializer = MedicalHistorySerializer(data=medical_history_data)
             
-            # Handle other related data updates similar to medical history...
-            # For brevity, showing the pattern with medical history
+            if not history_serializer.is_valid():
+                return Response({
+                    'error': 'Medical history update failed',
+                    'details': history_serializer.errors
+                }, status=status.HTTP_400_BAD_REQUEST)
+        
+        # Validate row changes of the other related sections
+        section_changes = {}
+        for section, serializer_class in ROW_SECTIONS.items():
+            if section not in request.data:
+                continue
+            rows, delete_ids, archived_ids, errors = validate_row_changes(
+                patient, serializer_class, request.data[section]
+            )
+            if any(errors):
+                return Response({
+                    'error': f'{section} update validation failed',
+                    'details': errors
+                }, status=status.HTTP_400_BAD_REQUEST)
+            section_changes[section] = (rows, delete_ids, archived_ids)
+        
+        changed_data = {}
+        with sharding.atomic():
+            if patient_serializer:
+                patient_serializer.save()
+                changed_data['patient'] = patient_serializer.data
             
-            # Get updated complete data
-            return get_complete_patient(request, patient_id)
+            if history_serializer:
+                history_serializer.save()
+                changed_data['medical_history'] = history_serializer.data
             
-        except Exception as e:
-            return Response({
-                'error': 'Failed to update patient record',
-                'details': str(e)
-            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+            for section, (rows, delete_ids, archived_ids) in section_changes.items():
+                serializer_class = ROW_SECTIONS[section]
+                if archived_ids:
+                    # Archived rows are brought back before they are changed, with a new id if theirs was taken
+                    new_ids = archive.restore_rows(patient.id, serializer_class.Meta.model, archived_ids)
+                    rows = [(new_ids.get(pk, pk), data) for pk, data in rows]
+                    delete_ids = [new_ids.get(pk, pk) for pk in delete_ids]
+                fields = [name for name in serializer_class.Meta.fields if name not in ('id', 'patient')]
+                result = sync_rows(serializer_class.Meta.model, patient, rows, fields, delete_ids=delete_ids)
+                if result.changed:
+                    changed_data[section] = {
+                        'created': serializer_class(result.created, many=True).data,
+                        'updated': serializer_class(result.updated, many=True).data,
+                        'deleted': result.deleted
+                    }
+        
+        return Response({
+            'message': 'Patient record updated successfully',
+            'patient_id': patient.id,
+            'data': changed_data
+        })
+        
+    except Http404:
+        raise
+    except Exception as e:
+        return Response({
+            'error': 'Failed to update patient record',
+            'details': str(e)
+        }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
-def delete_patient(request, patient_id):
-    """Delete patient and all related data"""
+def delete_complete_patient(request, patient_id):
+    """
+    Delete patient and all related data. The patient is hidden at once and
+    its rows are removed in the background; the response holds the progress
+    of that purge, also served by GET /api/patients/<id>/purge/.
+    """
     try:
-        patient = get_object_or_404(Patient, id=patient_id)
-        patient_name = patient.patient_name
-        
-        # Django will handle cascade deletion of related records
-        patient.delete()
+        patient = get_object_or_404(Patient.objects, id=patient_id)
+        job = purge.soft_delete(patient)
         
         return Response({
-            'message': f'Patient {patient_name} and all related data deleted successfully'
-        }, status=status.HTTP_204_NO_CONTENT)
+            'message': f'Patient {patient.patient_name} deleted, related data is being removed',
+            'purge': purge.progress(job)
+        }, status=status.HTTP_202_ACCEPTED)
         
+    except Http404:
+        raise
     except Exception as e:
         return Response({
             'error': 'Failed to delete patient',
@@ -335,16 +796,18 @@ def delete_patient(request, patient_id):
 def create_complete_patient_form(request):
     """View to create complete patient record with form"""
     if request.method == 'POST':
-        return handle_patient_form_submission(request)
+        new_id, shard = sharding.new_patient()
+        with sharding.using_shard(shard):
+            return handle_patient_form_submission(request, new_id=new_id)
     
     # GET request - show empty form
     context = {
         'patient_form': PatientForm(),
         'medical_history_form': MedicalHistoryForm(),
-        'checkup_formset': CheckUpFormSet(),
-        'lab_tests_formset': LabTestsFormSet(),
-        'treatment_formset': TreatmentPlanFormSet(),
-        'notes_formset': AdditionalNoteFormSet(),
+        'checkup_formset': CheckUpFormSet(prefix='checkups'),
+        'lab_tests_formset': LabTestsFormSet(prefix='lab_tests'),
+        'treatment_formset': TreatmentPlanFormSet(prefix='treatments'),
+        'notes_formset': AdditionalNoteFormSet(prefix='notes'),
         'form_action': 'create',
         'page_title': 'Create New Patient Record'
     }
@@ -352,9 +815,10 @@ def create_complete_patient_form(request):
     return render(request, 'patient_form.html', context)
 
 
+@sharding.on_patient_shard
 def edit_complete_patient_form(request, patient_id):
     """View to edit complete patient record"""
-    patient = get_object_or_404(Patient, id=patient_id)
+    patient = get_object_or_404(Patient.objects, id=patient_id)
     
     if request.method == 'POST':
         return handle_patient_form_submission(request, patient)
@@ -369,6 +833,7 @@ def edit_complete_patient_form(request, patient_id):
     # Prepare initial data for formsets
     checkup_initial = [
         {
+            'id': checkup.id,
             'symptoms': checkup.symptoms,
             'current_diagnosis': checkup.current_diagnosis,
             'date_of_checkup': checkup.date_of_checkup,
@@ -384,6 +849,7 @@ def edit_complete_patient_form(request, patient_id):
     
     lab_initial = [
         {
+            'id': lab.id,
             'lab_results': lab.lab_results,
             'imaging': lab.imaging,
             'other_tests': lab.other_tests,
@@ -392,6 +858,7 @@ def edit_complete_patient_form(request, patient_id):
     
     treatment_initial = [
         {
+            'id': treatment.id,
             'related_disease': treatment.related_disease,
             'assigned_doctor': treatment.assigned_doctor,
             'prescribed_medications': treatment.prescribed_medications,
@@ -404,6 +871,7 @@ def edit_complete_patient_form(request, patient_id):
     
     notes_initial = [
         {
+            'id': note.id,
             'doctor_remarks': note.doctor_remarks,
             'special_warnings': note.special_warnings,
         } for note in notes
@@ -412,10 +880,10 @@ def edit_complete_patient_form(request, patient_id):
     context = {
         'patient_form': PatientForm(instance=patient),
         'medical_history_form': MedicalHistoryForm(instance=medical_history),
-        'checkup_formset': CheckUpFormSet(initial=checkup_initial),
-        'lab_tests_formset': LabTestsFormSet(initial=lab_initial),
-        'treatment_formset': TreatmentPlanFormSet(initial=treatment_initial),
-        'notes_formset': AdditionalNoteFormSet(initial=notes_initial),
+        'checkup_formset': CheckUpFormSet(prefix='checkups', initial=checkup_initial),
+        'lab_tests_formset': LabTestsFormSet(prefix='lab_tests', initial=lab_initial),
+        'treatment_formset': TreatmentPlanFormSet(prefix='treatments', initial=treatment_initial),
+        'notes_formset': AdditionalNoteFormSet(prefix='notes', initial=notes_initial),
         'patient': patient,
         'form_action': 'edit',
         'page_title': f'Edit Patient Record - {patient.patient_name}'
@@ -424,8 +892,8 @@ def edit_complete_patient_form(request, patient_id):
     return render(request, 'patient_form.html', context)
 
 
-def handle_patient_form_submission(request, patient=None):
-    """Handle form submission for both create and update"""
+def handle_patient_form_submission(request, patient=None, new_id=None):
+    """Handle form submission for both create and update, `new_id` is the id of a created patient"""
     is_edit = patient is not None
     
     # Initialize forms
@@ -433,10 +901,10 @@ def handle_patient_form_submission(request, patient=None):
     medical_history = patient.medical_history.first() if is_edit else None
     medical_history_form = MedicalHistoryForm(request.POST, instance=medical_history)
     
-    checkup_formset = CheckUpFormSet(request.POST)
-    lab_tests_formset = LabTestsFormSet(request.POST)
-    treatment_formset = TreatmentPlanFormSet(request.POST)
-    notes_formset = AdditionalNoteFormSet(request.POST)
+    checkup_formset = CheckUpFormSet(request.POST, prefix='checkups')
+    lab_tests_formset = LabTestsFormSet(request.POST, prefix='lab_tests')
+    treatment_formset = TreatmentPlanFormSet(request.POST, prefix='treatments')
+    notes_formset = AdditionalNoteFormSet(request.POST, prefix='notes')
     
     # Validate all forms
     forms_valid = (
@@ -450,58 +918,35 @@ def handle_patient_form_submission(request, patient=None):
     
     if forms_valid:
         try:
-            with transaction.atomic():
-                # Save patient
-                patient_instance = patient_form.save()
+            with sharding.atomic():
+                # Save patient (skipped on edit when nothing changed)
+                if is_edit and not patient_form.has_changed():
+                    patient_instance = patient_form.instance
+                else:
+                    if not is_edit:
+                        patient_form.instance.id = new_id
+                    patient_instance = patient_form.save()
                 
                 # Save medical history
-                if medical_history_form.cleaned_data:
+                if medical_history_form.cleaned_data and (not is_edit or medical_history_form.has_changed()):
                     medical_history_instance = medical_history_form.save(commit=False)
                     medical_history_instance.patient = patient_instance
                     medical_history_instance.save()
                 
-                # Clear existing related data if editing
-                if is_edit:
-                    patient_instance.checkups.all().delete()
-                    patient_instance.labtests.all().delete()
-                    patient_instance.treatments.all().delete()
-                    patient_instance.notes.all().delete()
+                # Apply each formset as a diff against the stored rows: changed rows
+                # are updated, new rows inserted in bulk and removed rows deleted
+                checkup_result = sync_formset_rows(CheckUp, patient_instance, checkup_formset, is_edit)
+                sync_formset_rows(LabTests, patient_instance, lab_tests_formset, is_edit)
+                sync_formset_rows(AdditionalNote, patient_instance, notes_formset, is_edit)
                 
-                saved_checkups = []
-                
-                # Save checkups
-                for checkup_form in checkup_formset:
-                    if checkup_form.cleaned_data and not checkup_form.cleaned_data.get('DELETE', False):
-                        checkup_instance = checkup_form.save(commit=False)
-                        checkup_instance.patient = patient_instance
-                        checkup_instance.save()
-                        saved_checkups.append(checkup_instance)
-                
-                # Save lab tests
-                for lab_form in lab_tests_formset:
-                    if lab_form.cleaned_data and not lab_form.cleaned_data.get('DELETE', False):
-                        lab_instance = lab_form.save(commit=False)
-                        lab_instance.patient = patient_instance
-                        lab_instance.save()
-                
-                # Save treatments
-                for treatment_form in treatment_formset:
-                    if treatment_form.cleaned_data and not treatment_form.cleaned_data.get('DELETE', False):
-                        treatment_instance = treatment_form.save(commit=False)
-                        treatment_instance.patient = patient_instance
-                        
-                        # Link to first checkup if available
-                        if saved_checkups:
-                            treatment_instance.checkup = saved_checkups[0]
-                        
-                        treatment_instance.save()
-                
-                # Save notes
-                for note_form in notes_formset:
-                    if note_form.cleaned_data and not note_form.cleaned_data.get('DELETE', False):
-                        note_instance = note_form.save(commit=False)
-                        note_instance.patient = patient_instance
-                        note_instance.save()
+                # New treatments link to the first submitted checkup if available
+                new_treatment_defaults = None
+                if checkup_result.rows:
+                    new_treatment_defaults = {'checkup': checkup_result.rows[0]}
+                sync_formset_rows(
+                    TreatmentPlan, patient_instance, treatment_formset, is_edit,
+                    new_defaults=new_treatment_defaults
+                )
                 
                 action = "updated" if is_edit else "created"
                 messages.success(
@@ -534,58 +979,115 @@ def handle_patient_form_submission(request, patient=None):
     return render(request, 'patient_form.html', context)
 
 
+def sync_formset_rows(model, patient, formset, is_edit, new_defaults=None):
+    """
+    Write a related formset for a patient by diffing it against stored rows.
+    Forms carry the id of the row they edit; rows missing from the submission
+    or marked DELETE are removed.
+    """
+    rows = []
+    delete_ids = []
+    for form in formset:
+        data = form.cleaned_data
+        if not data:
+            continue
+        if data.get('DELETE', False):
+            if data.get('id'):
+                delete_ids.append(data['id'])
+            continue
+        rows.append((data.get('id') if is_edit else None, data))
+
+    return sync_rows(
+        model, patient, rows,
+        fields=formset.form._meta.fields,
+        delete_ids=delete_ids,
+        delete_missing=is_edit,
+        new_defaults=new_defaults,
+    )
+
+
+def fragment_settings():
+    """Cache alias and timeout of the {% cache %} fragments of the patient pages"""
+    return {
+        'fragment_cache': getattr(settings, 'FRAGMENT_CACHE', 'default'),
+        'fragment_timeout': getattr(settings, 'FRAGMENT_CACHE_TIMEOUT', 300),
+    }
+
+
+@sharding.on_patient_shard
 def patient_detail(request, patient_id):
-    """View to display complete patient details"""
-    patient = get_object_or_404(Patient, id=patient_id)
-    medical_history = patient.medical_history.first()
-    checkups = patient.checkups.all().order_by('-date_of_checkup')
-    lab_tests = patient.labtests.all()
-    treatments = patient.treatments.all().order_by('-next_followup_date')
-    notes = patient.notes.all()
-    
+    """
+    View to display complete patient details. Every section is a fragment
+    cached under the patient version (with updated_at, in case ids are
+    reused after a database reset), so a page with nothing new costs one
+    query; the record is only read to render missing fragments.
+    """
+    version = Patient.objects.filter(pk=patient_id).values_list('version', 'updated_at').first()
+    if version is None:
+        raise Http404('No Patient matches the given query.')
+
+    def sections():
+        record = get_complete_record(patient_id)
+        return {
+            'patient': record['patient'],
+            'medical_history': record['medical_history'],
+            'checkups': with_dates(record['checkups'], 'date_of_checkup'),
+            'lab_tests': record['lab_tests'],
+            'treatments': with_dates(record['treatments'], 'next_followup_date'),
+            'notes': record['notes'],
+        }
+
     context = {
-        'patient': patient,
-        'medical_history': medical_history,
-        'checkups': checkups,
-        'lab_tests': lab_tests,
-        'treatments': treatments,
-        'notes': notes,
+        'patient_id': patient_id,
+        'version': version,
+        'record': SimpleLazyObject(sections),
+        **fragment_settings(),
     }
     
     return render(request, 'patient_detail.html', context)
 
 
+def with_dates(rows, *fields):
+    """Copy serialized rows with ISO date strings parsed back to dates for templates"""
+    return [
+        {**row, **{name: parse_date(row[name]) if row.get(name) else None for name in fields}}
+        for row in rows
+    ]
+
+
+# Not on the replica: the form views redirect here after a write
 def patient_list(request):
-    """View to list all patients"""
-    patients = Patient.objects.all().order_by('-id')
-    
-    # Add summary data for each patient
-    patient_data = []
-    for patient in patients:
-        patient_info = {
-            'patient': patient,
-            'checkups_count': patient.checkups.count(),
-            'lab_tests_count': patient.labtests.count(),
-            'treatments_count': patient.treatments.count(),
-            'last_checkup': patient.checkups.first(),
-        }
-        patient_data.append(patient_info)
-    
+    """
+    View to list patients a page at a time, newest first or searched by name
+    (?q=<start of the name>). Pages follow ?cursor=<next_cursor> links.
+    """
+    try:
+        query, cursor, limit = parse_list_params(request.GET)
+        patients, next_cursor = list_page(query, cursor, limit)
+    except ValueError as ve:
+        messages.error(request, str(ve))
+        query, cursor, limit = (request.GET.get('q') or '').strip(), None, LIST_PAGE_SIZE
+        patients, next_cursor = list_page(query, limit=limit)
+
     context = {
-        'patient_data': patient_data,
+        'patients': patients,
+        'query': query,
+        'cursor': cursor,
+        'next_cursor': next_cursor,
+        **fragment_settings(),
     }
     
     return render(request, 'patient_list.html', context)
 
 
+@sharding.on_patient_shard
 def delete_patient(request, patient_id):
     """View to delete a patient"""
-    patient = get_object_or_404(Patient, id=patient_id)
+    patient = get_object_or_404(Patient.objects, id=patient_id)
     
     if request.method == 'POST':
-        patient_name = patient.patient_name
-        patient.delete()
-        messages.success(request, f'Patient record for {patient_name} has been deleted.')
+        purge.soft_delete(patient)
+        messages.success(request, f'Patient record for {patient.patient_name} has been deleted.')
         return redirect('patient_list')
     
     return render(request, 'patient_confirm_delete.html', {'patient': patient})
\ No newline at end of file
@@ -0,0 +1,228 @@
+"""
+Numeric vital signs
+
+Checkup vitals are stored as the free text the clinician typed ("120/80",
+"98.6 F", "70 kg", "5'9\""). parse() turns them into numbers in fixed units,
+which CheckUp keeps in indexed shadow columns (systolic_bp, diastolic_bp,
+heart_rate_bpm, temperature_c, weight_kg, height_cm, bmi_value) filled on
+every write, so analytics and range filters read numbers from the indexes
+instead of parsing text row by row.
+
+Values that cannot be parsed, or fall outside plausible ranges, are stored as
+NULL. The backfill_vitals management command refills the columns of rows
+written before they existed.
+"""
+import re
+
+
+# Text field -> shadow columns it fills
+SOURCE_FIELDS = {
+    'blood_pressure': ('systolic_bp', 'diastolic_bp'),
+    'heart_rate': ('heart_rate_bpm',),
+    'temperature': ('temperature_c',),
+    'weight': ('weight_kg',),
+    'height': ('height_cm',),
+    'bmi': ('bmi_value',),
+}
+SHADOW_FIELDS = ('systolic_bp', 'diastolic_bp', 'heart_rate_bpm', 'temperature_c', 'weight_kg', 'height_cm', 'bmi_value')
+
+# Plausible range of every column, values outside are treated as typos
+LIMITS = {
+    'systolic_bp': (50, 300),
+    'diastolic_bp': (20, 200),
+    'heart_rate_bpm': (20, 300),
+    'temperature_c': (25.0, 45.0),
+    'weight_kg': (0.5, 500.0),
+    'height_cm': (30.0, 280.0),
+    'bmi_value': (5.0, 150.0),
+}
+
+# Range filter parameter -> shadow column, as ?<name>_min=&<name>_max=
+RANGE_FILTERS = {
+    'systolic': 'systolic_bp',
+    'diastolic': 'diastolic_bp',
+    'heart_rate': 'heart_rate_bpm',
+    'temperature': 'temperature_c',
+    'weight': 'weight_kg',
+    'height': 'height_cm',
+    'bmi': 'bmi_value',
+}
+
+_NUMBER = r'(\d+(?:[.,]\d+)?)'
+_BLOOD_PRESSURE = re.compile(r'(\d{2,3})\s*(?:/|\\|over)\s*(\d{2,3})', re.IGNORECASE)
+_VALUE_UNIT = re.compile(_NUMBER + r'\s*(°|º|deg(?:rees?)?)?\s*([a-z]*)', re.IGNORECASE)
+_FEET_INCHES = re.compile(
+    r'(\d+)\s*(?:\'|’|ft|feet|foot)\s*(?:(\d+(?:\.\d+)?)\s*(?:"|”|\'\'|in|inch|inches)?)?', re.IGNORECASE
+)
+
+POUNDS_TO_KG = 0.45359237
+INCHES_TO_CM = 2.54
+
+
+def _number(text):
+    return float(text.replace(',', '.'))
+
+
+def _value_and_unit(text):
+    """First number of `text` and the word following it, lower case"""
+    match = _VALUE_UNIT.search(text)
+    if match is None:
+        return None, ''
+    return _number(match.group(1)), match.group(3).lower()
+
+
+def _within(column, value):
+    if value is None:
+        return None
+    low, high = LIMITS[column]
+    return value if low <= value <= high else None
+
+
+def parse_blood_pressure(text):
+    """(systolic, diastolic) in mmHg from "120/80", "120 / 80 mmHg", "120 over 80" """
+    match = _BLOOD_PRESSURE.search(text or '')
+    if match is None:
+        return None, None
+    systolic = _within('systolic_bp', int(match.group(1)))
+    diastolic = _within('diastolic_bp', int(match.group(2)))
+    if systolic is None or diastolic is None or diastolic >= systolic:
+        return None, None
+    return systolic, diastolic
+
+
+def parse_heart_rate(text):
+    """Beats per minute from "72", "72 bpm", "72 beats/min" """
+    value, _ = _value_and_unit(text or '')
+    return _within('heart_rate_bpm', None if value is None else round(value))
+
+
+def parse_temperature(text):
+    """
+    Degrees Celsius from "37", "37.2 C", "98.6 F", "98.6°F". Without a unit
+    values above 45 are read as Fahrenheit.
+    """
+    value, unit = _value_and_unit(text or '')
+    if value is None:
+        return None
+    if unit.startswith('f') or (not unit.startswith('c') and value > LIMITS['temperature_c'][1]):
+        value = (value - 32) * 5 / 9
+    return _within('temperature_c', round(value, 1))
+
+
+def parse_weight(text):
+    """Kilograms from "70", "70 kg", "154 lb", "154 lbs", "154 pounds" """
+    value, unit = _value_and_unit(text or '')
+    if value is None:
+        return None
+    if unit.startswith(('lb', 'pound')):
+        value *= POUNDS_TO_KG
+    elif unit.startswith('g') or unit == 'grams':
+        value /= 1000
+    return _within('weight_kg', round(value, 1))
+
+
+def parse_height(text):
+    """
+    Centimetres from "175", "175 cm", "1.75 m", "69 in", "5'9\"", "5 ft 9 in".
+    Without a unit values below 3 are read as metres.
+    """
+    text = text or ''
+    feet = _FEET_INCHES.search(text)
+    if feet is not None:
+        value = (int(feet.group(1)) * 12 + float(feet.group(2) or 0)) * INCHES_TO_CM
+        return _within('height_cm', round(value, 1))
+
+    value, unit = _value_and_unit(text)
+    if value is None:
+        return None
+    if unit.startswith('in'):
+        value *= INCHES_TO_CM
+    elif unit == 'mm':
+        value /= 10
+    elif unit in ('m', 'meter', 'meters', 'metre', 'metres') or (not unit and value < 3):
+        value *= 100
+    return _within('height_cm', round(value, 1))
+
+
+def parse_bmi(text):
+    value, _ = _value_and_unit(text or '')
+    return _within('bmi_value', None if value is None else round(value, 1))
+
+
+def bmi(weight_kg, height_cm):
+    """BMI from weight and height, None when either is missing"""
+    if not weight_kg or not height_cm:
+        return None
+    return _within('bmi_value', round(weight_kg / (height_cm / 100) ** 2, 1))
+
+
+def parse(values):
+    """
+    Shadow column values from a mapping of the text fields. A missing BMI is
+    computed from the weight and height.
+    """
+    systolic, diastolic = parse_blood_pressure(values.get('blood_pressure'))
+    parsed = {
+        'systolic_bp': systolic,
+        'diastolic_bp': diastolic,
+        'heart_rate_bpm': parse_heart_rate(values.get('heart_rate')),
+        'temperature_c': parse_temperature(values.get('temperature')),
+        'weight_kg': parse_weight(values.get('weight')),
+        'height_cm': parse_height(values.get('height')),
+        'bmi_value': parse_bmi(values.get('bmi')),
+    }
+    if parsed['bmi_value'] is None:
+        parsed['bmi_value'] = bmi(parsed['weight_kg'], parsed['height_cm'])
+    return parsed
+
+
+def fill(checkup):
+    """Set the shadow columns of a CheckUp instance from its text fields, True when any changed"""
+    parsed = parse({field: getattr(checkup, field) for field in SOURCE_FIELDS})
+    changed = False
+    for column, value in parsed.items():
+        if getattr(checkup, column) != value:
+            setattr(checkup, column, value)
+            changed = True
+    return changed
+
+
+def parse_range_filters(params):
+    """
+    Queryset lookups on the shadow columns from ?<name>_min= and ?<name>_max=
+    query parameters (names in RANGE_FILTERS), e.g. {'systolic_bp__gte': 140.0}.
+    Raises ValueError with a readable message on bad input.
+    """
+    lookups = {}
+    for name, column in RANGE_FILTERS.items():
+        for suffix, lookup in (('min', 'gte'), ('max', 'lte')):
+            raw = params.get(f'{name}_{suffix}')
+            if raw in (None, ''):
+                continue
+            try:
+                lookups[f'{column}__{lookup}'] = float(raw)
+            except ValueError:
+                raise ValueError(f"'{name}_{suffix}' must be a number.")
+    return lookups
+
+
+def backfill(model, batch_size=1000):
+    """
+    Refill the shadow columns of every `model` (CheckUp) row, in batches by id.
+    Only rows whose values differ are written. Takes the model class so
+    migrations can pass their historical model. Returns (rows read, rows updated).
+    """
+    rows = model.objects.order_by('pk').only(*SOURCE_FIELDS, *SHADOW_FIELDS)
+    read = updated = 0
+    last_id = 0
+    while True:
+        batch = list(rows.filter(pk__gt=last_id)[:batch_size])
+        if not batch:
+            break
+        changed = [row for row in batch if fill(row)]
+        if changed:
+            model.objects.bulk_update(changed, SHADOW_FIELDS)
+        read += len(batch)
+        updated += len(changed)
+        last_id = batch[-1].pk
+    return read, updated